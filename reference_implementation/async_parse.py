@@ -0,0 +1,97 @@
+# Parsing Demes models from asyncio code.
+#
+# parse() is CPU bound, and for large models it can take long enough to stall
+# an event loop. The AsyncParser runs parse() in an executor, so that the event
+# loop remains responsive, and limits the number of models being parsed at
+# once, so that a few very large models cannot occupy all of the workers.
+from __future__ import annotations
+
+import asyncio
+import concurrent.futures
+
+import demes_parser as parser
+
+
+class AsyncParser:
+    """
+    Parses models in an executor, with at most ``max_concurrency`` models
+    being parsed at any one time.
+
+    By default a thread pool is used. A ``concurrent.futures.ProcessPoolExecutor``
+    may be passed as the executor instead, in which case parsing doesn't compete
+    with the event loop for the GIL (but the resolved Graph is pickled in order
+    to return it). An executor that is passed in is not shut down by close().
+    """
+
+    def __init__(self, max_concurrency: int = 4, executor=None):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self._owns_executor = executor is None
+        if executor is None:
+            executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_concurrency, thread_name_prefix="demes_parser"
+            )
+        self._executor = executor
+        self._max_concurrency = max_concurrency
+        self._semaphore = None
+
+    async def parse(self, data: dict) -> parser.Graph:
+        """
+        Parse the data in the executor, and return the resolved Graph.
+
+        If the calling task is cancelled (e.g., by asyncio.wait_for() timing
+        out) while waiting for a free slot, the model is never parsed. If it is
+        cancelled while the model is being parsed, CancelledError is raised
+        immediately, but the slot is only released once the worker finishes,
+        so cancelled work still counts towards the concurrency limit.
+        """
+        if self._semaphore is None:
+            # Created lazily, so that it belongs to the running event loop.
+            self._semaphore = asyncio.Semaphore(self._max_concurrency)
+        semaphore = self._semaphore
+        await semaphore.acquire()
+        loop = asyncio.get_running_loop()
+        try:
+            job = self._executor.submit(parser.parse, data)
+        except BaseException:
+            semaphore.release()
+            raise
+        # The slot is released when the worker finishes, rather than when the
+        # asyncio future is done, as the latter is cancelled straight away.
+        job.add_done_callback(lambda _: _release(loop, semaphore))
+        future = asyncio.wrap_future(job)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # Drop the job if it hasn't started yet. Otherwise the result,
+            # or exception, is discarded when the worker finishes.
+            job.cancel()
+            future.add_done_callback(_consume_result)
+            raise
+
+    def close(self):
+        if self._owns_executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        self.close()
+
+
+def _release(loop, semaphore):
+    # Called from the worker thread, or from the event loop's thread if the job
+    # is cancelled before it starts.
+    try:
+        loop.call_soon_threadsafe(semaphore.release)
+    except RuntimeError:
+        # The event loop has been closed, so nothing is waiting for the slot.
+        pass
+
+
+def _consume_result(future):
+    # Retrieve the exception from an abandoned future, so that asyncio
+    # doesn't log it as never having been retrieved.
+    if not future.cancelled():
+        future.exception()
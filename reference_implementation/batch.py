@@ -0,0 +1,261 @@
+# Vectorised evaluation of a Template for many parameter vectors at once.
+#
+# Prior-sampling pipelines (e.g. for ABC) draw many parameter vectors and
+# reject those that don't give a valid graph. Template.evaluate() does this
+# for one vector at a time; here the same operations and checks are evaluated
+# with NumPy over a whole (n_samples x n_params) array, one column of slot
+# values at a time. The results are identical to evaluating each row with
+# Template.evaluate(): a sample is valid if and only if evaluate() wouldn't
+# raise, and the reason for an invalid sample is the message of the first
+# check that fails, which is the message that evaluate() would raise.
+from __future__ import annotations
+
+import dataclasses
+from typing import List, Tuple, Union
+
+import numpy as np
+
+import demes_parser as parser
+import templates
+
+
+def sequential_sum(columns):
+    # Sum the columns from left to right, as the built-in sum() does, so that
+    # the rounding is the same as for the non-vectorised checks.
+    total = np.zeros(columns.shape[0])
+    for j in range(columns.shape[1]):
+        total = total + columns[:, j]
+    return total
+
+
+def is_proportion(values):
+    return (0 < values) & (values <= 1)
+
+
+# Vectorised versions of the validators in demes_parser. The scalar
+# validators take a column of values, and the list validators take a 2D
+# array with a column for each list item.
+VALIDATORS = {
+    parser.is_positive_or_json_infinity: lambda values: values > 0,
+    parser.is_positive_and_finite: lambda values: (values > 0) & ~np.isinf(values),
+    parser.is_non_negative_and_finite: lambda values: (
+        (values >= 0) & ~np.isinf(values)
+    ),
+    parser.is_rate: lambda values: (0 <= values) & (values <= 1),
+    parser.is_proportion: is_proportion,
+    parser.is_list_of_proportions: lambda columns: np.all(
+        is_proportion(columns), axis=1
+    ),
+    parser.is_nonempty_list_of_proportions_with_sum_less_than_1: lambda columns: (
+        np.all(is_proportion(columns), axis=1)
+        & (columns.shape[1] > 0)
+        & (sequential_sum(columns) <= 1)
+    ),
+}
+
+
+def ingress_ok(values, migrations):
+    # As templates.ingress_ok(), for all samples at once.
+    ok = np.ones(values.shape[0], dtype=bool)
+    for _, end, _ in migrations:
+        time = values[:, end]
+        rate = np.zeros(values.shape[0])
+        for start_b, end_b, rate_b in migrations:
+            overlaps = (values[:, start_b] > time) & (time >= values[:, end_b])
+            rate = rate + np.where(overlaps, values[:, rate_b], 0)
+        ok &= ~(rate > 1 + parser.EPSILON)
+    return ok
+
+
+def sum_close_to_1(values, slots):
+    # math.isclose() with the default relative tolerance.
+    total = sequential_sum(values[:, slots])
+    return np.abs(total - 1) <= 1e-9 * np.maximum(np.abs(total), 1)
+
+
+# Vectorised versions of templates.OPERATIONS and templates.CHECKS. The values
+# are a (n_samples x n_slots) array.
+OPERATIONS = {
+    "min": lambda values, a, b: np.minimum(values[:, a], values[:, b]),
+    "max": lambda values, a, b: np.maximum(values[:, a], values[:, b]),
+}
+
+CHECKS = {
+    "valid": lambda values, a, validator: VALIDATORS[validator](values[:, a]),
+    "valid_list": lambda values, slots, validator: VALIDATORS[validator](
+        values[:, slots]
+    ),
+    "greater": lambda values, a, b: values[:, a] > values[:, b],
+    "equal": lambda values, a, b: values[:, a] == values[:, b],
+    "equal_to": lambda values, a, constant: values[:, a] == constant,
+    "infinite": lambda values, a: np.isinf(values[:, a]),
+    "finite_or_equal": lambda values, t, a, b: (
+        (values[:, t] != np.inf) | (values[:, a] == values[:, b])
+    ),
+    "in_interval": lambda values, t, start, end: (
+        (values[:, start] > values[:, t]) & (values[:, t] >= values[:, end])
+    ),
+    "in_dest_interval": lambda values, t, start, end: (
+        (values[:, start] >= values[:, t]) & (values[:, t] > values[:, end])
+    ),
+    "subinterval": lambda values, start, end, outer_start, outer_end: (
+        (values[:, start] <= values[:, outer_start])
+        & (values[:, end] >= values[:, outer_end])
+    ),
+    "disjoint": lambda values, start_a, end_a, start_b, end_b: (
+        (values[:, end_a] >= values[:, start_b])
+        | (values[:, end_b] >= values[:, start_a])
+    ),
+    "sum_at_most_1": lambda values, slots: (
+        sequential_sum(values[:, slots]) <= 1 + parser.EPSILON
+    ),
+    "sum_close_to_1": sum_close_to_1,
+    "ingress": ingress_ok,
+}
+
+
+@dataclasses.dataclass
+class BatchResult:
+    """
+    The resolved values for a batch of parameter vectors.
+
+    The arrays have a row for each sample. Rows for invalid samples contain
+    whatever values the operations produced, and should be ignored.
+    """
+
+    # True for the samples that give a valid graph.
+    valid: np.ndarray
+    # The index (into ``messages``) of the first check that failed for each
+    # sample, or -1 for valid samples.
+    failed_check: np.ndarray
+    # The error message for each of the template's checks.
+    messages: List[str]
+    # The (n_samples x n_slots) array of all of the slot values.
+    slots: np.ndarray
+    # (deme name, epoch index) for each column of the epoch arrays.
+    epochs: List[Tuple[str, int]]
+    epoch_start_time: np.ndarray
+    epoch_end_time: np.ndarray
+    epoch_start_size: np.ndarray
+    epoch_end_size: np.ndarray
+    # The columns of the migration arrays are in the order of the template's
+    # (expanded) migrations.
+    migration_rate: np.ndarray
+    migration_start_time: np.ndarray
+    migration_end_time: np.ndarray
+    # The columns of the pulse arrays are in the order of the template's
+    # pulses. The proportions are a (n_samples x n_pulses x max_sources) array,
+    # padded with zeros for pulses with fewer sources. As the pulse times may
+    # vary, pulse_order gives the indexes of the pulses for each sample, in
+    # the order that they appear in the resolved graph.
+    pulse_time: np.ndarray
+    pulse_proportions: np.ndarray
+    pulse_order: np.ndarray
+
+    def reasons(self) -> List[Union[str, None]]:
+        """
+        Return the error message for each sample, or None for valid samples.
+        """
+        return [None if j < 0 else self.messages[j] for j in self.failed_check]
+
+
+class BatchTemplate:
+    """
+    Evaluates a Template's operations and checks for many parameter vectors
+    at once.
+    """
+
+    def __init__(self, template: templates.Template):
+        self.template = template
+        self.parameters = template.parameters
+        self._static = np.array(
+            [template.is_static(slot) for slot in range(template.num_slots)],
+            dtype=bool,
+        )
+        self._initial_values = np.array(
+            [value for value in template.initial_values if value is not None],
+            dtype=float,
+        )
+        self._parameter_slots = np.array(
+            [slot for slot, _ in template.parameter_slots], dtype=int
+        )
+        self._parameter_columns = np.array(
+            [parameter for _, parameter in template.parameter_slots], dtype=int
+        )
+        self._operations = [
+            (OPERATIONS[name], dest, args) for name, dest, args in template.operations
+        ]
+        self._checks = [(CHECKS[name], args) for name, args, _ in template.checks]
+        self._messages = [message for _, _, message in template.checks]
+
+        self._epochs = []
+        epoch_slots = []
+        for deme in template.demes:
+            start_time = deme.start_time
+            for j, epoch in enumerate(deme.epochs):
+                self._epochs.append((deme.name, j))
+                epoch_slots.append(
+                    (start_time, epoch.end_time, epoch.start_size, epoch.end_size)
+                )
+                start_time = epoch.end_time
+        self._epoch_slots = np.array(epoch_slots, dtype=int).reshape(-1, 4)
+        self._migration_slots = np.array(
+            [(m.rate, m.start_time, m.end_time) for m in template.migrations],
+            dtype=int,
+        ).reshape(-1, 3)
+        self._pulse_time_slots = np.array(
+            [pulse.time for pulse in template.pulses], dtype=int
+        )
+        max_sources = max((len(p.proportions) for p in template.pulses), default=0)
+        # Padding refers to an extra slot that holds zero.
+        self._pulse_proportion_slots = np.full(
+            (len(template.pulses), max_sources), template.num_slots, dtype=int
+        )
+        for j, pulse in enumerate(template.pulses):
+            self._pulse_proportion_slots[j, : len(pulse.proportions)] = (
+                pulse.proportions
+            )
+
+    def evaluate(self, values) -> BatchResult:
+        """
+        Evaluate the (n_samples x n_params) array of parameter values. The
+        columns are in the order of the template's ``parameters``.
+        """
+        values = np.asarray(values, dtype=float)
+        if values.ndim != 2 or values.shape[1] != len(self.parameters):
+            raise ValueError(
+                f"Expected an array of shape (n_samples, {len(self.parameters)}), "
+                f"got {values.shape}"
+            )
+        num_samples = values.shape[0]
+        # The extra column is for padding the pulse proportions.
+        slots = np.zeros((num_samples, self.template.num_slots + 1))
+        slots[:, :-1][:, self._static] = self._initial_values
+        slots[:, self._parameter_slots] = values[:, self._parameter_columns]
+        failed_check = np.full(num_samples, -1)
+        # Comparisons with NaN and the like are dealt with by the checks.
+        with np.errstate(invalid="ignore", over="ignore"):
+            for operation, dest, args in self._operations:
+                slots[:, dest] = operation(slots, *args)
+            for j, (check, args) in enumerate(self._checks):
+                failed = ~check(slots, *args) & (failed_check < 0)
+                failed_check[failed] = j
+        pulse_time = slots[:, self._pulse_time_slots]
+        return BatchResult(
+            valid=failed_check < 0,
+            failed_check=failed_check,
+            messages=self._messages,
+            slots=slots[:, :-1],
+            epochs=self._epochs,
+            epoch_start_time=slots[:, self._epoch_slots[:, 0]],
+            epoch_end_time=slots[:, self._epoch_slots[:, 1]],
+            epoch_start_size=slots[:, self._epoch_slots[:, 2]],
+            epoch_end_size=slots[:, self._epoch_slots[:, 3]],
+            migration_rate=slots[:, self._migration_slots[:, 0]],
+            migration_start_time=slots[:, self._migration_slots[:, 1]],
+            migration_end_time=slots[:, self._migration_slots[:, 2]],
+            pulse_time=pulse_time,
+            pulse_proportions=slots[:, self._pulse_proportion_slots],
+            # A stable sort, as in Graph.resolve().
+            pulse_order=np.argsort(-pulse_time, axis=1, kind="stable"),
+        )
@@ -0,0 +1,245 @@
+# Measure the memory allocated by each phase of parse().
+#
+# parse() deep-copies the input data, decodes it into the object model (which
+# includes expanding symmetric migrations into pairs of asymmetric
+# migrations), resolves and validates the model. We additionally measure
+# as_json_dict(), which is used to output the resolved model, and
+# flyweight.share_epochs(), whose retained bytes are negative, as it frees
+# the epochs that are duplicated between demes. Each phase is
+# run with tracemalloc enabled, and we report the peak and retained bytes for
+# the phase, relative to the memory in use at the start of the phase. The
+# bytes retained by the expansion of symmetric migrations are those allocated
+# within Graph.add_migration() during decoding.
+#
+# Usage: python bench_memory.py [--json] [FILE ...] [--sizes N ...]
+#
+# By default, island models and stepping stone grids with a range of numbers
+# of demes, and single-deme models with the same range of numbers of epochs,
+# are measured, along with all of the examples. The bytes per deme, epoch,
+# etc. are the bytes retained by the resolved graph that were allocated by the
+# function that adds that kind of entity to the graph.
+import argparse
+import copy
+import dataclasses
+import gc
+import inspect
+import json
+import math
+import pathlib
+import tracemalloc
+
+from ruamel.yaml import YAML
+
+import demes_parser as parser
+import flyweight
+
+HERE = pathlib.Path(__file__).parent
+DEFAULT_FILES = sorted((HERE.parent / "examples").glob("*.yaml"))
+DEFAULT_SIZES = [10, 50, 100, 200]
+
+
+def island_model(num_demes):
+    return {
+        "time_units": "generations",
+        "defaults": {"epoch": {"start_size": 1000}},
+        "demes": [{"name": f"deme{j}"} for j in range(num_demes)],
+        "migrations": [{"demes": [f"deme{j}" for j in range(num_demes)], "rate": 1e-5}],
+    }
+
+
+def grid_model(num_demes):
+    # A two-dimensional stepping stone model, with migration between adjacent
+    # demes in rows of (about) sqrt(num_demes) demes. Each deme has the same
+    # bottleneck and expansion.
+    width = math.isqrt(num_demes)
+    names = [f"deme{j}" for j in range(num_demes)]
+    migrations = []
+    for j in range(num_demes):
+        if j % width + 1 < width and j + 1 < num_demes:
+            migrations.append({"demes": [names[j], names[j + 1]]})
+        if j + width < num_demes:
+            migrations.append({"demes": [names[j], names[j + width]]})
+    return {
+        "time_units": "generations",
+        "defaults": {"migration": {"rate": 1e-5}},
+        "demes": [
+            {
+                "name": name,
+                "epochs": [
+                    {"start_size": 10000, "end_time": 1000},
+                    {"start_size": 100, "end_time": 500},
+                    {"end_size": 10000},
+                ],
+            }
+            for name in names
+        ],
+        "migrations": migrations,
+    }
+
+
+def many_epochs_model(num_epochs):
+    return {
+        "time_units": "generations",
+        "demes": [
+            {
+                "name": "deme0",
+                "epochs": [
+                    {"start_size": 1000 + j, "end_time": num_epochs - j - 1}
+                    for j in range(num_epochs)
+                ],
+            }
+        ],
+    }
+
+
+# The functions that create each kind of entity.
+ENTITY_FUNCTIONS = {
+    "demes": parser.Graph.add_deme,
+    "epochs": parser.Deme.add_epoch,
+    "migrations": parser.Graph.add_migration,
+    "pulses": parser.Graph.add_pulse,
+}
+
+
+def function_lines(function):
+    lines, first_line = inspect.getsourcelines(function)
+    return range(first_line, first_line + len(lines))
+
+
+def allocated_by(statistics, function):
+    """
+    Return the bytes in the snapshot comparison statistics that were
+    allocated (directly or indirectly) by the function.
+    """
+    lines = function_lines(function)
+    total = 0
+    for stat in statistics:
+        if stat.size_diff > 0 and any(
+            frame.filename == parser.__file__ and frame.lineno in lines
+            for frame in stat.traceback
+        ):
+            total += stat.size_diff
+    return total
+
+
+def measure(func):
+    tracemalloc.reset_peak()
+    before, _ = tracemalloc.get_traced_memory()
+    result = func()
+    after, peak = tracemalloc.get_traced_memory()
+    return result, {"peak": peak - before, "retained": after - before}
+
+
+def share_epochs(graph):
+    stats = flyweight.share_epochs(graph)
+    # The epochs' keys are tuples, which are kept in CPython's free lists for
+    # reuse once they're freed. A full collection clears the free lists, so
+    # that only the memory retained by the graph is measured.
+    gc.collect()
+    return stats
+
+
+def benchmark(name, data):
+    """
+    Return the memory used by each phase of parsing the data.
+    """
+    tracemalloc.start(25)
+    try:
+        phases = {}
+        data_copy, phases["deepcopy"] = measure(lambda: copy.deepcopy(data))
+        start = tracemalloc.take_snapshot()
+        graph, phases["decode"] = measure(lambda: parser.build(data_copy))
+        decoded = tracemalloc.take_snapshot()
+        _, phases["resolve"] = measure(graph.resolve)
+        _, phases["validate"] = measure(graph.validate)
+        end = tracemalloc.take_snapshot()
+        _, phases["as_json_dict"] = measure(graph.as_json_dict)
+        # Collect any garbage from the earlier phases first, as share_epochs()
+        # does a full collection, which would otherwise be counted.
+        gc.collect()
+        sharing, phases["share_epochs"] = measure(lambda: share_epochs(graph))
+    finally:
+        tracemalloc.stop()
+    # Symmetric migrations are expanded by Graph.add_migration() while
+    # decoding, so the expansion can't be measured as a separate phase.
+    phases["migration_expansion"] = {
+        "peak": None,
+        "retained": allocated_by(
+            decoded.compare_to(start, "traceback"), parser.Graph.add_migration
+        ),
+    }
+    statistics = end.compare_to(start, "traceback")
+    entity_bytes = {
+        kind: allocated_by(statistics, function)
+        for kind, function in ENTITY_FUNCTIONS.items()
+    }
+
+    counts = {
+        "demes": len(graph.demes),
+        "epochs": sum(len(deme.epochs) for deme in graph.demes.values()),
+        "migrations": len(graph.migrations),
+        "pulses": len(graph.pulses),
+    }
+    return {
+        "name": name,
+        "counts": counts,
+        "phases": phases,
+        "bytes": entity_bytes,
+        "sharing": dataclasses.asdict(sharing),
+        "bytes_per": {
+            kind: entity_bytes[kind] / count
+            for kind, count in counts.items()
+            if count > 0
+        },
+    }
+
+
+def main(args=None):
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    argparser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="*",
+        default=DEFAULT_SIZES,
+        help="The numbers of demes or epochs in the synthetic models.",
+    )
+    argparser.add_argument(
+        "--json", action="store_true", help="Write the results as JSON."
+    )
+    args = argparser.parse_args(args)
+
+    models = []
+    for size in args.sizes:
+        models.append((f"island_model({size})", island_model(size)))
+        models.append((f"grid_model({size})", grid_model(size)))
+        models.append((f"many_epochs_model({size})", many_epochs_model(size)))
+    yaml = YAML(typ="safe")
+    for path in args.files:
+        with open(path, encoding="utf-8") as source:
+            models.append((str(path), yaml.load(source)))
+
+    results = [benchmark(name, data) for name, data in models]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(result["name"])
+        print("  " + ", ".join(f"{k}={v}" for k, v in result["counts"].items()))
+        for phase, usage in result["phases"].items():
+            peak = "" if usage["peak"] is None else f"peak {usage['peak']:>12,}"
+            print(f"  {phase:<20} retained {usage['retained']:>12,}  {peak}")
+        print(
+            "  bytes per "
+            + ", ".join(f"{k}: {v:,.0f}" for k, v in result["bytes_per"].items())
+        )
+        sharing = result["sharing"]
+        print(
+            f"  shared {sharing['epochs']} epochs as {sharing['unique_epochs']} "
+            f"unique epochs in {sharing['unique_sequences']} sequences, "
+            f"saving {-result['phases']['share_epochs']['retained']:,} bytes"
+        )
+
+
+if __name__ == "__main__":
+    main()
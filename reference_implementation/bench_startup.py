@@ -0,0 +1,102 @@
+# Measure the cold start cost of resolve_yaml.py.
+#
+# For each input file, resolve_yaml.py is run repeatedly in a fresh
+# interpreter with ``python -X importtime``. We report the median wall clock
+# time of the whole process, the total time spent importing modules, and the
+# modules with the largest cumulative import times.
+#
+# Usage: python bench_startup.py [--repeats N] [--json] [FILE ...]
+#
+# By default, the zigzag example is used, both as YAML input and as (resolved)
+# JSON input.
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = pathlib.Path(__file__).parent
+DEFAULT_FILES = [
+    HERE.parent / "examples" / "zigzag.resolved.json",
+    HERE.parent / "examples" / "zigzag.yaml",
+]
+
+
+def parse_importtime(stderr):
+    """
+    Return a dict mapping top-level module names to their cumulative import
+    time, in microseconds, from the output of ``python -X importtime``.
+    """
+    imports = {}
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        _, cumulative_us, name = line[len("import time:") :].split("|")
+        if not cumulative_us.strip().isdigit():
+            # The header line.
+            continue
+        # Nested imports are indented beneath the module that imported them.
+        name = name[1:]
+        if not name.startswith(" "):
+            imports[name] = int(cumulative_us)
+    return imports
+
+
+def run_once(path):
+    command = [sys.executable, "-X", "importtime", str(HERE / "resolve_yaml.py")]
+    before = time.perf_counter()
+    result = subprocess.run(
+        command + [str(path)], capture_output=True, text=True, check=True
+    )
+    wall_time = time.perf_counter() - before
+    return wall_time, parse_importtime(result.stderr)
+
+
+def benchmark(path, repeats):
+    wall_times = []
+    import_times = {}
+    for _ in range(repeats):
+        wall_time, imports = run_once(path)
+        wall_times.append(wall_time)
+        for name, us in imports.items():
+            import_times.setdefault(name, []).append(us)
+    import_medians = {
+        name: statistics.median(times) for name, times in import_times.items()
+    }
+    return {
+        "file": str(path),
+        "repeats": repeats,
+        "wall_time_s": statistics.median(wall_times),
+        "import_time_s": sum(import_medians.values()) / 1e6,
+        "imports_us": dict(
+            sorted(import_medians.items(), key=lambda item: item[1], reverse=True)
+        ),
+    }
+
+
+def main(args=None):
+    argparser = argparse.ArgumentParser()
+    argparser.add_argument("files", nargs="*", default=DEFAULT_FILES)
+    argparser.add_argument("--repeats", type=int, default=10)
+    argparser.add_argument("--top", type=int, default=5)
+    argparser.add_argument(
+        "--json", action="store_true", help="Write the results as JSON."
+    )
+    args = argparser.parse_args(args)
+
+    results = [benchmark(path, args.repeats) for path in args.files]
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    for result in results:
+        print(result["file"])
+        print(f"  wall time:   {result['wall_time_s'] * 1e3:8.1f} ms")
+        print(f"  import time: {result['import_time_s'] * 1e3:8.1f} ms")
+        for name, us in list(result["imports_us"].items())[: args.top]:
+            print(f"    {name:<30} {us / 1e3:8.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
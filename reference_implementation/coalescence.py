@@ -0,0 +1,310 @@
+# Closed-form integrals of 1/N(t) over the size history of a deme.
+#
+# Coalescent time rescaling, expected coalescence times and the harmonic-mean
+# effective size over a window all depend on integrals of the reciprocal of a
+# deme's size, 1/N(t). The size functions in the specification have
+# closed-form integrals, which are evaluated here with NumPy for arrays of
+# times, without numerical quadrature.
+#
+# Times are backwards in time, in the graph's time units, as elsewhere in the
+# parser. Within an epoch with end time e and length L = start_time - e, let
+# u = t - e be the time since the end of the epoch. With N1 the epoch's
+# end_size and N0 its start_size, the sizes are
+#
+#   constant:     N(u) = N1
+#   exponential:  N(u) = N1 * exp(-g * u),  with g = log(N1 / N0) / L
+#   linear:       N(u) = N1 + c * u,        with c = (N0 - N1) / L
+#
+# and the integrals of 1/N from the end of the epoch are
+#
+#   constant:     u / N1
+#   exponential:  expm1(g * u) / (g * N1)
+#   linear:       log1p(c * u / N1) / c
+#
+# which are inverted in closed form too.
+from __future__ import annotations
+
+from typing import Dict
+
+import numpy as np
+
+import demes_parser as parser
+
+EULER_GAMMA = 0.5772156649015329
+
+
+def scaled_e1(x):
+    """
+    Return exp(x) * E1(x) for an array of x > 0, where E1 is the exponential
+    integral.
+    """
+    x = np.asarray(x, dtype=float)
+    result = np.empty_like(x)
+    small = x <= 1
+    # The power series for small x.
+    xs = x[small]
+    total = -EULER_GAMMA - np.log(xs)
+    term = np.ones_like(xs)
+    for k in range(1, 30):
+        term = term * -xs / k
+        total = total - term / k
+    result[small] = np.exp(xs) * total
+    # The continued fraction for larger x, evaluated from the tail upwards.
+    xl = x[~small]
+    tail = xl + 201
+    for n in range(100, 0, -1):
+        tail = xl + 2 * n - 1 - n * n / tail
+    result[~small] = 1 / tail
+    return result
+
+
+def scaled_ei(x):
+    """
+    Return exp(-x) * Ei(x) for an array of x > 0, where Ei is the exponential
+    integral.
+    """
+    x = np.asarray(x, dtype=float)
+    result = np.empty_like(x)
+    small = x <= 40
+    # The power series. The terms are all positive, so there is no
+    # cancellation.
+    xs = x[small]
+    total = EULER_GAMMA + np.log(xs)
+    term = np.ones_like(xs)
+    for k in range(1, 160):
+        term = term * xs / k
+        total = total + term / k
+    result[small] = np.exp(-xs) * total
+    # The asymptotic series, truncated near its smallest term.
+    xl = x[~small]
+    total = np.ones_like(xl)
+    term = np.ones_like(xl)
+    for k in range(1, 40):
+        term = term * k / xl
+        total = total + term
+    result[~small] = total / xl
+    return result
+
+
+class SizeHistory:
+    """
+    The size history of a deme, as arrays with one entry per epoch, from
+    oldest to youngest.
+    """
+
+    def __init__(self, deme: parser.Deme, generation_time: float = 1):
+        self.name = deme.name
+        self.generation_time = generation_time
+        self.end_times = np.array([epoch.end_time for epoch in deme.epochs], float)
+        self.start_times = np.concatenate([[deme.start_time], self.end_times[:-1]])
+        self.start_sizes = np.array([e.start_size for e in deme.epochs], float)
+        self.end_sizes = np.array([e.end_size for e in deme.epochs], float)
+        lengths = self.start_times - self.end_times
+        # Growth rates are zero for constant epochs, and for exponential or
+        # linear epochs whose start and end sizes are equal.
+        size_functions = np.array([e.size_function for e in deme.epochs])
+        with np.errstate(divide="ignore", invalid="ignore"):
+            self.exponential_rates = np.where(
+                size_functions == "exponential",
+                np.log(self.end_sizes / self.start_sizes) / lengths,
+                0,
+            )
+            self.linear_slopes = np.where(
+                size_functions == "linear",
+                (self.start_sizes - self.end_sizes) / lengths,
+                0,
+            )
+        # The integral of 1/N over each whole epoch, and the integral from
+        # the deme's end time to the end of each epoch.
+        self.epoch_integrals = self._integral_within(np.arange(len(lengths)), lengths)
+        self.cumulative_integrals = np.concatenate(
+            [np.cumsum(self.epoch_integrals[:0:-1])[::-1], [0]]
+        )
+
+    @property
+    def start_time(self):
+        return self.start_times[0]
+
+    @property
+    def end_time(self):
+        return self.end_times[-1]
+
+    def _epoch_index(self, t):
+        # The index of the epoch whose interval (start_time, end_time]
+        # contains t. The deme's start time is included in the first epoch.
+        t = np.asarray(t, dtype=float)
+        if np.any(~((self.end_time <= t) & (t <= self.start_time))):
+            raise ValueError(
+                f"times must be within deme {self.name}'s time interval "
+                f"({self.start_time}, {self.end_time}]"
+            )
+        k = np.searchsorted(self.end_times[::-1], t, side="right")
+        return t, len(self.end_times) - k
+
+    def _integral_within(self, j, u):
+        # The integral of 1/N from the end of epoch j to u above it.
+        g = self.exponential_rates[j]
+        c = self.linear_slopes[j]
+        n1 = self.end_sizes[j]
+        # The where() calls evaluate every branch, so the unused branches
+        # are computed with placeholder rates of 1 to avoid dividing by zero.
+        g_ = np.where(g == 0, 1, g)
+        c_ = np.where(c == 0, 1, c)
+        with np.errstate(over="ignore", invalid="ignore"):
+            return np.where(
+                g != 0,
+                np.expm1(g_ * u) / (g_ * n1),
+                np.where(c != 0, np.log1p(c_ * u / n1) / c_, u / n1),
+            )
+
+    def _inverse_within(self, j, y):
+        # The u such that _integral_within(j, u) == y.
+        g = self.exponential_rates[j]
+        c = self.linear_slopes[j]
+        n1 = self.end_sizes[j]
+        g_ = np.where(g == 0, 1, g)
+        c_ = np.where(c == 0, 1, c)
+        with np.errstate(over="ignore", invalid="ignore"):
+            return np.where(
+                g != 0,
+                np.log1p(g_ * n1 * y) / g_,
+                np.where(c != 0, n1 * np.expm1(c_ * y) / c_, y * n1),
+            )
+
+    def size(self, t):
+        """Return the deme's size at the times t."""
+        t, j = self._epoch_index(t)
+        u = t - self.end_times[j]
+        g = self.exponential_rates[j]
+        c = self.linear_slopes[j]
+        n1 = self.end_sizes[j]
+        # Constant epochs are handled separately, as the first epoch may be
+        # infinitely long.
+        with np.errstate(invalid="ignore"):
+            return np.where(
+                g != 0,
+                n1 * np.exp(-g * u),
+                np.where(c != 0, n1 + c * u, n1),
+            )
+
+    def cumulative(self, t):
+        """
+        Return the integral of 1/N from the deme's end time to the times t.
+        """
+        t, j = self._epoch_index(t)
+        return self.cumulative_integrals[j] + self._integral_within(
+            j, t - self.end_times[j]
+        )
+
+    def integral(self, start_time, end_time):
+        """
+        Return the integral of 1/N over the time windows (start_time, end_time].
+        """
+        return self.cumulative(start_time) - self.cumulative(end_time)
+
+    def inverse(self, y, end_time=None):
+        """
+        Return the times t such that the integral of 1/N over
+        (t, end_time] is y. By default end_time is the deme's end time.
+        """
+        if end_time is None:
+            end_time = self.end_time
+        y = np.asarray(self.cumulative(end_time) + np.asarray(y, dtype=float))
+        total = self.cumulative_integrals[0] + self.epoch_integrals[0]
+        if np.any(~((0 <= y) & (y <= total))):
+            raise ValueError(
+                f"integral values must be between 0 and {total}, the integral "
+                f"over deme {self.name}'s time interval"
+            )
+        k = np.searchsorted(self.cumulative_integrals[::-1], y, side="right")
+        j = len(self.end_times) - k
+        return self.end_times[j] + self._inverse_within(
+            j, y - self.cumulative_integrals[j]
+        )
+
+    def harmonic_mean_size(self, start_time, end_time):
+        """
+        Return the harmonic mean of the deme's size over the time windows
+        (start_time, end_time].
+        """
+        start_time = np.asarray(start_time, dtype=float)
+        end_time = np.asarray(end_time, dtype=float)
+        if np.any(start_time <= end_time):
+            raise ValueError("start_time must be greater than end_time")
+        return (start_time - end_time) / self.integral(start_time, end_time)
+
+    def expected_coalescence_time(self, t=None, ploidy=2):
+        """
+        Return the expected time until two lineages sampled at the times t
+        coalesce, if the deme were isolated from all other demes.
+
+        The rate of coalescence at time t is 1 / (ploidy * N(t)) per
+        generation. The deme must have an infinite start time, so that the
+        lineages are certain to coalesce. By default t is the deme's end time.
+        """
+        if not np.isinf(self.start_time):
+            raise ValueError(
+                f"deme {self.name} has a finite start_time, so lineages may "
+                "not coalesce within it"
+            )
+        if t is None:
+            t = self.end_time
+        t, _ = self._epoch_index(t)
+        if np.any(np.isinf(t)):
+            raise ValueError("times must be finite")
+        # The coalescence rate per unit of time is k / N.
+        k = 1 / (ploidy * self.generation_time)
+        expected = np.zeros_like(t)
+        # For each epoch, the lineages reach the younger end of the part of the
+        # epoch that's older than t without coalescing with probability
+        # exp(-k * integral), and then take the expected time to coalesce
+        # within the epoch, or the time to reach the end of the epoch if they
+        # don't.
+        for j in range(len(self.end_times)):
+            active = t < self.start_times[j]
+            end = np.where(
+                active, np.maximum(t, self.end_times[j]), self.start_times[j]
+            )
+            survival = np.exp(-k * (self.cumulative(end) - self.cumulative(t)))
+            contribution = self._coalescence_time_within(
+                j,
+                self.size(end),
+                self.start_times[j] - end,
+                k,
+            )
+            expected = expected + np.where(active, survival * contribution, 0)
+        return expected
+
+    def _coalescence_time_within(self, j, n1, length, k):
+        # The integral of exp(-k * integral of 1/N from the end of the
+        # segment) over a segment of epoch j whose younger end has size n1.
+        g = self.exponential_rates[j]
+        c = self.linear_slopes[j]
+        with np.errstate(all="ignore"):
+            if g != 0:
+                # With w = exp(g * u), the integral is
+                # exp(a) / g * integral of exp(-a * w) / w from 1 to w(L),
+                # where a = k / (g * n1), which is a difference of
+                # exponential integrals.
+                a = k / (g * n1)
+                w = np.exp(g * length)
+                survival = np.exp(-a * (w - 1))
+                if g > 0:
+                    return (scaled_e1(a) - survival * scaled_e1(a * w)) / g
+                return (survival * scaled_ei(-a * w) - scaled_ei(-a)) / g
+            if c != 0:
+                # The survival is (1 + c * u / n1) ** -(k / c).
+                z = np.log1p(c * length / n1)
+                if c == k:
+                    return n1 * z / c
+                return n1 * np.expm1((c - k) * z / c) / (c - k)
+            # With an infinite length, expm1(-inf) is -1.
+            return -n1 * np.expm1(-k * length / n1) / k
+
+
+def size_histories(graph: parser.Graph) -> Dict[str, SizeHistory]:
+    """Return the SizeHistory of each deme in a resolved graph."""
+    return {
+        name: SizeHistory(deme, graph.generation_time)
+        for name, deme in graph.demes.items()
+    }
@@ -0,0 +1,411 @@
+# Columnar form of resolved Demes Graphs, and sharing it with worker
+# processes through shared memory.
+#
+# A launcher that starts many worker processes for the same model would
+# otherwise send each worker a pickled Graph, which each worker must then
+# unpickle into its own tree of objects. Instead, the launcher can place the
+# columnar form of the graph in a multiprocessing.shared_memory block once,
+# and send each worker a GraphHandle, which is a few hundred bytes. Each
+# worker attaches to the block, and gets a GraphView whose arrays are
+# read-only views of the shared memory, so nothing is copied: the deme,
+# ancestor, epoch, migration and pulse tables are all returned as views. A
+# worker that needs the object model can call GraphView.to_graph(), at the
+# cost of copying the whole graph into new objects.
+#
+# The columnar form is a dict of one-dimensional NumPy arrays:
+#
+#   strings:     string_data (UTF-8 bytes) and string_offsets, indexed by the
+#                string columns below
+#   graph:       graph_strings (time_units, description and the metadata as
+#                JSON), graph_generation_time, and doi
+#   demes:       deme_name, deme_description, deme_start_time, and the offsets
+#                deme_epochs and deme_ancestors of each deme's rows in the
+#                epoch and ancestor columns
+#   ancestors:   ancestor_deme (deme index) and ancestor_proportion
+#   epochs:      epoch_end_time, epoch_start_size, epoch_end_size,
+#                epoch_size_function, epoch_selfing_rate, epoch_cloning_rate
+#   migrations:  migration_rate, migration_start_time, migration_end_time,
+#                migration_source and migration_dest (deme indexes)
+#   pulses:      pulse_time, pulse_dest, and the offsets pulse_sources of each
+#                pulse's rows in pulse_source and pulse_proportion
+#
+# Numbers are stored as float64, so integer values (e.g., a start_size of 100)
+# come back as floats, which compare equal to the original values.
+from __future__ import annotations
+
+import dataclasses
+import json
+import sys
+import threading
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+import demes_parser as parser
+
+# Arrays are placed in shared memory at multiples of this offset.
+ALIGNMENT = 8
+
+
+class StringTable:
+    def __init__(self):
+        self.index: Dict[str, int] = {}
+
+    def add(self, string: str) -> int:
+        return self.index.setdefault(string, len(self.index))
+
+    def columns(self) -> Dict[str, np.ndarray]:
+        encoded = [string.encode("utf-8") for string in self.index]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(data) for data in encoded])
+        return {
+            "string_data": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+            "string_offsets": offsets,
+        }
+
+
+def offsets(lengths) -> np.ndarray:
+    result = np.zeros(len(lengths) + 1, dtype=np.int64)
+    result[1:] = np.cumsum(lengths)
+    return result
+
+
+def to_columns(graph: parser.Graph) -> Dict[str, np.ndarray]:
+    """
+    Return the columnar form of the resolved graph.
+    """
+    strings = StringTable()
+    index = {name: j for j, name in enumerate(graph.demes)}
+    demes = list(graph.demes.values())
+    epochs = [epoch for deme in demes for epoch in deme.epochs]
+    columns = {
+        "graph_strings": np.array(
+            [
+                strings.add(graph.time_units),
+                strings.add(graph.description),
+                strings.add(json.dumps(graph.metadata)),
+            ],
+            dtype=np.int64,
+        ),
+        "graph_generation_time": np.array([graph.generation_time], dtype=float),
+        "doi": np.array([strings.add(doi) for doi in graph.doi], dtype=np.int64),
+        "deme_name": np.array([strings.add(d.name) for d in demes], dtype=np.int64),
+        "deme_description": np.array(
+            [strings.add(deme.description) for deme in demes], dtype=np.int64
+        ),
+        "deme_start_time": np.array([deme.start_time for deme in demes], dtype=float),
+        "deme_epochs": offsets([len(deme.epochs) for deme in demes]),
+        "deme_ancestors": offsets([len(deme.ancestors) for deme in demes]),
+        "ancestor_deme": np.array(
+            [index[a.name] for deme in demes for a in deme.ancestors], dtype=np.int64
+        ),
+        "ancestor_proportion": np.array(
+            [p for deme in demes for p in deme.proportions], dtype=float
+        ),
+        "epoch_size_function": np.array(
+            [strings.add(epoch.size_function) for epoch in epochs], dtype=np.int64
+        ),
+        "migration_source": np.array(
+            [index[m.source.name] for m in graph.migrations], dtype=np.int64
+        ),
+        "migration_dest": np.array(
+            [index[m.dest.name] for m in graph.migrations], dtype=np.int64
+        ),
+        "pulse_time": np.array([p.time for p in graph.pulses], dtype=float),
+        "pulse_dest": np.array(
+            [index[p.dest.name] for p in graph.pulses], dtype=np.int64
+        ),
+        "pulse_sources": offsets([len(pulse.sources) for pulse in graph.pulses]),
+        "pulse_source": np.array(
+            [index[s.name] for p in graph.pulses for s in p.sources], dtype=np.int64
+        ),
+        "pulse_proportion": np.array(
+            [x for pulse in graph.pulses for x in pulse.proportions], dtype=float
+        ),
+    }
+    for field in ["end_time", "start_size", "end_size", "selfing_rate", "cloning_rate"]:
+        columns[f"epoch_{field}"] = np.array(
+            [getattr(epoch, field) for epoch in epochs], dtype=float
+        )
+    for field in ["rate", "start_time", "end_time"]:
+        columns[f"migration_{field}"] = np.array(
+            [getattr(migration, field) for migration in graph.migrations], dtype=float
+        )
+    columns.update(strings.columns())
+    return columns
+
+
+class GraphView:
+    """
+    A read-only view of the columnar form of a resolved graph. The tables
+    are returned as dicts of views of the column arrays, without copying.
+    to_graph() builds a new object model from the columns, which copies
+    everything.
+    """
+
+    def __init__(self, columns: Dict[str, np.ndarray]):
+        self.columns = columns
+        data = columns["string_data"].tobytes()
+        bounds = columns["string_offsets"].tolist()
+        self.strings = [
+            data[start:end].decode("utf-8") for start, end in zip(bounds, bounds[1:])
+        ]
+        self.deme_names = [self.strings[j] for j in columns["deme_name"].tolist()]
+        self.deme_index = {name: j for j, name in enumerate(self.deme_names)}
+
+    @property
+    def time_units(self) -> str:
+        return self.strings[self.columns["graph_strings"][0]]
+
+    @property
+    def description(self) -> str:
+        return self.strings[self.columns["graph_strings"][1]]
+
+    @property
+    def metadata(self) -> dict:
+        return json.loads(self.strings[self.columns["graph_strings"][2]])
+
+    @property
+    def generation_time(self) -> float:
+        return self.columns["graph_generation_time"][0].item()
+
+    @property
+    def doi(self) -> List[str]:
+        return [self.strings[j] for j in self.columns["doi"].tolist()]
+
+    def _table(self, prefix, fields, start=None, end=None):
+        return {field: self.columns[f"{prefix}_{field}"][start:end] for field in fields}
+
+    def demes(self) -> Dict[str, np.ndarray]:
+        """
+        Return the deme columns, in the order of deme_names: the start_time,
+        and the offsets of each deme's rows in the epoch and ancestor columns.
+        """
+        return self._table("deme", ["start_time", "epochs", "ancestors"])
+
+    def epochs(self, name: str) -> Dict[str, np.ndarray]:
+        """
+        Return the epoch columns of the deme, as views of the shared arrays.
+        The size_function column holds indexes into strings.
+        """
+        j = self.deme_index[name]
+        start, end = self.columns["deme_epochs"][j : j + 2]
+        return self._table(
+            "epoch",
+            [
+                "end_time",
+                "start_size",
+                "end_size",
+                "size_function",
+                "selfing_rate",
+                "cloning_rate",
+            ],
+            start,
+            end,
+        )
+
+    def ancestors(self, name: str) -> Dict[str, np.ndarray]:
+        """
+        Return the ancestor columns of the deme, as views of the shared
+        arrays: the index of each ancestor deme, and its proportion.
+        """
+        j = self.deme_index[name]
+        start, end = self.columns["deme_ancestors"][j : j + 2]
+        return self._table("ancestor", ["deme", "proportion"], start, end)
+
+    def migrations(self) -> Dict[str, np.ndarray]:
+        """
+        Return the migration columns, as views of the shared arrays, with the
+        source and dest as deme indexes.
+        """
+        return self._table(
+            "migration", ["rate", "start_time", "end_time", "source", "dest"]
+        )
+
+    def pulses(self) -> Dict[str, np.ndarray]:
+        """
+        Return the pulse columns, as views of the shared arrays: the time and
+        dest (a deme index) of each pulse, and the offsets of each pulse's
+        rows in the source and proportion columns.
+        """
+        return self._table("pulse", ["time", "dest", "sources"])
+
+    def pulse_sources(self, j: int) -> Dict[str, np.ndarray]:
+        """
+        Return the source columns of the j-th pulse, as views of the shared
+        arrays: the index of each source deme, and its proportion.
+        """
+        start, end = self.columns["pulse_sources"][j : j + 2]
+        return self._table("pulse", ["source", "proportion"], start, end)
+
+    def to_graph(self) -> parser.Graph:
+        """
+        Return the resolved graph, as a new object model.
+        """
+        c = {name: array.tolist() for name, array in self.columns.items()}
+        strings = self.strings
+        graph = parser.Graph(
+            time_units=self.time_units,
+            generation_time=self.generation_time,
+            doi=self.doi,
+            description=self.description,
+            metadata=self.metadata,
+        )
+        demes = []
+        for j, name in enumerate(self.deme_names):
+            a, b = c["deme_ancestors"][j : j + 2]
+            deme = parser.Deme(
+                name=name,
+                description=strings[c["deme_description"][j]],
+                start_time=c["deme_start_time"][j],
+                ancestors=[demes[k] for k in c["ancestor_deme"][a:b]],
+                proportions=c["ancestor_proportion"][a:b],
+            )
+            a, b = c["deme_epochs"][j : j + 2]
+            deme.epochs = [
+                parser.Epoch(
+                    end_time=c["epoch_end_time"][k],
+                    start_size=c["epoch_start_size"][k],
+                    end_size=c["epoch_end_size"][k],
+                    size_function=strings[c["epoch_size_function"][k]],
+                    selfing_rate=c["epoch_selfing_rate"][k],
+                    cloning_rate=c["epoch_cloning_rate"][k],
+                )
+                for k in range(a, b)
+            ]
+            demes.append(deme)
+            graph.demes[name] = deme
+        graph.migrations = [
+            parser.Migration(rate, start_time, end_time, demes[source], demes[dest])
+            for rate, start_time, end_time, source, dest in zip(
+                c["migration_rate"],
+                c["migration_start_time"],
+                c["migration_end_time"],
+                c["migration_source"],
+                c["migration_dest"],
+            )
+        ]
+        for j, (time, dest) in enumerate(zip(c["pulse_time"], c["pulse_dest"])):
+            a, b = c["pulse_sources"][j : j + 2]
+            graph.pulses.append(
+                parser.Pulse(
+                    sources=[demes[k] for k in c["pulse_source"][a:b]],
+                    dest=demes[dest],
+                    time=time,
+                    proportions=c["pulse_proportion"][a:b],
+                )
+            )
+        return graph
+
+
+@dataclasses.dataclass(frozen=True)
+class GraphHandle:
+    """
+    The name of a shared memory block that holds the columnar form of a
+    graph, and the (name, dtype, offset, length) of each array within it.
+    """
+
+    name: str
+    layout: Tuple[Tuple[str, str, int, int], ...]
+
+
+# Before Python 3.13, attaching to a block registers it with the resource
+# tracker, as if this process had created it, so the block would be unlinked
+# when this process exits, while the owner still uses it. Unregistering it
+# after attaching isn't safe either, as workers may share the owner's tracker,
+# so that they would remove the owner's registration. Instead, the tracker's
+# register() is replaced, once, by a function that skips the registrations made
+# while the calling thread is attaching to a block. Registrations made by
+# other threads at the same time are passed on as usual.
+_attaching = threading.local()
+_install_lock = threading.Lock()
+_tracker_register = None
+
+
+def _register(name, rtype):
+    if not getattr(_attaching, "active", False):
+        _tracker_register(name, rtype)
+
+
+def attach_shared_memory(name):
+    from multiprocessing import resource_tracker, shared_memory
+
+    global _tracker_register
+
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name, track=False)
+    with _install_lock:
+        if resource_tracker.register is not _register:
+            _tracker_register = resource_tracker.register
+            resource_tracker.register = _register
+    _attaching.active = True
+    try:
+        return shared_memory.SharedMemory(name)
+    finally:
+        _attaching.active = False
+
+
+class SharedGraph:
+    """
+    The columnar form of a resolved graph in a shared memory block, which
+    worker processes can attach() to with the handle. The block is freed
+    by close(), or on leaving a with block.
+    """
+
+    def __init__(self, graph: parser.Graph):
+        from multiprocessing import shared_memory
+
+        columns = to_columns(graph)
+        layout = []
+        size = 0
+        for name, array in columns.items():
+            size = -(-size // ALIGNMENT) * ALIGNMENT
+            layout.append((name, array.dtype.str, size, len(array)))
+            size += array.nbytes
+        self.shared_memory = shared_memory.SharedMemory(create=True, size=max(size, 1))
+        self.handle = GraphHandle(self.shared_memory.name, tuple(layout))
+        for name, dtype, offset, length in layout:
+            np.ndarray(length, dtype, self.shared_memory.buf, offset)[:] = columns[name]
+
+    def close(self):
+        self.shared_memory.close()
+        self.shared_memory.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SharedGraphView(GraphView):
+    """
+    A GraphView of a graph in shared memory. The view must be closed, and
+    no references to its arrays may be kept, before the block can be freed.
+    """
+
+    def __init__(self, handle: GraphHandle):
+        self.shared_memory = attach_shared_memory(handle.name)
+        columns = {}
+        for name, dtype, offset, length in handle.layout:
+            array = np.ndarray(length, dtype, self.shared_memory.buf, offset)
+            array.flags.writeable = False
+            columns[name] = array
+        super().__init__(columns)
+
+    def close(self):
+        self.columns = None
+        self.shared_memory.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def attach(handle: GraphHandle) -> SharedGraphView:
+    """
+    Attach to the graph in shared memory with the given handle.
+    """
+    return SharedGraphView(handle)
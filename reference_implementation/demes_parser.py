@@ -23,10 +23,13 @@ from __future__ import annotations
 import math
 import numbers
 import copy
-import pprint
 import dataclasses
 from typing import Dict, List, Union
 
+# Modules that are only needed by some of the Graph methods (pprint, json,
+# hashlib) are imported where they are used, to keep the start up time down
+# for short-lived processes that only parse a single model.
+
 # Numerical wiggle room.
 EPSILON = 1e-6
 
@@ -48,8 +51,27 @@ def parse(data: dict) -> Graph:
     # graph are applied in the "resolve" functions. Finally, we validate
     # the fully-qualified graph to ensure that relationships between the
     # entities have been specified correctly.
-    data = copy.deepcopy(data)
+    graph = build(copy.deepcopy(data))
+
+    # The input object model has now been fully populated, and local type and
+    # value checking done. Default values (either from the schema or set explicitly
+    # by the user via "defaults" sections) have been assigned. We now "resolve"
+    # the model so that any values that can be imputed from the structure of the
+    # model are set explicitly. Once this is done, we then validate the model to
+    # check that the relationships between various entities make sense. Note that
+    # there isn't a clean separation between resolution and validation here, since
+    # some validation is simplest to perform as part of the resolution logic in
+    # this particular implementation.
+    graph.resolve()
+    graph.validate()
 
+    return graph
+
+
+def build(data: dict) -> Graph:
+    # Build the object model of the input data, without resolving it. The data
+    # dictionary is consumed in the process, so callers must pass a copy if
+    # they want to keep it.
     defaults = pop_object(data, "defaults", {})
     deme_defaults = pop_object(defaults, "deme", {})
     migration_defaults = pop_object(defaults, "migration", {})
@@ -67,25 +89,8 @@ def parse(data: dict) -> Graph:
         ),
         metadata=pop_object(data, "metadata", {}),
     )
-    check_defaults(
-        deme_defaults,
-        dict(
-            description=(str, None),
-            start_time=((str, numbers.Number), is_positive_or_json_infinity),
-            ancestors=(list, is_list_of_identifiers),
-            proportions=(list, is_list_of_proportions),
-        ),
-    )
-
-    allowed_epoch_defaults = dict(
-        end_time=(numbers.Number, is_non_negative_and_finite),
-        start_size=(numbers.Number, is_positive_and_finite),
-        end_size=(numbers.Number, is_positive_and_finite),
-        selfing_rate=(numbers.Number, is_rate),
-        cloning_rate=(numbers.Number, is_rate),
-        size_function=(str, None),
-    )
-    check_defaults(global_epoch_defaults, allowed_epoch_defaults)
+    check_defaults(deme_defaults, DEME_DEFAULTS)
+    check_defaults(global_epoch_defaults, EPOCH_DEFAULTS)
 
     for deme_data in pop_list(data, "demes"):
         insert_defaults(deme_data, deme_defaults)
@@ -108,10 +113,10 @@ def parse(data: dict) -> Graph:
         local_defaults = pop_object(deme_data, "defaults", {})
         local_epoch_defaults = pop_object(local_defaults, "epoch", {})
         check_empty(local_defaults)
-        check_defaults(local_epoch_defaults, allowed_epoch_defaults)
+        check_defaults(local_epoch_defaults, EPOCH_DEFAULTS)
         epoch_defaults = global_epoch_defaults.copy()
         epoch_defaults.update(local_epoch_defaults)
-        check_defaults(epoch_defaults, allowed_epoch_defaults)
+        check_defaults(epoch_defaults, EPOCH_DEFAULTS)
 
         # There is always at least one epoch defined with the default values.
         for epoch_data in pop_list(deme_data, "epochs", [{}]):
@@ -139,17 +144,7 @@ def parse(data: dict) -> Graph:
     if len(graph.demes) == 0:
         raise ValueError("the graph must have one or more demes")
 
-    check_defaults(
-        migration_defaults,
-        dict(
-            rate=(numbers.Number, is_rate),
-            start_time=((numbers.Number, str), is_positive_or_json_infinity),
-            end_time=(numbers.Number, is_non_negative_and_finite),
-            source=(str, is_identifier),
-            dest=(str, is_identifier),
-            demes=(list, is_list_of_identifiers),
-        ),
-    )
+    check_defaults(migration_defaults, MIGRATION_DEFAULTS)
     for migration_data in pop_list(data, "migrations", []):
         insert_defaults(migration_data, migration_defaults)
         graph.add_migration(
@@ -176,15 +171,7 @@ def parse(data: dict) -> Graph:
         )
         check_empty(migration_data)
 
-    check_defaults(
-        pulse_defaults,
-        dict(
-            sources=(list, is_nonempty_list_of_identifiers),
-            dest=(str, is_identifier),
-            time=(numbers.Number, is_positive_and_finite),
-            proportions=(list, is_nonempty_list_of_proportions_with_sum_less_than_1),
-        ),
-    )
+    check_defaults(pulse_defaults, PULSE_DEFAULTS)
     for pulse_data in pop_list(data, "pulses", []):
         insert_defaults(pulse_data, pulse_defaults)
         graph.add_pulse(
@@ -208,19 +195,6 @@ def parse(data: dict) -> Graph:
         check_empty(pulse_data)
 
     check_empty(data)
-
-    # The input object model has now been fully populated, and local type and
-    # value checking done. Default values (either from the schema or set explicitly
-    # by the user via "defaults" sections) have been assigned. We now "resolve"
-    # the model so that any values that can be imputed from the structure of the
-    # model are set explicitly. Once this is done, we then validate the model to
-    # check that the relationships between various entities make sense. Note that
-    # there isn't a clean separation between resolution and validation here, since
-    # some validation is simplest to perform as part of the resolution logic in
-    # this particular implementation.
-    graph.resolve()
-    graph.validate()
-
     return graph
 
 
@@ -230,6 +204,18 @@ def encode_inf(value):
     return value
 
 
+def canonical_json_value(value):
+    # Integers and floats that compare equal (e.g. 1 and 1.0) must be
+    # serialised identically, so all numbers are converted to float.
+    if isinstance(value, dict):
+        return {key: canonical_json_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [canonical_json_value(item) for item in value]
+    if isinstance(value, numbers.Number) and not isinstance(value, bool):
+        return float(value)
+    return value
+
+
 # Validator functions. These are used as arguments to the pop_x functions and
 # check properties of the values.
 
@@ -278,6 +264,38 @@ def is_nonempty_list_of_proportions_with_sum_less_than_1(value):
     return is_list_of_proportions(value) and len(value) > 0 and sum(value) <= 1
 
 
+# The fields that can be specified in each of the defaults sections, along
+# with their required types and validators.
+DEME_DEFAULTS = dict(
+    description=(str, None),
+    start_time=((str, numbers.Number), is_positive_or_json_infinity),
+    ancestors=(list, is_list_of_identifiers),
+    proportions=(list, is_list_of_proportions),
+)
+EPOCH_DEFAULTS = dict(
+    end_time=(numbers.Number, is_non_negative_and_finite),
+    start_size=(numbers.Number, is_positive_and_finite),
+    end_size=(numbers.Number, is_positive_and_finite),
+    selfing_rate=(numbers.Number, is_rate),
+    cloning_rate=(numbers.Number, is_rate),
+    size_function=(str, None),
+)
+MIGRATION_DEFAULTS = dict(
+    rate=(numbers.Number, is_rate),
+    start_time=((numbers.Number, str), is_positive_or_json_infinity),
+    end_time=(numbers.Number, is_non_negative_and_finite),
+    source=(str, is_identifier),
+    dest=(str, is_identifier),
+    demes=(list, is_list_of_identifiers),
+)
+PULSE_DEFAULTS = dict(
+    sources=(list, is_nonempty_list_of_identifiers),
+    dest=(str, is_identifier),
+    time=(numbers.Number, is_positive_and_finite),
+    proportions=(list, is_nonempty_list_of_proportions_with_sum_less_than_1),
+)
+
+
 def validate_item(name, value, required_type, validator=None):
     if not isinstance(value, required_type):
         raise TypeError(
@@ -380,14 +398,14 @@ class Interval:
 
     def intersects(self, other):
         """True if self and other intersect, False otherwise."""
-        assert isinstance(other, self.__class__)
+        assert isinstance(other, Interval)
         return not (
             self.end_time >= other.start_time or other.end_time >= self.start_time
         )
 
     def is_subinterval(self, other):
         """True if self is completely contained within other, False otherwise."""
-        assert isinstance(other, self.__class__)
+        assert isinstance(other, Interval)
         return self.start_time <= other.start_time and self.end_time >= other.end_time
 
     def __contains__(self, time):
@@ -466,10 +484,26 @@ class Deme:
             "description": self.description,
             "start_time": encode_inf(self.start_time),
             "epochs": [epoch.as_json_dict() for epoch in self.epochs],
-            "proportions": self.proportions,
+            "proportions": list(self.proportions),
             "ancestors": [deme.name for deme in self.ancestors],
         }
 
+    def __eq__(self, other):
+        # Ancestors are compared by name. Comparing the ancestor Deme objects
+        # themselves would recursively compare each ancestor's ancestors,
+        # which is exponential in the depth of diamond-shaped ancestries.
+        if not isinstance(other, Deme):
+            return NotImplemented
+        return (
+            self.name == other.name
+            and self.start_time == other.start_time
+            and self.description == other.description
+            and [deme.name for deme in self.ancestors]
+            == [deme.name for deme in other.ancestors]
+            and self.proportions == other.proportions
+            and self.epochs == other.epochs
+        )
+
     def __resolve_times(self):
         if self.start_time is None:
             default = math.inf
@@ -566,10 +600,26 @@ class Pulse:
     proportions: List[float]
 
     def as_json_dict(self) -> dict:
-        d = dataclasses.asdict(self)
-        d["sources"] = [source.name for source in self.sources]
-        d["dest"] = self.dest.name
-        return d
+        # The sources and dest are replaced by their names. We don't use
+        # dataclasses.asdict() here, as it would recursively copy the
+        # referenced Deme objects (and all of their ancestors) first.
+        return {
+            "sources": [source.name for source in self.sources],
+            "dest": self.dest.name,
+            "time": self.time,
+            "proportions": list(self.proportions),
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Pulse):
+            return NotImplemented
+        return (
+            [source.name for source in self.sources]
+            == [source.name for source in other.sources]
+            and self.dest.name == other.dest.name
+            and self.time == other.time
+            and self.proportions == other.proportions
+        )
 
     def validate(self):
         sources_names = set(source.name for source in self.sources)
@@ -615,11 +665,24 @@ class Migration:
         return Interval(self.start_time, self.end_time)
 
     def as_json_dict(self) -> dict:
-        d = dataclasses.asdict(self)
-        d["start_time"] = encode_inf(self.start_time)
-        d["source"] = self.source.name
-        d["dest"] = self.dest.name
-        return d
+        return {
+            "rate": self.rate,
+            "start_time": encode_inf(self.start_time),
+            "end_time": self.end_time,
+            "source": self.source.name,
+            "dest": self.dest.name,
+        }
+
+    def __eq__(self, other):
+        if not isinstance(other, Migration):
+            return NotImplemented
+        return (
+            self.rate == other.rate
+            and self.start_time == other.start_time
+            and self.end_time == other.end_time
+            and self.source.name == other.source.name
+            and self.dest.name == other.dest.name
+        )
 
     def resolve(self):
         if self.start_time is None:
@@ -737,17 +800,93 @@ class Graph:
         return pulse
 
     def __str__(self):
+        import pprint
+
         data = self.as_json_dict()
         return pprint.pformat(data, indent=2)
 
     def as_json_dict(self):
-        d = dataclasses.asdict(self)
-        d["demes"] = [deme.as_json_dict() for deme in self.demes.values()]
-        d["migrations"] = [migration.as_json_dict() for migration in self.migrations]
-        d["pulses"] = [pulse.as_json_dict() for pulse in self.pulses]
-        return d
+        return {
+            "time_units": self.time_units,
+            "generation_time": self.generation_time,
+            "doi": list(self.doi),
+            "description": self.description,
+            "metadata": copy.deepcopy(self.metadata),
+            "demes": [deme.as_json_dict() for deme in self.demes.values()],
+            "migrations": [migration.as_json_dict() for migration in self.migrations],
+            "pulses": [pulse.as_json_dict() for pulse in self.pulses],
+        }
+
+    def __eq__(self, other):
+        # Each deme, migration and pulse is compared once, so equality is
+        # linear in the size of the graph. Unlike a plain dict comparison,
+        # the order of the demes is significant, as it is in the MDM.
+        if not isinstance(other, Graph):
+            return NotImplemented
+        return (
+            self.time_units == other.time_units
+            and self.generation_time == other.generation_time
+            and self.doi == other.doi
+            and self.description == other.description
+            and self.metadata == other.metadata
+            and list(self.demes.items()) == list(other.demes.items())
+            and self.migrations == other.migrations
+            and self.pulses == other.pulses
+        )
+
+    def fingerprint(self) -> str:
+        """
+        Return a hex digest of the canonical MDM form of the graph.
+
+        Graphs that compare equal have the same fingerprint, so the
+        fingerprint can be used as a key when caching or deduplicating graphs.
+        """
+        import hashlib
+        import json
+
+        data = canonical_json_value(self.as_json_dict())
+        text = json.dumps(data, sort_keys=True, separators=(",", ":"))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    def __reduce_ex__(self, protocol):
+        # By default, pickle records the class and the __dict__ of every
+        # object in the graph. Instead, the graph is reduced to flat tuples of
+        # plain values, with the demes referred to by their index, which
+        # pickles to about half the size, and is faster to unpickle.
+        # If a deme's epochs aren't a list (e.g., epochs that are shared by
+        # flyweight.share_epochs()), the graph is pickled as objects, so that
+        # the epochs stay shared.
+        if not all(isinstance(deme.epochs, list) for deme in self.demes.values()):
+            return super().__reduce_ex__(protocol)
+        return graph_from_state, (graph_state(self),)
+
+    # The copy module also uses __reduce_ex__(), so copies are made in the
+    # same way as they would be without it: a shallow copy shares the demes,
+    # migrations, pulses and metadata, and a deep copy copies every object.
+
+    def __copy__(self):
+        graph = self.__class__.__new__(self.__class__)
+        graph.__dict__.update(self.__dict__)
+        return graph
+
+    def __deepcopy__(self, memo):
+        graph = self.__class__.__new__(self.__class__)
+        memo[id(self)] = graph
+        graph.__dict__.update(copy.deepcopy(self.__dict__, memo))
+        return graph
 
     def validate(self):
+        self.validate_generation_time()
+        for deme in self.demes.values():
+            deme.validate()
+        for pulse in self.pulses:
+            pulse.validate()
+        for migration in self.migrations:
+            migration.validate()
+        self.validate_migration_overlaps()
+        self.validate_ingress_rates()
+
+    def validate_generation_time(self):
         if self.generation_time is None:
             if self.time_units == "generations":
                 self.generation_time = 1
@@ -760,13 +899,8 @@ class Graph:
             raise ValueError(
                 "If time_units are in generations, generation_time must be 1"
             )
-        for deme in self.demes.values():
-            deme.validate()
-        for pulse in self.pulses:
-            pulse.validate()
-        for migration in self.migrations:
-            migration.validate()
 
+    def validate_migration_overlaps(self):
         # Migrations involving the same source and dest can't overlap temporally.
         for j, migration_a in enumerate(self.migrations, 1):
             for migration_b in self.migrations[j:]:
@@ -783,6 +917,7 @@ class Graph:
                         f"({start_time}, {end_time}]"
                     )
 
+    def validate_ingress_rates(self):
         # The rate of migration entering a deme cannot be more than 1 in any
         # given interval of time.
         time_boundaries = set()
@@ -812,7 +947,9 @@ class Graph:
             deme.resolve()
         for migration in self.migrations:
             migration.resolve()
+        self.sort_pulses()
 
+    def sort_pulses(self):
         # Sort pulses from oldest to youngest.
         # In a discrete-time setting, non-integer pulse times that are distinct
         # could be rounded to the same time value. If the input file has the pulses
@@ -824,3 +961,110 @@ class Graph:
         # of pulses that have the same time value to start with (as required by
         # the spec).
         self.pulses.sort(key=lambda pulse: pulse.time, reverse=True)
+
+
+def graph_state(graph: Graph) -> tuple:
+    """
+    Return the state of the graph as flat tuples of plain values, for
+    pickling. See Graph.__reduce_ex__().
+    """
+    index = {name: j for j, name in enumerate(graph.demes)}
+    demes = tuple(
+        (
+            deme.name,
+            deme.description,
+            deme.start_time,
+            tuple(index[ancestor.name] for ancestor in deme.ancestors),
+            None if deme.proportions is None else tuple(deme.proportions),
+            tuple(
+                (
+                    epoch.end_time,
+                    epoch.start_size,
+                    epoch.end_size,
+                    epoch.size_function,
+                    epoch.selfing_rate,
+                    epoch.cloning_rate,
+                )
+                for epoch in deme.epochs
+            ),
+        )
+        for deme in graph.demes.values()
+    )
+    migrations = tuple(
+        (
+            migration.rate,
+            migration.start_time,
+            migration.end_time,
+            index[migration.source.name],
+            index[migration.dest.name],
+        )
+        for migration in graph.migrations
+    )
+    pulses = tuple(
+        (
+            tuple(index[source.name] for source in pulse.sources),
+            index[pulse.dest.name],
+            pulse.time,
+            tuple(pulse.proportions),
+        )
+        for pulse in graph.pulses
+    )
+    return (
+        graph.time_units,
+        graph.generation_time,
+        list(graph.doi),
+        graph.description,
+        graph.metadata,
+        demes,
+        migrations,
+        pulses,
+    )
+
+
+def graph_from_state(state: tuple) -> Graph:
+    """
+    Return the graph with the state returned by graph_state().
+    """
+    (
+        time_units,
+        generation_time,
+        doi,
+        description,
+        metadata,
+        deme_states,
+        migration_states,
+        pulse_states,
+    ) = state
+    graph = Graph(
+        time_units=time_units,
+        generation_time=generation_time,
+        doi=doi,
+        description=description,
+        metadata=metadata,
+    )
+    demes = []
+    for name, description, start_time, ancestors, proportions, epochs in deme_states:
+        deme = Deme(
+            name=name,
+            description=description,
+            start_time=start_time,
+            ancestors=[demes[j] for j in ancestors],
+            proportions=None if proportions is None else list(proportions),
+            epochs=[Epoch(*epoch) for epoch in epochs],
+        )
+        demes.append(deme)
+        graph.demes[name] = deme
+    graph.migrations = [
+        Migration(rate, start_time, end_time, demes[source], demes[dest])
+        for rate, start_time, end_time, source, dest in migration_states
+    ]
+    graph.pulses = [
+        Pulse(
+            sources=[demes[j] for j in sources],
+            dest=demes[dest],
+            time=time,
+            proportions=list(proportions),
+        )
+        for sources, dest, time, proportions in pulse_states
+    ]
+    return graph
@@ -0,0 +1,266 @@
+# Conversion of a resolved Demes Graph to integer generations.
+#
+# Discrete-time (e.g., Wright-Fisher) simulators need the times in a graph to
+# be whole numbers of generations. Times are converted to generations using
+# the graph's generation_time and rounded. Rounding is monotonic, so the
+# order of Graph.pulses (oldest first, and in the order given in the input
+# for pulses at the same time) is still correct for the rounded times, even
+# where distinct times are rounded to the same generation. This is the reason
+# for sorting the pulses in Graph.resolve().
+#
+# Rounding can also make an epoch or migration's start and end times equal.
+# Such zero-length intervals are reported, and left out of the discrete graph.
+#
+# The per-generation deme sizes, selfing and cloning rates, and migration
+# rates are given as run-length encoded schedules, with one Run for each
+# interval of generations with the same value.
+from __future__ import annotations
+
+import dataclasses
+import math
+from typing import Dict, List, Tuple, Union
+
+import demes_parser as parser
+
+ROUNDING = {
+    "nearest": round,
+    "floor": math.floor,
+    "ceil": math.ceil,
+}
+
+
+@dataclasses.dataclass
+class Run:
+    """
+    A value that applies to each generation in (start_time, end_time], i.e.
+    the generations k with end_time <= k < start_time.
+    """
+
+    start_time: Union[int, float]
+    end_time: int
+    value: float
+
+
+@dataclasses.dataclass
+class ZeroLength:
+    """An interval whose start and end times were rounded to the same time."""
+
+    # One of "deme", "epoch" or "migration".
+    kind: str
+    # The deme name, or "source->dest" for a migration.
+    name: str
+    # The index of the epoch within the deme, or of the migration within
+    # Graph.migrations. None for demes.
+    index: Union[int, None]
+    time: int
+
+
+@dataclasses.dataclass
+class DiscreteEpoch:
+    start_time: Union[int, float]
+    end_time: int
+    start_size: float
+    end_size: float
+    size_function: str
+    selfing_rate: float
+    cloning_rate: float
+
+    def size_at(self, time: int) -> float:
+        if self.size_function == "constant":
+            return self.start_size
+        # The fraction of the epoch that has elapsed, forwards in time.
+        dt = (self.start_time - time) / (self.start_time - self.end_time)
+        if self.size_function == "exponential":
+            return self.start_size * (self.end_size / self.start_size) ** dt
+        return self.start_size + (self.end_size - self.start_size) * dt
+
+
+@dataclasses.dataclass
+class DiscreteDeme:
+    name: str
+    start_time: Union[int, float]
+    end_time: int
+    # The epochs with non-zero length.
+    epochs: List[DiscreteEpoch]
+    size_schedule: List[Run]
+    selfing_schedule: List[Run]
+    cloning_schedule: List[Run]
+
+
+@dataclasses.dataclass
+class DiscreteMigration:
+    source: str
+    dest: str
+    rate: float
+    start_time: Union[int, float]
+    end_time: int
+
+
+@dataclasses.dataclass
+class DiscretePulse:
+    sources: List[str]
+    dest: str
+    time: int
+    proportions: List[float]
+
+
+@dataclasses.dataclass
+class DiscreteGraph:
+    demes: Dict[str, DiscreteDeme]
+    migrations: List[DiscreteMigration]
+    # In the order in which they must be applied.
+    pulses: List[DiscretePulse]
+    # Maps (source, dest) to the schedule of the migration rate. Generations
+    # without a Run have a migration rate of zero.
+    migration_schedules: Dict[Tuple[str, str], List[Run]]
+    zero_length: List[ZeroLength]
+
+
+def append_run(runs, start_time, end_time, value):
+    # Extend the last run if it is adjacent and has the same value.
+    if len(runs) > 0 and runs[-1].end_time == start_time and runs[-1].value == value:
+        runs[-1].end_time = end_time
+    else:
+        runs.append(Run(start_time, end_time, value))
+
+
+def size_runs(epoch, integer_sizes):
+    """
+    Return the runs of equal sizes within the epoch, oldest first.
+
+    The size is evaluated at each generation's time. Sizes change
+    monotonically within an epoch, so the end of each run is found by
+    bisection, and the number of size evaluations is proportional to the
+    number of runs rather than the number of generations.
+    """
+
+    def size(k):
+        value = epoch.size_at(k)
+        if integer_sizes:
+            value = max(1, round(value))
+        return value
+
+    runs = []
+    if epoch.size_function == "constant" or math.isinf(epoch.start_time):
+        append_run(runs, epoch.start_time, epoch.end_time, size(epoch.end_time))
+        return runs
+    k = epoch.start_time - 1
+    while k >= epoch.end_time:
+        value = size(k)
+        # Find the youngest generation in [end_time, k] with the same size.
+        lo, hi = epoch.end_time, k
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if size(mid) == value:
+                hi = mid
+            else:
+                lo = mid + 1
+        append_run(runs, k + 1, lo, value)
+        k = lo - 1
+    return runs
+
+
+def discretize(
+    graph: parser.Graph, rounding: str = "nearest", integer_sizes: bool = True
+) -> DiscreteGraph:
+    """
+    Return the graph with its times rounded to integer generations.
+
+    The rounding is one of "nearest" (the built-in round()), "floor" or
+    "ceil". If integer_sizes is True, the sizes in the size schedules are
+    rounded to the nearest integer, with a minimum of 1.
+    """
+    if rounding not in ROUNDING:
+        raise ValueError(f"rounding must be one of {list(ROUNDING)}")
+    round_generations = ROUNDING[rounding]
+
+    def to_generations(time):
+        if math.isinf(time):
+            return time
+        return round_generations(time / graph.generation_time)
+
+    zero_length = []
+    demes = {}
+    for deme in graph.demes.values():
+        start_time = to_generations(deme.start_time)
+        epochs = []
+        sizes: List[Run] = []
+        selfing: List[Run] = []
+        cloning: List[Run] = []
+        for j, epoch in enumerate(deme.epochs):
+            end_time = to_generations(epoch.end_time)
+            if end_time == start_time:
+                zero_length.append(ZeroLength("epoch", deme.name, j, end_time))
+                continue
+            discrete_epoch = DiscreteEpoch(
+                start_time=start_time,
+                end_time=end_time,
+                start_size=epoch.start_size,
+                end_size=epoch.end_size,
+                size_function=epoch.size_function,
+                selfing_rate=epoch.selfing_rate,
+                cloning_rate=epoch.cloning_rate,
+            )
+            epochs.append(discrete_epoch)
+            for run in size_runs(discrete_epoch, integer_sizes):
+                append_run(sizes, run.start_time, run.end_time, run.value)
+            append_run(selfing, start_time, end_time, epoch.selfing_rate)
+            append_run(cloning, start_time, end_time, epoch.cloning_rate)
+            start_time = end_time
+        end_time = to_generations(deme.end_time)
+        if len(epochs) == 0:
+            zero_length.append(ZeroLength("deme", deme.name, None, end_time))
+        demes[deme.name] = DiscreteDeme(
+            name=deme.name,
+            start_time=to_generations(deme.start_time),
+            end_time=end_time,
+            epochs=epochs,
+            size_schedule=sizes,
+            selfing_schedule=selfing,
+            cloning_schedule=cloning,
+        )
+
+    migrations = []
+    for j, migration in enumerate(graph.migrations):
+        name = f"{migration.source.name}->{migration.dest.name}"
+        start_time = to_generations(migration.start_time)
+        end_time = to_generations(migration.end_time)
+        if start_time == end_time:
+            zero_length.append(ZeroLength("migration", name, j, end_time))
+            continue
+        migrations.append(
+            DiscreteMigration(
+                source=migration.source.name,
+                dest=migration.dest.name,
+                rate=migration.rate,
+                start_time=start_time,
+                end_time=end_time,
+            )
+        )
+    # Migrations between the same pair of demes don't overlap, and rounding
+    # preserves that, so the runs just need to be put in order.
+    migration_schedules: Dict[Tuple[str, str], List[Run]] = {}
+    for migration in sorted(migrations, key=lambda m: m.start_time, reverse=True):
+        append_run(
+            migration_schedules.setdefault((migration.source, migration.dest), []),
+            migration.start_time,
+            migration.end_time,
+            migration.rate,
+        )
+
+    pulses = [
+        DiscretePulse(
+            sources=[source.name for source in pulse.sources],
+            dest=pulse.dest.name,
+            time=to_generations(pulse.time),
+            proportions=list(pulse.proportions),
+        )
+        for pulse in graph.pulses
+    ]
+    return DiscreteGraph(
+        demes=demes,
+        migrations=migrations,
+        pulses=pulses,
+        migration_schedules=migration_schedules,
+        zero_length=zero_length,
+    )
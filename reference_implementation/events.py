@@ -0,0 +1,228 @@
+# Compilation of a resolved Demes Graph into a list of backward-time events.
+#
+# Coalescent simulators process a model backwards in time, from the present
+# (time zero) into the past, as a sequence of events that change the state of
+# the simulation. The EventList is built once from a resolved graph. Demes are
+# referred to by dense integer indexes, in the order of Graph.demes, and the
+# growth rates of the epochs are precomputed. Events at the same time are
+# grouped into a single EventBatch.
+#
+# Within a batch, the events are ordered so that they can be applied one after
+# another, backwards in time:
+#
+#  1. SizeChange events, for the epochs that begin (backwards in time) at the
+#     batch's time. The first SizeChange for a deme makes it active.
+#  2. MigrationRateChange events.
+#  3. PulseEvents, in the reverse of the order in which they are applied
+#     forwards in time.
+#  4. AncestryEvents, for the demes that start (forwards in time) at the
+#     batch's time. The deme's lineages move to its ancestors, and the deme
+#     becomes inactive.
+from __future__ import annotations
+
+import bisect
+import dataclasses
+import math
+from typing import Dict, List, Tuple, Union
+
+import demes_parser as parser
+
+
+@dataclasses.dataclass
+class SizeChange:
+    """
+    Sets a deme's size parameters for the time above the event's time. The
+    size at time t above the event is
+
+      constant:     initial_size
+      exponential:  initial_size * exp(-growth_rate * (t - time))
+      linear:       initial_size + linear_rate * (t - time)
+    """
+
+    time: float
+    deme: int
+    size_function: str
+    initial_size: float
+    growth_rate: float
+    linear_rate: float
+    selfing_rate: float
+    cloning_rate: float
+
+
+@dataclasses.dataclass
+class MigrationRateChange:
+    """
+    Sets the rate of migration from source to dest (forwards in time) for
+    the time above the event's time. Backwards in time, lineages move from
+    dest to source.
+    """
+
+    time: float
+    source: int
+    dest: int
+    rate: float
+
+
+@dataclasses.dataclass
+class PulseEvent:
+    """
+    A pulse from the sources into dest. Backwards in time, each lineage in
+    dest moves to each source with the corresponding proportion.
+    """
+
+    time: float
+    sources: List[int]
+    dest: int
+    proportions: List[float]
+
+
+@dataclasses.dataclass
+class AncestryEvent:
+    """
+    The start of a deme (forwards in time). Backwards in time, each lineage
+    in the deme moves to each ancestor with the corresponding proportion, and
+    the deme becomes inactive.
+    """
+
+    time: float
+    deme: int
+    ancestors: List[int]
+    proportions: List[float]
+
+
+Event = Union[SizeChange, MigrationRateChange, PulseEvent, AncestryEvent]
+
+
+@dataclasses.dataclass
+class EventBatch:
+    time: float
+    events: List[Event]
+
+
+def size_change(time, deme, epoch, length):
+    growth_rate = 0
+    linear_rate = 0
+    if epoch.size_function == "exponential":
+        growth_rate = math.log(epoch.end_size / epoch.start_size) / length
+    elif epoch.size_function == "linear":
+        linear_rate = (epoch.start_size - epoch.end_size) / length
+    return SizeChange(
+        time=time,
+        deme=deme,
+        size_function=epoch.size_function,
+        initial_size=epoch.end_size,
+        growth_rate=growth_rate,
+        linear_rate=linear_rate,
+        selfing_rate=epoch.selfing_rate,
+        cloning_rate=epoch.cloning_rate,
+    )
+
+
+class EventList:
+    """
+    The events of a resolved graph, in batches from youngest to oldest.
+    """
+
+    def __init__(self, graph: parser.Graph):
+        self.deme_names: List[str] = list(graph.demes)
+        self.deme_index: Dict[str, int] = {
+            name: j for j, name in enumerate(self.deme_names)
+        }
+        # Events of each of the four kinds, by time.
+        size_changes: Dict[float, List[Event]] = {}
+        rate_changes: Dict[float, List[Event]] = {}
+        pulses: Dict[float, List[Event]] = {}
+        ancestry: Dict[float, List[Event]] = {}
+
+        for deme in graph.demes.values():
+            j = self.deme_index[deme.name]
+            start_time = deme.start_time
+            for epoch in deme.epochs:
+                size_changes.setdefault(epoch.end_time, []).append(
+                    size_change(epoch.end_time, j, epoch, start_time - epoch.end_time)
+                )
+                start_time = epoch.end_time
+            if not math.isinf(deme.start_time):
+                ancestry.setdefault(deme.start_time, []).append(
+                    AncestryEvent(
+                        time=deme.start_time,
+                        deme=j,
+                        ancestors=[self.deme_index[a.name] for a in deme.ancestors],
+                        proportions=list(deme.proportions),
+                    )
+                )
+
+        # The migration rate between a pair of demes changes at the start and
+        # end times of its migrations. Migrations between the same pair don't
+        # overlap, so the rate is that of at most one migration.
+        by_pair: Dict[Tuple[int, int], List[parser.Migration]] = {}
+        for migration in graph.migrations:
+            pair = (
+                self.deme_index[migration.source.name],
+                self.deme_index[migration.dest.name],
+            )
+            by_pair.setdefault(pair, []).append(migration)
+        for (source, dest), migrations in by_pair.items():
+            migrations.sort(key=lambda migration: migration.end_time)
+            end_times = [migration.end_time for migration in migrations]
+            boundaries = set(end_times)
+            boundaries.update(migration.start_time for migration in migrations)
+            boundaries.discard(math.inf)
+            rate = 0
+            for time in sorted(boundaries):
+                # The migration, if any, that is ongoing just above the time.
+                k = bisect.bisect_right(end_times, time) - 1
+                new_rate = 0
+                if k >= 0 and time < migrations[k].start_time:
+                    new_rate = migrations[k].rate
+                if new_rate != rate:
+                    rate_changes.setdefault(time, []).append(
+                        MigrationRateChange(time, source, dest, new_rate)
+                    )
+                rate = new_rate
+
+        # Pulses are applied backwards in time in the reverse order.
+        for pulse in reversed(graph.pulses):
+            pulses.setdefault(pulse.time, []).append(
+                PulseEvent(
+                    time=pulse.time,
+                    sources=[self.deme_index[s.name] for s in pulse.sources],
+                    dest=self.deme_index[pulse.dest.name],
+                    proportions=list(pulse.proportions),
+                )
+            )
+
+        times = set(size_changes) | set(rate_changes) | set(pulses) | set(ancestry)
+        self.times: List[float] = sorted(times)
+        self.batches: List[EventBatch] = [
+            EventBatch(
+                time=time,
+                events=size_changes.get(time, [])
+                + rate_changes.get(time, [])
+                + pulses.get(time, [])
+                + ancestry.get(time, []),
+            )
+            for time in self.times
+        ]
+
+    def __len__(self):
+        return len(self.batches)
+
+    def __iter__(self):
+        return iter(self.batches)
+
+    def batch_at(self, time: float) -> Union[EventBatch, None]:
+        """Return the batch of events at the given time, or None."""
+        j = bisect.bisect_left(self.times, time)
+        if j < len(self.times) and self.times[j] == time:
+            return self.batches[j]
+        return None
+
+    def batches_between(self, start_time: float, end_time: float) -> List[EventBatch]:
+        """
+        Return the batches in the time interval (start_time, end_time], from
+        youngest to oldest.
+        """
+        lo = bisect.bisect_left(self.times, end_time)
+        hi = bisect.bisect_left(self.times, start_time)
+        return self.batches[lo:hi]
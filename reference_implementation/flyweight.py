@@ -0,0 +1,244 @@
+# Sharing of identical epochs between the demes of a resolved Demes Graph.
+#
+# Each deme of a resolved graph has its own list of Epoch objects, even though
+# many models have large numbers of demes with exactly the same epochs (e.g.,
+# an island model or a stepping stone grid, where every deme has the same
+# size history). share_epochs() hash-conses the epochs of a graph: each
+# distinct epoch is stored once, as a SharedEpoch, and each distinct sequence
+# of epochs is stored once, as a tuple of SharedEpochs, which is used by all
+# of the demes with that sequence.
+#
+# A deme's epochs are replaced by a SharedEpochs view of the shared tuple,
+# which behaves as a list. The view is copy-on-write: the first time that the
+# list is modified through it (e.g., by Deme.add_epoch() or by assigning to an
+# item), the deme gets a private list of new Epoch objects, and the shared
+# tuple is left unchanged. The epochs of the view are EpochRefs, which refer
+# to a position in the deme's view, as a SharedEpoch doesn't know which of
+# its demes it is being modified through. Writing a field of an EpochRef also
+# gives the deme its private list, and the write goes to the deme's copy of
+# the epoch, which the EpochRef refers to from then on.
+#
+# A shared graph compares equal to the same graph without sharing, and
+# produces the same output.
+from __future__ import annotations
+
+import collections.abc
+import dataclasses
+from typing import Dict, Tuple
+
+import demes_parser as parser
+
+EPOCH_FIELDS = tuple(field.name for field in dataclasses.fields(parser.Epoch))
+
+
+def epoch_values(epoch: parser.Epoch) -> tuple:
+    return tuple(getattr(epoch, name) for name in EPOCH_FIELDS)
+
+
+def epoch_key(epoch: parser.Epoch) -> tuple:
+    # The type of each value is part of the key, as values of different types
+    # may be equal (e.g., 1000 and 1000.0), but aren't output the same.
+    return tuple((type(value), value) for value in epoch_values(epoch))
+
+
+def values_equal(epoch, other) -> bool:
+    # Equal to an Epoch with the same fields, which the dataclass's __eq__
+    # doesn't allow, as it requires the classes to be the same.
+    if not isinstance(other, parser.Epoch):
+        return NotImplemented
+    return epoch_values(epoch) == epoch_values(other)
+
+
+class SharedEpoch(parser.Epoch):
+    """
+    An epoch that is shared by the demes of a graph, and can't be modified.
+    """
+
+    def __init__(self, *args, **kwargs):
+        epoch = parser.Epoch(*args, **kwargs)
+        for name in EPOCH_FIELDS:
+            object.__setattr__(self, name, getattr(epoch, name))
+
+    def __setattr__(self, name, value):
+        raise AttributeError("cannot modify a shared epoch")
+
+    def __delattr__(self, name):
+        raise AttributeError("cannot modify a shared epoch")
+
+    __eq__ = values_equal
+    __hash__ = None
+
+    def copy(self) -> parser.Epoch:
+        return parser.Epoch(*epoch_values(self))
+
+
+class EpochRef(parser.Epoch):
+    """
+    The epoch at a position in a deme's SharedEpochs view. Reading a field
+    reads the deme's epoch, and writing a field writes the deme's private
+    copy of the epoch.
+    """
+
+    def __init__(self, view: SharedEpochs, index: int):
+        self._view = view
+        self._index = index
+
+    def target(self) -> parser.Epoch:
+        """
+        Return the epoch that is referred to: the shared epoch, or the deme's
+        copy of it, if the deme has a private list of epochs.
+        """
+        view = self._view
+        if view.copies is None:
+            return view.epochs[self._index]
+        return view.copies[self._index]
+
+    def detach(self) -> parser.Epoch:
+        """
+        Give the deme a private list of epochs, if it doesn't have one yet,
+        and return the deme's copy of the epoch.
+        """
+        self._view.detach()
+        return self._view.copies[self._index]
+
+    __eq__ = values_equal
+    __hash__ = None
+
+    def __reduce_ex__(self, protocol):
+        # Copies and pickles are plain epochs, which don't refer to the deme.
+        return parser.Epoch, epoch_values(self)
+
+
+def epoch_field(name):
+    def get(self):
+        return getattr(self.target(), name)
+
+    def set(self, value):
+        setattr(self.detach(), name, value)
+
+    def delete(self):
+        delattr(self.detach(), name)
+
+    return property(get, set, delete)
+
+
+for name in EPOCH_FIELDS:
+    setattr(EpochRef, name, epoch_field(name))
+
+
+class SharedEpochs(collections.abc.MutableSequence):
+    """
+    A deme's list of epochs, as a copy-on-write view of a shared tuple of
+    epochs.
+    """
+
+    __slots__ = ("deme", "epochs", "copies")
+
+    def __init__(self, deme: parser.Deme, epochs: Tuple[SharedEpoch, ...]):
+        self.deme = deme
+        self.epochs = epochs
+        # The private copies of the shared epochs, in the same order.
+        self.copies = None
+
+    @property
+    def shared(self) -> bool:
+        return isinstance(self.epochs, tuple)
+
+    def detach(self) -> list:
+        """
+        Give the deme a private list of (modifiable) copies of the shared
+        epochs, if it doesn't have one yet, and return it.
+        """
+        if self.shared:
+            self.epochs = [epoch.copy() for epoch in self.epochs]
+            self.copies = tuple(self.epochs)
+            # The deme's epochs may have been replaced by a list of EpochRefs
+            # (e.g., by normalize.merge_epochs()), which is left as it is.
+            if self.deme.epochs is self:
+                self.deme.epochs = self.epochs
+        return self.epochs
+
+    def __len__(self):
+        return len(self.epochs)
+
+    def __getitem__(self, index):
+        if not self.shared:
+            return self.epochs[index]
+        if isinstance(index, slice):
+            return [EpochRef(self, j) for j in range(len(self.epochs))[index]]
+        return EpochRef(self, range(len(self.epochs))[index])
+
+    def __iter__(self):
+        if not self.shared:
+            return iter(self.epochs)
+        return (EpochRef(self, j) for j in range(len(self.epochs)))
+
+    def __setitem__(self, index, value):
+        self.detach()[index] = value
+
+    def __delitem__(self, index):
+        del self.detach()[index]
+
+    def insert(self, index, value):
+        self.detach().insert(index, value)
+
+    def __eq__(self, other):
+        if not isinstance(other, collections.abc.Sequence):
+            return NotImplemented
+        return len(self) == len(other) and all(a == b for a, b in zip(self, other))
+
+    __hash__ = None
+
+    def __repr__(self):
+        return repr(list(self))
+
+
+@dataclasses.dataclass
+class SharingStats:
+    """
+    The numbers of epochs and epoch sequences before and after sharing.
+    """
+
+    demes: int
+    epochs: int
+    unique_epochs: int
+    unique_sequences: int
+
+
+def share_epochs(graph: parser.Graph) -> SharingStats:
+    """
+    Share identical epochs, and identical sequences of epochs, between the
+    demes of the resolved graph, in place. Returns the numbers of epochs
+    before and after sharing.
+    """
+    epochs: Dict[tuple, SharedEpoch] = {}
+    sequences: Dict[tuple, Tuple[SharedEpoch, ...]] = {}
+    num_epochs = 0
+    for deme in graph.demes.values():
+        keys = tuple(epoch_key(epoch) for epoch in deme.epochs)
+        num_epochs += len(keys)
+        sequence = sequences.get(keys)
+        if sequence is None:
+            sequence = []
+            for key, epoch in zip(keys, deme.epochs):
+                shared = epochs.get(key)
+                if shared is None:
+                    shared = epochs[key] = SharedEpoch(*epoch_values(epoch))
+                sequence.append(shared)
+            sequence = sequences[keys] = tuple(sequence)
+        deme.epochs = SharedEpochs(deme, sequence)
+    return SharingStats(
+        demes=len(graph.demes),
+        epochs=num_epochs,
+        unique_epochs=len(epochs),
+        unique_sequences=len(sequences),
+    )
+
+
+def unshare(deme: parser.Deme):
+    """
+    Give the deme a private list of modifiable epochs, if its epochs are
+    shared.
+    """
+    if isinstance(deme.epochs, SharedEpochs):
+        deme.epochs.detach()
@@ -0,0 +1,304 @@
+# Immutable resolved Demes Graphs, with cached derived properties.
+#
+# Deme.end_time, Deme.time_interval and Migration.time_interval are
+# properties, so they're recomputed (and a new Interval is allocated) each time
+# that they're accessed, as the entities they're derived from may have changed.
+# freeze() makes a resolved and validated graph immutable in place, after
+# which the derived properties can't change, so they're computed once:
+#
+#  - Each entity's class is changed to a Frozen subclass, which raises
+#    dataclasses.FrozenInstanceError if a field is set, or if a method that
+#    modifies the graph (e.g., Graph.add_deme()) is called.
+#  - The lists and dicts in the graph (including the metadata) are replaced by
+#    FrozenLists and FrozenDicts, which compare equal to lists and dicts, but
+#    can't be modified.
+#  - Deme.end_time, Deme.time_interval and Migration.time_interval are cached
+#    (the latter two as FrozenIntervals, which also can't be modified), along
+#    with the start time of each of a deme's epochs, and an array of the
+#    boundaries between them.
+#  - Each entity (and the graph) is hashable, with a precomputed hash value,
+#    so frozen graphs can be used as dict keys and in sets.
+#
+# A frozen graph compares equal to the same graph that isn't frozen, and
+# produces the same output. As nothing in it can change, a frozen graph can be
+# shared between threads without locks, and copy.copy() and copy.deepcopy()
+# return it unchanged.
+from __future__ import annotations
+
+import dataclasses
+import functools
+
+import numpy as np
+
+import demes_parser as parser
+import flyweight
+
+
+def frozen_error(*args, **kwargs):
+    raise dataclasses.FrozenInstanceError("cannot modify a frozen graph")
+
+
+class FrozenList(list):
+    """
+    A list that can't be modified.
+    """
+
+    append = extend = insert = pop = remove = clear = sort = reverse = frozen_error
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = frozen_error
+
+    def __hash__(self):
+        return hash(tuple(self))
+
+    def __reduce__(self):
+        return FrozenList, (list(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenDict(dict):
+    """
+    A dict that can't be modified.
+    """
+
+    __setitem__ = __delitem__ = __ior__ = frozen_error
+    clear = pop = popitem = setdefault = update = frozen_error
+
+    def __reduce__(self):
+        return FrozenDict, (dict(self),)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+def freeze_value(value):
+    # Recursively freeze the lists and dicts in a metadata value.
+    if isinstance(value, dict):
+        return FrozenDict((key, freeze_value(item)) for key, item in value.items())
+    if isinstance(value, list):
+        return FrozenList(freeze_value(item) for item in value)
+    return value
+
+
+def thaw_value(value):
+    if isinstance(value, dict):
+        return {key: thaw_value(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [thaw_value(item) for item in value]
+    return value
+
+
+class Frozen:
+    """
+    Mixin for the frozen entity classes. The hash value is set by freeze().
+    """
+
+    __setattr__ = __delattr__ = frozen_error
+
+    def __hash__(self):
+        return self._hash
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+
+class FrozenInterval(Frozen, parser.Interval):
+    def __init__(self, start_time, end_time):
+        assert start_time > end_time
+        object.__setattr__(self, "start_time", start_time)
+        object.__setattr__(self, "end_time", end_time)
+        object.__setattr__(self, "_hash", hash((start_time, end_time)))
+
+    def __eq__(self, other):
+        if not isinstance(other, parser.Interval):
+            return NotImplemented
+        return (self.start_time, self.end_time) == (other.start_time, other.end_time)
+
+    __hash__ = Frozen.__hash__
+
+
+class FrozenEpoch(Frozen, parser.Epoch):
+    resolve = frozen_error
+
+    def __eq__(self, other):
+        # Equal to an Epoch with the same fields, which the dataclass's
+        # __eq__ doesn't allow, as it requires the classes to be the same.
+        if not isinstance(other, parser.Epoch):
+            return NotImplemented
+        return dataclasses.astuple(self) == dataclasses.astuple(other)
+
+    # Defining __eq__ resets __hash__.
+    __hash__ = Frozen.__hash__
+
+
+class FrozenDeme(Frozen, parser.Deme):
+    add_epoch = resolve = frozen_error
+
+    @functools.cached_property
+    def end_time(self):
+        return self.epochs[-1].end_time
+
+    @functools.cached_property
+    def time_interval(self):
+        return FrozenInterval(self.start_time, self.end_time)
+
+    @functools.cached_property
+    def epoch_start_times(self) -> FrozenList:
+        """
+        The start time of each epoch.
+        """
+        return FrozenList(
+            [self.start_time] + [epoch.end_time for epoch in self.epochs[:-1]]
+        )
+
+    @functools.cached_property
+    def boundaries(self) -> np.ndarray:
+        """
+        A read-only array of the deme's start time, followed by the end time
+        of each epoch.
+        """
+        boundaries = np.array(
+            [self.start_time] + [epoch.end_time for epoch in self.epochs],
+            dtype=float,
+        )
+        boundaries.flags.writeable = False
+        return boundaries
+
+
+class FrozenMigration(Frozen, parser.Migration):
+    resolve = frozen_error
+
+    @functools.cached_property
+    def time_interval(self):
+        return FrozenInterval(self.start_time, self.end_time)
+
+
+class FrozenPulse(Frozen, parser.Pulse):
+    pass
+
+
+class FrozenGraph(Frozen, parser.Graph):
+    add_deme = add_migration = add_pulse = resolve = sort_pulses = frozen_error
+
+    def as_json_dict(self):
+        data = super().as_json_dict()
+        data["metadata"] = thaw_value(self.metadata)
+        return data
+
+    def __reduce_ex__(self, protocol):
+        return graph_from_state, (parser.graph_state(self),)
+
+
+def freeze_object(obj, cls, hash_value):
+    object.__setattr__(obj, "__class__", cls)
+    object.__setattr__(obj, "_hash", hash_value)
+
+
+def freeze_deme(deme):
+    # Epochs may be shared between demes, see flyweight.py, in which case the
+    # shared epochs are frozen, rather than the deme's references to them.
+    epochs = [
+        epoch.target() if isinstance(epoch, flyweight.EpochRef) else epoch
+        for epoch in deme.epochs
+    ]
+    for epoch in epochs:
+        if not isinstance(epoch, FrozenEpoch):
+            freeze_object(epoch, FrozenEpoch, hash(dataclasses.astuple(epoch)))
+    deme.epochs = FrozenList(epochs)
+    deme.ancestors = FrozenList(deme.ancestors)
+    deme.proportions = FrozenList(deme.proportions)
+    freeze_object(
+        deme,
+        FrozenDeme,
+        hash(
+            (
+                deme.name,
+                deme.start_time,
+                deme.description,
+                tuple(ancestor.name for ancestor in deme.ancestors),
+                tuple(deme.proportions),
+                tuple(deme.epochs),
+            )
+        ),
+    )
+    # Compute the cached properties now, so that the deme isn't modified
+    # after it's frozen.
+    for name in ["end_time", "time_interval", "epoch_start_times", "boundaries"]:
+        getattr(deme, name)
+
+
+def graph_from_state(state: tuple) -> FrozenGraph:
+    # Unpickle a frozen graph, see Graph.__reduce_ex__().
+    return freeze(parser.graph_from_state(state))
+
+
+def freeze(graph: parser.Graph) -> FrozenGraph:
+    """
+    Make the resolved and validated graph immutable, in place, and return it.
+    """
+    if isinstance(graph, FrozenGraph):
+        return graph
+    for deme in graph.demes.values():
+        freeze_deme(deme)
+    for migration in graph.migrations:
+        freeze_object(
+            migration,
+            FrozenMigration,
+            hash(
+                (
+                    migration.rate,
+                    migration.start_time,
+                    migration.end_time,
+                    migration.source.name,
+                    migration.dest.name,
+                )
+            ),
+        )
+        migration.time_interval
+    for pulse in graph.pulses:
+        pulse.sources = FrozenList(pulse.sources)
+        pulse.proportions = FrozenList(pulse.proportions)
+        freeze_object(
+            pulse,
+            FrozenPulse,
+            hash(
+                (
+                    tuple(source.name for source in pulse.sources),
+                    pulse.dest.name,
+                    pulse.time,
+                    tuple(pulse.proportions),
+                )
+            ),
+        )
+    graph.doi = FrozenList(graph.doi)
+    graph.metadata = freeze_value(graph.metadata)
+    graph.demes = FrozenDict(graph.demes)
+    graph.migrations = FrozenList(graph.migrations)
+    graph.pulses = FrozenList(graph.pulses)
+    # The metadata isn't hashed, as it may contain unhashable values. Equal
+    # graphs still have equal hashes.
+    freeze_object(
+        graph,
+        FrozenGraph,
+        hash(
+            (
+                graph.time_units,
+                graph.generation_time,
+                tuple(graph.doi),
+                graph.description,
+                tuple(graph.demes.items()),
+                tuple(graph.migrations),
+                tuple(graph.pulses),
+            )
+        ),
+    )
+    return graph
@@ -0,0 +1,198 @@
+# Programmatic construction of a Demes Graph.
+#
+# The parse() function takes a JSON-like dict, copies it, and then pops each
+# field back out of it. Programs that generate models would need to build that
+# dict only for it to be taken apart again. The GraphBuilder instead takes the
+# values directly as arguments, checks each one in the same way that parse()
+# does, and adds the entities to the Graph. The build() method then resolves
+# and validates the Graph, exactly as parse() does.
+#
+# Unlike parse(), the builder has no "defaults" sections: values that are
+# omitted take the same values that parse() would use if no defaults were
+# given. Times may be given as math.inf, but not as the string "Infinity".
+from __future__ import annotations
+
+import numbers
+from typing import List, Union
+
+import demes_parser as parser
+
+
+def is_positive(value):
+    # Start times may be infinite.
+    return value > 0
+
+
+def check(name, value, required_type, validator=None):
+    # Values of None are left for the resolution step to fill in.
+    if value is not None:
+        parser.validate_item(name, value, required_type, validator)
+
+
+def check_list(name, value, required_type, validator):
+    parser.validate_item(name, value, list)
+    for item in value:
+        parser.validate_item(name, item, required_type, validator)
+
+
+class GraphBuilder:
+    """
+    Builds a fully-resolved Graph from a sequence of method calls.
+    """
+
+    def __init__(
+        self,
+        *,
+        time_units: str,
+        generation_time: Union[float, None] = None,
+        description: str = "",
+        doi: Union[List[str], None] = None,
+        metadata: Union[dict, None] = None,
+    ):
+        doi = [] if doi is None else doi
+        metadata = {} if metadata is None else metadata
+        check("time_units", time_units, str)
+        check(
+            "generation_time",
+            generation_time,
+            numbers.Number,
+            parser.is_positive_and_finite,
+        )
+        check("description", description, str)
+        check_list("doi", doi, str, parser.is_nonempty)
+        check("metadata", metadata, dict)
+        self._graph = parser.Graph(
+            time_units=time_units,
+            generation_time=generation_time,
+            description=description,
+            doi=doi,
+            metadata=metadata,
+        )
+
+    @property
+    def graph(self) -> parser.Graph:
+        if self._graph is None:
+            raise ValueError("The graph has already been built")
+        return self._graph
+
+    def add_deme(
+        self,
+        name: str,
+        *,
+        description: str = "",
+        start_time: Union[float, None] = None,
+        ancestors: Union[List[str], None] = None,
+        proportions: Union[List[float], None] = None,
+    ) -> parser.Deme:
+        """
+        Add a deme to the graph. Epochs must then be added with add_epoch().
+        """
+        ancestors = [] if ancestors is None else ancestors
+        check("name", name, str, parser.is_identifier)
+        check("description", description, str)
+        check("start_time", start_time, numbers.Number, is_positive)
+        check_list("ancestors", ancestors, str, parser.is_identifier)
+        if proportions is not None:
+            check_list("proportions", proportions, numbers.Number, parser.is_proportion)
+        return self.graph.add_deme(
+            name=name,
+            description=description,
+            start_time=start_time,
+            ancestors=ancestors,
+            proportions=proportions,
+        )
+
+    def add_epoch(
+        self,
+        deme: str,
+        *,
+        end_time: Union[float, None] = None,
+        start_size: Union[float, None] = None,
+        end_size: Union[float, None] = None,
+        selfing_rate: float = 0,
+        cloning_rate: float = 0,
+        size_function: Union[str, None] = None,
+    ) -> parser.Epoch:
+        """
+        Add an epoch to the end of the named deme's list of epochs.
+        """
+        check("end_time", end_time, numbers.Number, parser.is_non_negative_and_finite)
+        check("start_size", start_size, numbers.Number, parser.is_positive_and_finite)
+        check("end_size", end_size, numbers.Number, parser.is_positive_and_finite)
+        check("selfing_rate", selfing_rate, numbers.Number, parser.is_rate)
+        check("cloning_rate", cloning_rate, numbers.Number, parser.is_rate)
+        check("size_function", size_function, str)
+        return self.graph.demes[deme].add_epoch(
+            end_time=end_time,
+            start_size=start_size,
+            end_size=end_size,
+            selfing_rate=selfing_rate,
+            cloning_rate=cloning_rate,
+            size_function=size_function,
+        )
+
+    def add_migration(
+        self,
+        *,
+        rate: float,
+        source: Union[str, None] = None,
+        dest: Union[str, None] = None,
+        demes: Union[List[str], None] = None,
+        start_time: Union[float, None] = None,
+        end_time: Union[float, None] = None,
+    ) -> List[parser.Migration]:
+        """
+        Add an asymmetric migration (from source to dest), or symmetric
+        migrations between all pairs of the given demes.
+        """
+        check("rate", rate, numbers.Number, parser.is_rate)
+        check("source", source, str, parser.is_nonempty)
+        check("dest", dest, str, parser.is_nonempty)
+        if demes is not None:
+            check_list("demes", demes, str, parser.is_identifier)
+        check("start_time", start_time, numbers.Number, is_positive)
+        check("end_time", end_time, numbers.Number, parser.is_non_negative_and_finite)
+        return self.graph.add_migration(
+            rate=rate,
+            start_time=start_time,
+            end_time=end_time,
+            source=source,
+            dest=dest,
+            demes=demes,
+        )
+
+    def add_pulse(
+        self,
+        *,
+        sources: List[str],
+        dest: str,
+        time: float,
+        proportions: List[float],
+    ) -> parser.Pulse:
+        check_list("sources", sources, str, parser.is_identifier)
+        check("dest", dest, str, parser.is_identifier)
+        parser.validate_item(
+            "time", time, numbers.Number, parser.is_positive_and_finite
+        )
+        check_list("proportions", proportions, numbers.Number, parser.is_proportion)
+        return self.graph.add_pulse(
+            sources=sources, dest=dest, time=time, proportions=proportions
+        )
+
+    def build(self) -> parser.Graph:
+        """
+        Resolve and validate the graph, and return it.
+
+        The builder can't be used any further once build() has been called,
+        whether or not the graph was valid.
+        """
+        graph = self.graph
+        self._graph = None
+        if len(graph.demes) == 0:
+            raise ValueError("the graph must have one or more demes")
+        for deme in graph.demes.values():
+            if len(deme.epochs) == 0:
+                raise ValueError(f"no epochs for deme {deme.name}")
+        graph.resolve()
+        graph.validate()
+        return graph
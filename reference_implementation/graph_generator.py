@@ -0,0 +1,243 @@
+# Random generation of valid Demes models.
+#
+# The schema-based strategies from hypothesis_jsonschema produce documents
+# that have the right structure, but almost all of them are semantically
+# invalid (e.g., demes that don't exist when their descendants start), so they
+# don't exercise the resolution and validation code much beyond the first
+# error. The generator here constructs HDM documents that are valid by
+# construction, with knobs to control their size, for stress testing and
+# benchmarking.
+#
+# Demes are arranged in levels of ancestry. The root demes (level 0) have an
+# infinite start time, and each deme at level d > 0 starts within the time
+# band for its level and has ancestors at lower levels, which are older:
+#
+#   level d starts within (BAND * (depth - d), BAND * (depth - d + 1))
+#
+# A deme's end time is chosen after all of its descendants, so that it exists
+# when each of them starts. Migrations and pulses are then added between demes
+# that exist at the same time.
+#
+# random_graph() takes a seed (or a random.Random instance), and graphs()
+# returns a Hypothesis strategy, so that Hypothesis can shrink the knobs and
+# the random choices.
+from __future__ import annotations
+
+import math
+import random
+from typing import Union
+
+BAND = 1000
+SIZE_FUNCTIONS = ["constant", "exponential", "linear"]
+
+
+def uniform_within(rng, low, high):
+    # A uniform value strictly within (low, high), avoiding the endpoints.
+    return low + (high - low) * (0.05 + 0.9 * rng.random())
+
+
+def random_size(rng):
+    return round(10 ** rng.uniform(2, 5))
+
+
+def random_epochs(rng, start_time, end_time, num_epochs):
+    # Epochs with end times in decreasing order, and a size function that's
+    # valid for their time interval. The first epoch of a root deme is
+    # infinitely long, so must have a constant size. Repeated end times are
+    # dropped, so there may be fewer than num_epochs epochs.
+    finite_start = min(start_time, end_time + BAND)
+    end_times = sorted(
+        {uniform_within(rng, end_time, finite_start) for _ in range(num_epochs - 1)},
+        reverse=True,
+    )
+    epochs = []
+    for j, epoch_end_time in enumerate(end_times + [end_time]):
+        size_function = rng.choice(SIZE_FUNCTIONS)
+        if j == 0 and math.isinf(start_time):
+            size_function = "constant"
+        epoch = {"end_time": epoch_end_time, "start_size": random_size(rng)}
+        if size_function == "constant":
+            epoch["end_size"] = epoch["start_size"]
+        else:
+            epoch["end_size"] = random_size(rng)
+            epoch["size_function"] = size_function
+        if rng.random() < 0.1:
+            epoch["selfing_rate"] = rng.random()
+        if rng.random() < 0.1:
+            epoch["cloning_rate"] = rng.random()
+        epochs.append(epoch)
+    return epochs
+
+
+def random_proportions(rng, n, total=1):
+    weights = [rng.uniform(0.1, 1) for _ in range(n)]
+    return [total * weight / sum(weights) for weight in weights]
+
+
+def random_graph(
+    seed: Union[int, random.Random, None] = None,
+    *,
+    num_demes: int = 10,
+    depth: int = 3,
+    max_epochs: int = 3,
+    max_ancestors: int = 2,
+    migration_density: float = 0.1,
+    num_pulse_times: int = 2,
+    pulses_per_time: int = 1,
+) -> dict:
+    """
+    Return a random, valid HDM document.
+
+    :param seed: A seed, or a random.Random instance to draw from.
+    :param num_demes: The number of demes.
+    :param depth: The maximum number of levels of ancestry below the roots.
+    :param max_epochs: The maximum number of epochs per deme.
+    :param max_ancestors: The maximum number of ancestors per deme.
+    :param migration_density: The probability of migration between each
+        pair of demes whose time intervals overlap.
+    :param num_pulse_times: The number of distinct pulse times.
+    :param pulses_per_time: The number of pulses at each pulse time. Fewer
+        pulses are added if fewer than two demes exist at the pulse time.
+    """
+    if num_demes < 1:
+        raise ValueError("num_demes must be at least 1")
+    if depth < 0 or max_epochs < 1 or max_ancestors < 1:
+        raise ValueError(
+            "depth must be non-negative, and max_epochs and "
+            "max_ancestors must be positive"
+        )
+    rng = seed if isinstance(seed, random.Random) else random.Random(seed)
+    names = [f"deme{j}" for j in range(num_demes)]
+
+    # The ancestry of each deme.
+    levels = [0]
+    start_times = [math.inf]
+    ancestors = [[]]
+    for j in range(1, num_demes):
+        level = 0
+        if depth > 0:
+            level = rng.randint(0, min(depth, max(levels) + 1))
+        levels.append(level)
+        if level == 0:
+            start_times.append(math.inf)
+            ancestors.append([])
+            continue
+        start_times.append(
+            uniform_within(rng, BAND * (depth - level), BAND * (depth - level + 1))
+        )
+        candidates = [k for k in range(j) if levels[k] < level]
+        num_ancestors = rng.randint(1, min(max_ancestors, len(candidates)))
+        ancestors.append(sorted(rng.sample(candidates, num_ancestors)))
+
+    # Each deme ends before any of its descendants start.
+    end_times = []
+    for j in range(num_demes):
+        latest = min(
+            [start_times[j]]
+            + [start_times[k] for k in range(num_demes) if j in ancestors[k]]
+        )
+        end_time = 0
+        if rng.random() < 0.3:
+            end_time = uniform_within(rng, 0, min(latest, BAND * (depth + 1)))
+        end_times.append(end_time)
+
+    demes = []
+    for j in range(num_demes):
+        deme = {"name": names[j]}
+        if len(ancestors[j]) > 0:
+            deme["ancestors"] = [names[k] for k in ancestors[j]]
+            deme["proportions"] = random_proportions(rng, len(ancestors[j]))
+            deme["start_time"] = start_times[j]
+        deme["epochs"] = random_epochs(
+            rng, start_times[j], end_times[j], rng.randint(1, max_epochs)
+        )
+        demes.append(deme)
+
+    # Migration between pairs of demes that exist at the same time. The rates
+    # are small enough that the total migration into any deme is below 1.
+    migrations = []
+    max_rate = min(1e-3, 1 / num_demes)
+    for a in range(num_demes):
+        for b in range(num_demes):
+            start_time = min(start_times[a], start_times[b])
+            end_time = max(end_times[a], end_times[b])
+            if a == b or start_time <= end_time:
+                continue
+            if rng.random() >= migration_density:
+                continue
+            migration = {
+                "source": names[a],
+                "dest": names[b],
+                "rate": rng.uniform(0, max_rate),
+            }
+            if rng.random() < 0.5:
+                migration_start_time = uniform_within(
+                    rng, end_time, min(start_time, end_time + BAND)
+                )
+                migration["start_time"] = migration_start_time
+                if rng.random() < 0.5:
+                    migration["end_time"] = uniform_within(
+                        rng, end_time, migration_start_time
+                    )
+            migrations.append(migration)
+
+    # Pulses at distinct times, between demes that exist at the time.
+    pulses = []
+    for _ in range(num_pulse_times):
+        time = uniform_within(rng, 0, BAND * (depth + 1))
+        sources = [j for j in range(num_demes) if start_times[j] > time >= end_times[j]]
+        dests = [j for j in range(num_demes) if start_times[j] >= time > end_times[j]]
+        for _ in range(pulses_per_time):
+            dest_choices = [j for j in dests if any(k != j for k in sources)]
+            if len(dest_choices) == 0:
+                break
+            dest = rng.choice(dest_choices)
+            choices = [k for k in sources if k != dest]
+            pulse_sources = rng.sample(choices, rng.randint(1, min(2, len(choices))))
+            pulses.append(
+                {
+                    "sources": [names[k] for k in pulse_sources],
+                    "dest": names[dest],
+                    "time": time,
+                    "proportions": random_proportions(
+                        rng, len(pulse_sources), rng.uniform(0.01, 0.5)
+                    ),
+                }
+            )
+
+    graph = {"time_units": "generations", "demes": demes}
+    if len(migrations) > 0:
+        graph["migrations"] = migrations
+    if len(pulses) > 0:
+        graph["pulses"] = pulses
+    return graph
+
+
+def graphs(
+    *,
+    max_demes: int = 10,
+    max_depth: int = 3,
+    max_epochs: int = 3,
+    max_ancestors: int = 2,
+    max_migration_density: float = 0.5,
+    max_pulse_times: int = 3,
+    max_pulses_per_time: int = 2,
+):
+    """
+    Return a Hypothesis strategy for random, valid HDM documents, with knobs
+    up to the given maximums.
+    """
+    # Imported here, so that random_graph() can be used without Hypothesis.
+    from hypothesis import strategies as st
+
+    return st.builds(
+        random_graph,
+        st.randoms(use_true_random=False),
+        num_demes=st.integers(1, max_demes),
+        depth=st.integers(0, max_depth),
+        max_epochs=st.integers(1, max_epochs),
+        max_ancestors=st.integers(1, max_ancestors),
+        migration_density=st.floats(0, max_migration_density),
+        num_pulse_times=st.integers(0, max_pulse_times),
+        pulses_per_time=st.integers(1, max_pulses_per_time),
+    )
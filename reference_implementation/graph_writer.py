@@ -0,0 +1,107 @@
+# Streaming output of a resolved Demes Graph.
+#
+# Graph.as_json_dict() builds a dict for the whole graph, which json.dumps()
+# then turns into a single string, so for a large graph the object model, the
+# dict tree and the output string are all held in memory at once. The writer
+# here walks the graph instead, and serialises each deme, migration and pulse
+# separately, writing it to the output stream before moving on to the next.
+# Only one entity's dict exists at a time, so the memory used by the
+# writer doesn't grow with the size of the graph.
+#
+# The formats are:
+#
+#   pretty:   identical to json.dumps(graph.as_json_dict(), indent=2)
+#   compact:  identical to json.dumps(graph.as_json_dict(), separators=(",", ":"))
+#   yaml:     a YAML document with the same data
+#
+# The JSON formats are written with json.dump(), which encodes its input
+# incrementally and writes each chunk to the stream as it goes. The lists of
+# demes, migrations and pulses in its input are LazyLists, which create the
+# dict for each entity as the encoder iterates over them, so the output is
+# exactly that of json.dumps() on the whole dict tree.
+import json
+
+FORMATS = ("pretty", "compact", "yaml")
+
+
+class LazyList(list):
+    """
+    A list whose items are generated each time it is iterated over.
+
+    The json encoder accepts list subclasses, and only uses len() and
+    iteration on them.
+    """
+
+    def __init__(self, length, items):
+        super().__init__()
+        self.length = length
+        self.items = items
+
+    def __len__(self):
+        return self.length
+
+    def __iter__(self):
+        return iter(self.items())
+
+
+def graph_fields(graph):
+    # The fields of graph.as_json_dict(), in the same order, with the lists
+    # of entities as LazyLists.
+    return {
+        "time_units": graph.time_units,
+        "generation_time": graph.generation_time,
+        "doi": list(graph.doi),
+        "description": graph.description,
+        "metadata": graph.metadata,
+        "demes": LazyList(
+            len(graph.demes),
+            lambda: (deme.as_json_dict() for deme in graph.demes.values()),
+        ),
+        "migrations": LazyList(
+            len(graph.migrations),
+            lambda: (migration.as_json_dict() for migration in graph.migrations),
+        ),
+        "pulses": LazyList(
+            len(graph.pulses), lambda: (pulse.as_json_dict() for pulse in graph.pulses)
+        ),
+    }
+
+
+def write_yaml(graph, stream):
+    # Imported here, as ruamel.yaml is slow to import and isn't needed for
+    # JSON output.
+    from ruamel.yaml import YAML
+
+    yaml = YAML(typ="safe")
+    yaml.default_flow_style = False
+    # Keep the keys in the same order as the JSON output.
+    yaml.sort_base_mapping_type_on_output = False
+    for key, value in graph_fields(graph).items():
+        if not isinstance(value, LazyList):
+            yaml.dump({key: value}, stream)
+            continue
+        if len(value) == 0:
+            stream.write(f"{key}: []\n")
+            continue
+        # Each entity is dumped as a single-item sequence, which is
+        # indistinguishable from an item of the sequence under the key.
+        stream.write(f"{key}:\n")
+        for item in value:
+            yaml.dump([item], stream)
+
+
+def write_graph(graph, stream, format="pretty"):
+    """
+    Write the resolved graph to the text stream, in the given format. See
+    FORMATS.
+    """
+    if format == "pretty":
+        json.dump(graph_fields(graph), stream, indent=2)
+        stream.write("\n")
+    elif format == "compact":
+        json.dump(graph_fields(graph), stream, separators=(",", ":"))
+        stream.write("\n")
+    elif format == "yaml":
+        write_yaml(graph, stream)
+    else:
+        raise ValueError(f"format must be one of {list(FORMATS)}")
@@ -0,0 +1,82 @@
+# Normalisation passes over a resolved Demes Graph.
+#
+# merge_epochs() merges runs of adjacent epochs within a deme that describe a
+# single size trajectory, so that code that loops over Deme.epochs has fewer
+# epochs to visit. Two adjacent epochs are merged if they have the same
+# selfing and cloning rates, the size is continuous between them (the older
+# epoch's end_size is the younger epoch's start_size), and
+#
+#  - both have a constant size, i.e. their start and end sizes are all
+#    equal, whatever their size_function; or
+#  - both are exponential, with the same growth rate; or
+#  - both are linear, with the same slope.
+#
+# The merged epoch has the older epoch's start_size and the younger epoch's
+# end_time and end_size, so the size at each time is unchanged, up to the
+# rounding error in evaluating the size function over the longer interval.
+# Growth rates and slopes are compared with a relative tolerance of REL_TOL,
+# as they are computed from the sizes and times of each epoch.
+from __future__ import annotations
+
+import math
+
+import demes_parser as parser
+
+REL_TOL = 1e-9
+
+
+def size_rate(epoch: parser.Epoch, start_time: float) -> float:
+    # The rate of change of the size over the epoch, forwards in time.
+    length = start_time - epoch.end_time
+    if epoch.size_function == "exponential":
+        return math.log(epoch.end_size / epoch.start_size) / length
+    return (epoch.end_size - epoch.start_size) / length
+
+
+def mergeable(
+    older: parser.Epoch, older_start_time: float, younger: parser.Epoch
+) -> bool:
+    if (
+        older.selfing_rate != younger.selfing_rate
+        or older.cloning_rate != younger.cloning_rate
+        or older.end_size != younger.start_size
+    ):
+        return False
+    older_constant = older.start_size == older.end_size
+    younger_constant = younger.start_size == younger.end_size
+    if older_constant or younger_constant:
+        return older_constant and younger_constant
+    if older.size_function != younger.size_function:
+        return False
+    return math.isclose(
+        size_rate(older, older_start_time),
+        size_rate(younger, older.end_time),
+        rel_tol=REL_TOL,
+    )
+
+
+def merge_epochs(graph: parser.Graph) -> int:
+    """
+    Merge adjacent epochs with the same size trajectory within each deme of
+    the resolved graph, in place. Returns the number of epochs removed.
+    """
+    removed = 0
+    for deme in graph.demes.values():
+        epochs = [deme.epochs[0]]
+        # The start time of the last epoch in the merged list.
+        start_time = deme.start_time
+        for epoch in deme.epochs[1:]:
+            last = epochs[-1]
+            if not mergeable(last, start_time, epoch):
+                start_time = last.end_time
+                epochs.append(epoch)
+                continue
+            if last.size_function != epoch.size_function:
+                # Only constant epochs with different size functions are
+                # merged.
+                last.size_function = "constant"
+            last.end_time = epoch.end_time
+            last.end_size = epoch.end_size
+            removed += 1
+        deme.epochs = epochs
+    return removed
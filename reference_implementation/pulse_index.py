@@ -0,0 +1,138 @@
+# An index over the pulses of a resolved Demes Graph.
+#
+# Graph.resolve() sorts pulses from oldest to youngest, keeping the order of
+# pulses that occur at the same time. The specification says that pulses at
+# the same time are applied sequentially, in the order they are listed, so
+# every consumer must otherwise replay each group of simultaneous pulses to
+# find the net ancestry proportions. The PulseIndex groups pulses by time,
+# composes each group into a single sparse admixture matrix, and supports
+# finding the pulses in a time window by bisection.
+from __future__ import annotations
+
+import bisect
+import dataclasses
+from typing import Dict, List, Union
+
+import demes_parser as parser
+
+
+@dataclasses.dataclass
+class PulseGroup:
+    """
+    The pulses that occur at a single time, in the order they are applied.
+    """
+
+    time: float
+    pulses: List[parser.Pulse]
+    # Maps each deme affected by the group to its ancestry immediately after
+    # the pulses, as proportions of the demes before the pulses. Demes that
+    # aren't affected by any pulse in the group are omitted.
+    admixture: Dict[str, Dict[str, float]]
+    # True if applying the pulses in a different order could give different
+    # ancestry proportions.
+    order_dependent: bool
+
+
+def compose_pulses(pulses: List[parser.Pulse]) -> Dict[str, Dict[str, float]]:
+    """
+    Return the ancestry proportions obtained by applying the pulses in order.
+
+    This generalises the procedure given in the specification to pulses into
+    more than one destination: if a pulse's source deme was itself the
+    destination of an earlier pulse, the source's updated ancestry is used.
+    """
+    admixture: Dict[str, Dict[str, float]] = {}
+    for pulse in pulses:
+        dest = pulse.dest.name
+        ancestry = {
+            name: (1 - sum(pulse.proportions)) * proportion
+            for name, proportion in admixture.get(dest, {dest: 1}).items()
+        }
+        for source, proportion in zip(pulse.sources, pulse.proportions):
+            for name, p in admixture.get(source.name, {source.name: 1}).items():
+                ancestry[name] = ancestry.get(name, 0) + proportion * p
+        admixture[dest] = ancestry
+    return admixture
+
+
+def is_order_dependent(pulses: List[parser.Pulse]) -> bool:
+    """
+    True if the outcome of the pulses could depend on the order they are
+    applied in.
+
+    Two pulses commute unless they have the same destination, or the
+    destination of one is a source of the other. The first case is the one
+    illustrated in the specification.
+    """
+    dests = [pulse.dest.name for pulse in pulses]
+    if len(set(dests)) != len(dests):
+        return True
+    dests = set(dests)
+    return any(source.name in dests for pulse in pulses for source in pulse.sources)
+
+
+class PulseIndex:
+    """
+    The pulses of a resolved graph, grouped by time.
+
+    Groups are listed from oldest to youngest, matching the order of
+    Graph.pulses.
+    """
+
+    def __init__(self, graph: parser.Graph):
+        self.groups: List[PulseGroup] = []
+        pulses_by_time: Dict[float, List[parser.Pulse]] = {}
+        for pulse in graph.pulses:
+            pulses_by_time.setdefault(pulse.time, []).append(pulse)
+        for time in sorted(pulses_by_time, reverse=True):
+            pulses = pulses_by_time[time]
+            self.groups.append(
+                PulseGroup(
+                    time=time,
+                    pulses=pulses,
+                    admixture=compose_pulses(pulses),
+                    order_dependent=is_order_dependent(pulses),
+                )
+            )
+        # Group times in increasing order, for use with the bisect module.
+        self._times = [group.time for group in reversed(self.groups)]
+
+    def __len__(self):
+        return len(self.groups)
+
+    def __iter__(self):
+        return iter(self.groups)
+
+    def group_at(self, time: float) -> Union[PulseGroup, None]:
+        """Return the group of pulses at the given time, or None."""
+        j = bisect.bisect_left(self._times, time)
+        if j < len(self._times) and self._times[j] == time:
+            return self.groups[len(self._times) - j - 1]
+        return None
+
+    def groups_between(self, start_time: float, end_time: float) -> List[PulseGroup]:
+        """
+        Return the groups of pulses in the half-open time interval
+        (start_time, end_time], from oldest to youngest.
+        """
+        # Groups with end_time <= time < start_time, mapped from the
+        # increasing order of self._times to the decreasing order of groups.
+        n = len(self._times)
+        lo = bisect.bisect_left(self._times, end_time)
+        hi = bisect.bisect_left(self._times, start_time)
+        return self.groups[n - hi : n - lo]
+
+    def pulses_between(self, start_time: float, end_time: float) -> List[parser.Pulse]:
+        """
+        Return the pulses in the half-open time interval (start_time, end_time],
+        in the order in which they are applied.
+        """
+        return [
+            pulse
+            for group in self.groups_between(start_time, end_time)
+            for pulse in group.pulses
+        ]
+
+    def order_dependent_groups(self) -> List[PulseGroup]:
+        """Return the groups whose outcome depends on the order of the pulses."""
+        return [group for group in self.groups if group.order_dependent]
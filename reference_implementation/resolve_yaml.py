@@ -1,16 +1,347 @@
 # Convert a yaml Demes model to a fully qualified json model and write
-# to stdout.
+# to stdout. The --format option selects pretty-printed JSON (the default),
+# compact JSON or YAML output, which is written as the graph is walked,
+# without building the whole output in memory (see graph_writer.py).
+#
+# With the --worker option, requests are instead read from stdin, one JSON
+# object per line, and a JSON response is written to stdout for each request,
+# also one per line. This avoids paying the interpreter startup cost for every
+# model. A request has an optional "id", which is copied to the response, and
+# either a "path" to a YAML/JSON file, or an inline YAML/JSON "document":
+#
+#   {"id": 1, "path": "examples/zigzag.yaml"}
+#   {"id": 2, "document": "time_units: generations\ndemes: ..."}
+#
+# The response contains either the resolved "graph", or an "error" with the
+# exception "type" and "message":
+#
+#   {"id": 1, "graph": {...}}
+#   {"id": 2, "error": {"type": "ValueError", "message": "..."}}
+#
+# With the --all option, the file is read as a stream of YAML documents
+# (separated by "---" lines), which are loaded and resolved one at a time, so
+# that memory use doesn't grow with the number of documents. One line of JSON
+# is written for each document, with its "index" in the stream, and either
+# the resolved "graph" or an "error" as above:
+#
+#   {"index": 0, "graph": {...}}
+#   {"index": 1, "error": {"type": "ValueError", "message": "..."}}
+#
+# A YAML syntax error ends the stream, as the documents after it can't be
+# found reliably.
+#
+# Input files may be compressed with gzip, bzip2 or xz, which is detected from
+# the magic bytes at the start of the file, and the file is decompressed as it
+# is read. The output is written to stdout, or to the file given with the
+# --output option, which is compressed if its name ends in .gz, .bz2 or .xz.
+# The resolved graph is written through the compressor as it is serialised.
 import sys
 import json
-from ruamel.yaml import YAML
+import argparse
+import contextlib
+import importlib
+import io
+import pathlib
 
 import demes_parser as parser
+import graph_writer
 
 
-if __name__ == "__main__":
+class LazyYAML:
+    """
+    A YAML loader that imports ruamel.yaml the first time it is used.
+
+    Importing ruamel.yaml takes a significant fraction of the run time for
+    small models, and isn't needed at all for JSON input. The C-accelerated
+    loader from ruamel.yaml.clib is used if it is installed, and otherwise
+    the pure-Python loader.
+    """
+
+    def __init__(self):
+        self._yaml = None
+
+    def _loader(self):
+        if self._yaml is None:
+            from ruamel.yaml import YAML, __with_libyaml__
+
+            self._yaml = YAML(typ="safe", pure=not __with_libyaml__)
+        return self._yaml
+
+    def load(self, stream):
+        return self._loader().load(stream)
+
+    def load_all(self, stream):
+        """Return an iterator over the documents in the stream."""
+        return self._loader().load_all(stream)
+
+
+# The compression modules from the standard library, by the magic bytes at the
+# start of a compressed file, and by file extension. The modules are imported
+# when they are used, to keep the start up time down.
+COMPRESSION_MAGIC = {
+    b"\x1f\x8b": "gzip",
+    b"BZh": "bz2",
+    b"\xfd7zXZ\x00": "lzma",
+}
+COMPRESSION_SUFFIXES = {
+    ".gz": "gzip",
+    ".bz2": "bz2",
+    ".xz": "lzma",
+}
+
+
+class DecompressingReader(io.BufferedReader):
+    """
+    A buffered reader of a decompressed stream, which also closes the
+    compressed file that it's read from.
+    """
+
+    def __init__(self, stream, source):
+        super().__init__(stream)
+        self.source = source
+
+    def close(self):
+        try:
+            super().close()
+        finally:
+            self.source.close()
+
+
+def open_input(path, text=False):
+    """
+    Open a file for reading, in binary or text mode, decompressing it if it
+    starts with the magic bytes of a supported compression format.
+
+    The file is only opened once, so that pipes (e.g., /dev/stdin) can be read.
+    """
+    source = open(path, "rb")
+    head = source.peek(max(map(len, COMPRESSION_MAGIC)))
+    stream = source
+    for magic, module in COMPRESSION_MAGIC.items():
+        if head.startswith(magic):
+            compression = importlib.import_module(module)
+            stream = DecompressingReader(compression.open(source, "rb"), source)
+            break
+    if text:
+        stream = io.TextIOWrapper(stream, encoding="utf-8")
+    return stream
+
+
+def open_output(path):
+    """
+    Open a file for writing text, compressing it if its extension is that of
+    a supported compression format. If path is None, stdout is used.
+    """
+    if path is None:
+        return contextlib.nullcontext(sys.stdout)
+    module = COMPRESSION_SUFFIXES.get(pathlib.PurePath(path).suffix.lower())
+    if module is not None:
+        compression = importlib.import_module(module)
+        return compression.open(path, "wt", encoding="utf-8")
+    return open(path, "w", encoding="utf-8")
+
+
+def uncompressed_path(path):
+    # The path without any compression extension, e.g. model.yaml for
+    # model.yaml.gz, so that the format can be found from its extension.
+    path = pathlib.PurePath(path)
+    if path.suffix.lower() in COMPRESSION_SUFFIXES:
+        path = path.with_suffix("")
+    return path
+
+
+def sniff_format(content, path=None):
+    """
+    Return "json" or "yaml", based on the file extension of the path if it has
+    a known extension, and otherwise on the content.
+    """
+    if path is not None:
+        suffix = pathlib.PurePath(path).suffix.lower()
+        if suffix == ".json":
+            return "json"
+        if suffix in (".yaml", ".yml"):
+            return "yaml"
+    if isinstance(content, bytes):
+        content = content[:64].decode("utf-8", errors="ignore")
+    # A model is a mapping, so a JSON document must start with a brace.
+    # YAML flow mappings also start with a brace, but the JSON loader will
+    # reject those that aren't also valid JSON.
+    if content.lstrip("\ufeff \t\r\n").startswith("{"):
+        return "json"
+    return "yaml"
+
 
-    yaml = YAML(typ="safe")
-    with open(sys.argv[1], encoding="utf-8") as source:
-        data = yaml.load(source)
-    graph = parser.parse(data)
-    print(json.dumps(graph.as_json_dict(), indent=2))
+class NotStrictJSON(ValueError):
+    """
+    A document that Python's JSON loader accepts, but the YAML loader
+    doesn't load in the same way.
+    """
+
+
+def unique_keys(pairs):
+    obj = dict(pairs)
+    if len(obj) != len(pairs):
+        # The YAML loader rejects duplicate keys.
+        raise NotStrictJSON("duplicate key")
+    return obj
+
+
+def reject_constant(name):
+    # NaN, Infinity and -Infinity aren't JSON, and the YAML loader loads them
+    # as strings.
+    raise NotStrictJSON(f"non-standard constant {name}")
+
+
+def loads(content, yaml, path=None):
+    """
+    Load a YAML or JSON document from a str or bytes object.
+    """
+    if sniff_format(content, path) == "json":
+        try:
+            return json.loads(
+                content, object_pairs_hook=unique_keys, parse_constant=reject_constant
+            )
+        except (json.JSONDecodeError, NotStrictJSON):
+            # JSON is (almost) a subset of YAML, so the YAML loader is the
+            # reference for anything that isn't valid JSON.
+            pass
+    return yaml.load(content)
+
+
+def load_path(path, yaml):
+    # Read the whole (decompressed) file with a single read, and let the
+    # loader do the decoding.
+    with open_input(path) as source:
+        content = source.read()
+    return loads(content, yaml, uncompressed_path(path))
+
+
+def error_response(e):
+    return {"type": type(e).__name__, "message": str(e)}
+
+
+def handle_request(line, yaml):
+    response = {"id": None}
+    try:
+        request = json.loads(line)
+        if not isinstance(request, dict):
+            raise TypeError("request must be a JSON object")
+        response["id"] = request.pop("id", None)
+        if "path" in request and "document" not in request:
+            data = load_path(request.pop("path"), yaml)
+        elif "document" in request and "path" not in request:
+            data = loads(request.pop("document"), yaml)
+        else:
+            raise ValueError("request must have exactly one of 'path' or 'document'")
+        if len(request) != 0:
+            raise ValueError(f"Extra fields are not permitted:{request}")
+        response["graph"] = parser.parse(data).as_json_dict()
+    except Exception as e:
+        response["error"] = error_response(e)
+    return response
+
+
+def resolve_documents(stream, yaml):
+    """
+    Yield an (index, result) pair for each document in a stream of YAML
+    documents, where the result is the resolved Graph, or the exception
+    raised while loading or resolving the document. Each document is loaded
+    only when the previous result has been consumed.
+    """
+    documents = iter(yaml.load_all(stream))
+    index = 0
+    while True:
+        try:
+            data = next(documents)
+        except StopIteration:
+            return
+        except Exception as e:
+            # The loader can't continue after a syntax error.
+            yield index, e
+            return
+        try:
+            yield index, parser.parse(data)
+        except Exception as e:
+            yield index, e
+        index += 1
+
+
+def write_documents(results, stdout):
+    # Write newline-delimited JSON, with one line for each document.
+    for index, result in results:
+        response = {"index": index}
+        if isinstance(result, parser.Graph):
+            response["graph"] = result.as_json_dict()
+        else:
+            response["error"] = error_response(result)
+        stdout.write(json.dumps(response, separators=(",", ":")) + "\n")
+
+
+def run_worker(stdin, stdout):
+    # The YAML loader is created once and reused for every request.
+    yaml = LazyYAML()
+    for line in stdin:
+        if len(line.strip()) == 0:
+            continue
+        response = handle_request(line, yaml)
+        stdout.write(json.dumps(response, separators=(",", ":")) + "\n")
+        # Flush after every response, so that clients can pipeline requests.
+        stdout.flush()
+
+
+def main(args=None):
+    argparser = argparse.ArgumentParser()
+    group = argparser.add_mutually_exclusive_group(required=True)
+    group.add_argument("path", nargs="?", help="The YAML model to resolve.")
+    group.add_argument(
+        "--worker",
+        action="store_true",
+        help="Read JSON-lines requests from stdin and write responses to stdout.",
+    )
+    argparser.add_argument(
+        "--format",
+        choices=graph_writer.FORMATS,
+        help="The output format. Defaults to pretty-printed JSON.",
+    )
+    argparser.add_argument(
+        "--all",
+        action="store_true",
+        help=(
+            "Resolve each document in a multi-document YAML stream, and write "
+            "one line of JSON per document."
+        ),
+    )
+    argparser.add_argument(
+        "-o",
+        "--output",
+        help=(
+            "The file to write to, instead of stdout. The output is compressed "
+            "if the file name ends in .gz, .bz2 or .xz."
+        ),
+    )
+    args = argparser.parse_args(args)
+    if args.worker:
+        # The worker writes one line of JSON per request to stdout.
+        for option, value in [
+            ("--all", args.all),
+            ("-o/--output", args.output),
+            ("--format", args.format),
+        ]:
+            if value:
+                argparser.error(
+                    f"argument --worker: not allowed with argument {option}"
+                )
+        run_worker(sys.stdin, sys.stdout)
+    elif args.all:
+        with open_input(args.path, text=True) as stream:
+            with open_output(args.output) as output:
+                write_documents(resolve_documents(stream, LazyYAML()), output)
+    else:
+        data = load_path(args.path, LazyYAML())
+        graph = parser.parse(data)
+        with open_output(args.output) as output:
+            graph_writer.write_graph(graph, output, args.format or "pretty")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,296 @@
+# Simplification of a resolved Demes Graph into a minimal HDM document.
+#
+# The fully-resolved MDM spells out every field of every entity, and expands
+# each symmetric migration into a pair of asymmetric migrations for each pair
+# of demes. simplify() reverses this, and returns an HDM document that parses
+# to an identical Graph:
+#
+#  1. Fields that are equal to the value the parser would resolve them to
+#     are dropped. E.g., a deme's start_time is dropped if it is infinite and
+#     the deme has no ancestors, or if it is the end time of its only
+#     ancestor, and an epoch's start_size is dropped if it is the end_size of
+#     the previous epoch.
+#  2. Runs of consecutive migrations that are exactly the expansion of a
+#     symmetric migration are replaced by that symmetric migration. Only
+#     consecutive runs are grouped, so that the order of Graph.migrations is
+#     unchanged.
+#  3. Values that are repeated across the epochs, demes, migrations or pulses
+#     are moved into the top-level defaults, where that reduces the number of
+#     fields. A default applies to every entity that doesn't set the field,
+#     including those whose field was dropped in step 1, so those entities
+#     must spell out the field again if their resolved value is different.
+from __future__ import annotations
+
+import collections
+import copy
+import dataclasses
+from typing import Dict, List
+
+import demes_parser as parser
+
+
+@dataclasses.dataclass
+class Item:
+    """
+    An entity of the output document. For each field that can be set by a
+    default, resolved has the values that the entity must resolve to. A
+    symmetric migration resolves to one value per pair of demes.
+    """
+
+    data: dict
+    resolved: Dict[str, list]
+
+
+def drop_resolved(item, field, default):
+    # Drop the field if the parser would resolve it to the same value.
+    (value,) = item.resolved[field]
+    if value == default:
+        del item.data[field]
+
+
+def simplify_deme(deme: parser.Deme) -> Item:
+    start_time = parser.encode_inf(deme.start_time)
+    item = Item(
+        data={
+            "name": deme.name,
+            "description": deme.description,
+            "start_time": start_time,
+            "ancestors": [ancestor.name for ancestor in deme.ancestors],
+            "proportions": list(deme.proportions),
+        },
+        resolved={"description": [deme.description], "start_time": [start_time]},
+    )
+    drop_resolved(item, "description", "")
+    if len(deme.ancestors) == 0:
+        drop_resolved(item, "start_time", parser.JSON_INFINITY_STR)
+        del item.data["ancestors"]
+        del item.data["proportions"]
+    elif len(deme.ancestors) == 1:
+        drop_resolved(item, "start_time", deme.ancestors[0].epochs[-1].end_time)
+        del item.data["proportions"]
+    return item
+
+
+def simplify_epochs(deme: parser.Deme) -> List[Item]:
+    items = []
+    for j, epoch in enumerate(deme.epochs):
+        item = Item(
+            data=dict(
+                end_time=epoch.end_time,
+                start_size=epoch.start_size,
+                end_size=epoch.end_size,
+                size_function=epoch.size_function,
+                selfing_rate=epoch.selfing_rate,
+                cloning_rate=epoch.cloning_rate,
+            ),
+            resolved={},
+        )
+        item.resolved = {key: [value] for key, value in item.data.items()}
+        if j == len(deme.epochs) - 1:
+            drop_resolved(item, "end_time", 0)
+        if j > 0:
+            drop_resolved(item, "start_size", deme.epochs[j - 1].end_size)
+        drop_resolved(item, "end_size", epoch.start_size)
+        default_size_function = "exponential"
+        if epoch.start_size == epoch.end_size:
+            default_size_function = "constant"
+        drop_resolved(item, "size_function", default_size_function)
+        drop_resolved(item, "selfing_rate", 0)
+        drop_resolved(item, "cloning_rate", 0)
+        items.append(item)
+    return items
+
+
+def migration_key(migration: parser.Migration):
+    # The fields of a migration that must match for it to be grouped with
+    # others, with times that are equal to their resolved defaults as None.
+    start_time = migration.start_time
+    if start_time == min(migration.source.start_time, migration.dest.start_time):
+        start_time = None
+    end_time = migration.end_time
+    if end_time == max(migration.source.end_time, migration.dest.end_time):
+        end_time = None
+    return migration.rate, start_time, end_time
+
+
+def symmetric_pairs(demes):
+    # The (source, dest) pairs of a symmetric migration, in the order in which
+    # Graph.add_migration() adds them.
+    for j, deme_a in enumerate(demes, 1):
+        for deme_b in demes[j:]:
+            yield deme_a, deme_b
+            yield deme_b, deme_a
+
+
+def symmetric_demes(migrations, keys, i):
+    """
+    Return the demes of the largest symmetric migration whose expansion is
+    the run of migrations starting at index i, or None.
+    """
+    # The first row of the expansion has migrations between the first deme
+    # and each of the others, in both directions.
+    first = migrations[i].source.name
+    demes = [first]
+    k = i
+    while (
+        k + 1 < len(migrations)
+        and keys[k] == keys[i]
+        and keys[k + 1] == keys[i]
+        and migrations[k].source.name == first
+        and migrations[k].dest.name == migrations[k + 1].source.name
+        and migrations[k + 1].dest.name == first
+        and migrations[k].dest.name not in demes
+    ):
+        demes.append(migrations[k].dest.name)
+        k += 2
+    if len(demes) < 2:
+        return None
+    # The expansion of a prefix of the demes only matches the run if the
+    # prefix is the first two demes, whose pair of migrations was matched
+    # above.
+    pairs = list(symmetric_pairs(demes))
+    run = migrations[i : i + len(pairs)]
+    if len(run) == len(pairs) and all(
+        keys[i + m] == keys[i]
+        and migration.source.name == source
+        and migration.dest.name == dest
+        for m, (migration, (source, dest)) in enumerate(zip(run, pairs))
+    ):
+        return demes
+    return demes[:2]
+
+
+def simplify_migrations(migrations: List[parser.Migration]) -> List[Item]:
+    keys = [migration_key(migration) for migration in migrations]
+    items = []
+    i = 0
+    while i < len(migrations):
+        demes = symmetric_demes(migrations, keys, i)
+        if demes is None:
+            run = migrations[i : i + 1]
+            data = {"source": run[0].source.name, "dest": run[0].dest.name}
+        else:
+            run = migrations[i : i + len(demes) * (len(demes) - 1)]
+            data = {"demes": demes}
+        rate, start_time, end_time = keys[i]
+        data["rate"] = rate
+        if start_time is not None:
+            data["start_time"] = parser.encode_inf(start_time)
+        if end_time is not None:
+            data["end_time"] = end_time
+        resolved = {
+            "rate": [rate],
+            "start_time": [parser.encode_inf(m.start_time) for m in run],
+            "end_time": [m.end_time for m in run],
+        }
+        items.append(Item(data, resolved))
+        i += len(run)
+    return items
+
+
+def simplify_pulse(pulse: parser.Pulse) -> Item:
+    data = pulse.as_json_dict()
+    return Item(data, {"time": [pulse.time], "dest": [pulse.dest.name]})
+
+
+def factor_default(items: List[Item], field: str):
+    """
+    Return the value of the field to use as a default for the items, or None
+    if no default would reduce the number of fields in the document.
+    """
+    explicit = collections.Counter()
+    omitted = collections.Counter()
+    num_omitted = 0
+    for item in items:
+        if field in item.data:
+            explicit[item.data[field]] += 1
+            continue
+        values = set(item.resolved[field])
+        if len(values) > 1:
+            # The field resolves to different values for different pairs of
+            # a symmetric migration, so it can't be spelled out.
+            return None
+        omitted[values.pop()] += 1
+        num_omitted += 1
+    best = None
+    # The default itself is one field, so it must remove at least two fields.
+    best_gain = 1
+    for value, count in explicit.items():
+        # The items that omit the field, but don't resolve to the default,
+        # must now set the field.
+        gain = count - (num_omitted - omitted[value])
+        if gain > best_gain:
+            best, best_gain = value, gain
+    return best
+
+
+def factor_defaults(items: List[Item], fields) -> dict:
+    defaults = {}
+    for field in fields:
+        value = factor_default(items, field)
+        if value is None:
+            continue
+        defaults[field] = value
+        for item in items:
+            if field in item.data:
+                if item.data[field] == value:
+                    del item.data[field]
+            elif item.resolved[field][0] != value:
+                item.data[field] = item.resolved[field][0]
+    return defaults
+
+
+def simplify(graph: parser.Graph) -> dict:
+    """
+    Return a minimal HDM document that resolves to the given resolved graph.
+    """
+    deme_items = [simplify_deme(deme) for deme in graph.demes.values()]
+    epoch_items = [simplify_epochs(deme) for deme in graph.demes.values()]
+    migration_items = simplify_migrations(graph.migrations)
+    pulse_items = [simplify_pulse(pulse) for pulse in graph.pulses]
+
+    defaults = {}
+    for kind, items, fields in [
+        ("deme", deme_items, ["description", "start_time"]),
+        (
+            "epoch",
+            [item for items in epoch_items for item in items],
+            [
+                "end_time",
+                "start_size",
+                "end_size",
+                "size_function",
+                "selfing_rate",
+                "cloning_rate",
+            ],
+        ),
+        ("migration", migration_items, ["rate", "start_time", "end_time"]),
+        ("pulse", pulse_items, ["time", "dest"]),
+    ]:
+        kind_defaults = factor_defaults(items, fields)
+        if len(kind_defaults) > 0:
+            defaults[kind] = kind_defaults
+
+    data = {"time_units": graph.time_units}
+    if graph.time_units != "generations":
+        data["generation_time"] = graph.generation_time
+    if graph.description != "":
+        data["description"] = graph.description
+    if len(graph.doi) > 0:
+        data["doi"] = list(graph.doi)
+    if len(graph.metadata) > 0:
+        data["metadata"] = copy.deepcopy(graph.metadata)
+    if len(defaults) > 0:
+        data["defaults"] = defaults
+    data["demes"] = []
+    for deme_item, items in zip(deme_items, epoch_items):
+        epochs = [item.data for item in items]
+        # A deme without epochs has a single epoch with the default values.
+        if epochs != [{}]:
+            deme_item.data["epochs"] = epochs
+        data["demes"].append(deme_item.data)
+    if len(migration_items) > 0:
+        data["migrations"] = [item.data for item in migration_items]
+    if len(pulse_items) > 0:
+        data["pulses"] = [item.data for item in pulse_items]
+    return data
@@ -0,0 +1,135 @@
+# Streaming resolution of Demes models.
+#
+# parse() only returns the Graph once every entity has been resolved and
+# validated, so a consumer such as a simulator can't start setting up its
+# state for the model until then. A StreamingParser resolves the model in the
+# same way, but emits each deme, migration and pulse to its observers as soon
+# as that entity is final:
+#
+#  - Demes are resolved in order, after their ancestors, and a deme's fields
+#    and epochs never change once it has been resolved and validated, so each
+#    deme is emitted straight away.
+#  - A migration is resolved from the time intervals of its source and dest,
+#    so it's emitted once the later of the two demes has been emitted.
+#  - Pulses are sorted by time, so their order is only known once all of the
+#    demes have been resolved. They're emitted then, in the sorted order.
+#
+# The checks that involve all of the migrations (that migrations between the
+# same demes don't overlap, and that the rate of migration into each deme is
+# at most 1) are done at the end, after which each observer gets a final
+# commit() with the resolved Graph. If any check fails, each observer gets an
+# abort() with the exception instead, and the exception is raised. The
+# entities that were emitted before then must be discarded. If an observer's
+# commit() raises, the observers after it get an abort() with that exception.
+#
+# The resolved Graph is identical to the one returned by parse(). When a model
+# has several errors, the error that's raised may be different, as each deme
+# is validated before the next deme is resolved.
+from __future__ import annotations
+
+import copy
+from typing import Iterable, List
+
+import demes_parser as parser
+
+
+class Observer:
+    """
+    Receives the entities of a model from a StreamingParser, as they are
+    resolved. Subclasses override the methods for the events they need.
+    """
+
+    def deme(self, deme: parser.Deme):
+        """Called with each deme, in the order of Graph.demes."""
+
+    def migration(self, migration: parser.Migration):
+        """
+        Called with each migration, once its source and dest have been
+        emitted.
+        """
+
+    def pulse(self, pulse: parser.Pulse):
+        """Called with each pulse, in the order of Graph.pulses."""
+
+    def commit(self, graph: parser.Graph):
+        """Called with the resolved graph, once it has been validated."""
+
+    def abort(self, error: Exception):
+        """
+        Called with the exception, if the model is invalid. The entities that
+        were emitted are not part of a valid graph.
+        """
+
+
+class StreamingParser:
+    """
+    Parses models, emitting the resolved entities to the registered
+    observers.
+    """
+
+    def __init__(self, observers: Iterable[Observer] = ()):
+        self.observers: List[Observer] = list(observers)
+
+    def add_observer(self, observer: Observer):
+        self.observers.append(observer)
+
+    def emit(self, event, entity):
+        for observer in self.observers:
+            getattr(observer, event)(entity)
+
+    def parse(self, data: dict) -> parser.Graph:
+        """
+        Parse the data, and return the resolved Graph. Each observer gets
+        either a commit() or an abort() before this returns or raises.
+        Exceptions raised by the observers also abort the parse, including
+        those raised by commit(), in which case the observers after it get an
+        abort() instead.
+        """
+        try:
+            graph = parser.build(copy.deepcopy(data))
+            self.resolve(graph)
+        except Exception as e:
+            self.emit("abort", e)
+            raise
+        for j, observer in enumerate(self.observers):
+            try:
+                observer.commit(graph)
+            except Exception as e:
+                for other in self.observers[j + 1 :]:
+                    other.abort(e)
+                raise
+        return graph
+
+    def resolve(self, graph: parser.Graph):
+        graph.validate_generation_time()
+        # The migrations to emit after each deme.
+        deme_index = {name: j for j, name in enumerate(graph.demes)}
+        migrations_after: List[List[parser.Migration]] = [[] for _ in graph.demes]
+        for migration in graph.migrations:
+            j = max(deme_index[migration.source.name], deme_index[migration.dest.name])
+            migrations_after[j].append(migration)
+
+        for deme, migrations in zip(graph.demes.values(), migrations_after):
+            deme.resolve()
+            deme.validate()
+            self.emit("deme", deme)
+            for migration in migrations:
+                migration.resolve()
+                migration.validate()
+                self.emit("migration", migration)
+
+        graph.sort_pulses()
+        for pulse in graph.pulses:
+            pulse.validate()
+            self.emit("pulse", pulse)
+
+        graph.validate_migration_overlaps()
+        graph.validate_ingress_rates()
+
+
+def parse(data: dict, observers: Iterable[Observer]) -> parser.Graph:
+    """
+    Parse the data, emitting the resolved entities to the observers. See
+    StreamingParser.parse().
+    """
+    return StreamingParser(observers).parse(data)
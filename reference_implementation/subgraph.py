@@ -0,0 +1,214 @@
+# Extraction of a subgraph of a resolved Demes Graph.
+#
+# A subgraph has a subset of the demes, and covers a time window
+# (start_time, end_time] of the original graph. The demes are closed under
+# ancestry within the window: a lineage in a deme of the subgraph can only
+# move to another deme of the subgraph, so the subgraph includes
+#
+#  - the ancestors of each deme that starts within the window,
+#  - the sources of each pulse into a deme within the window, and
+#  - the sources of each migration into a deme that overlaps the window.
+#
+# Events at exactly the start_time or end_time of the window are outside of
+# it. Entities are clipped to the window as follows:
+#
+#  - Demes that start at or before start_time have an infinite start time in
+#    the subgraph, and no ancestors. Their size, and the migration between
+#    them, just after start_time (forwards in time) is extended infinitely
+#    into the past. If the epoch at start_time doesn't have a constant size,
+#    a constant epoch with the size at start_time is inserted before it.
+#  - Demes, epochs and migrations that end before end_time end at end_time
+#    in the subgraph, with their size at that time.
+#
+# The SubgraphExtractor indexes the migrations and pulses of the graph by
+# their destination deme once, so that each extraction takes time
+# proportional to the size of the subgraph (and the number of migrations and
+# pulses into its demes), rather than to the size of the whole graph.
+from __future__ import annotations
+
+import copy
+import math
+from typing import Dict, Iterable, List, Tuple, Union
+
+import demes_parser as parser
+
+
+def size_at(epoch: parser.Epoch, start_time: float, time: float) -> float:
+    # The size at a time within the epoch, which starts at start_time.
+    if time == start_time:
+        return epoch.start_size
+    if time == epoch.end_time or epoch.size_function == "constant":
+        return epoch.end_size
+    # The fraction of the epoch that has elapsed, forwards in time.
+    dt = (start_time - time) / (start_time - epoch.end_time)
+    if epoch.size_function == "exponential":
+        return epoch.start_size * (epoch.end_size / epoch.start_size) ** dt
+    return epoch.start_size + (epoch.end_size - epoch.start_size) * dt
+
+
+class SubgraphExtractor:
+    """
+    Extracts subgraphs from a resolved graph.
+    """
+
+    def __init__(self, graph: parser.Graph):
+        self.graph = graph
+        # The position of each deme in the graph.
+        self.deme_index = {name: j for j, name in enumerate(graph.demes)}
+        # The migrations and pulses into each deme, with their positions in
+        # the graph, so that the subgraph can keep them in the same order.
+        self.migrations_into: Dict[str, List[Tuple[int, parser.Migration]]] = {
+            name: [] for name in graph.demes
+        }
+        for j, migration in enumerate(graph.migrations):
+            self.migrations_into[migration.dest.name].append((j, migration))
+        self.pulses_into: Dict[str, List[Tuple[int, parser.Pulse]]] = {
+            name: [] for name in graph.demes
+        }
+        for j, pulse in enumerate(graph.pulses):
+            self.pulses_into[pulse.dest.name].append((j, pulse))
+
+    def extract(
+        self,
+        demes: Union[Iterable[str], None] = None,
+        start_time: float = math.inf,
+        end_time: float = 0,
+    ) -> parser.Graph:
+        """
+        Return the subgraph with the given demes, and their ancestry closure,
+        within the time window (start_time, end_time]. By default, all of
+        the demes that exist within the window are included.
+        """
+        if not (start_time > end_time >= 0) or math.isinf(end_time):
+            raise ValueError("must have start_time > end_time >= 0")
+        window = parser.Interval(start_time, end_time)
+        if demes is None:
+            demes = [
+                name
+                for name, deme in self.graph.demes.items()
+                if deme.time_interval.intersects(window)
+            ]
+        else:
+            demes = list(demes)
+            for name in demes:
+                if name not in self.graph.demes:
+                    raise ValueError(f"deme {name} is not in the graph")
+                if not self.graph.demes[name].time_interval.intersects(window):
+                    raise ValueError(
+                        f"deme {name} does not exist in the time window "
+                        f"({start_time}, {end_time}]"
+                    )
+
+        # The ancestry closure of the demes, with the migrations and pulses
+        # between them within the window.
+        closure = set()
+        migrations = []
+        pulses = []
+        stack = list(demes)
+        while len(stack) > 0:
+            name = stack.pop()
+            if name in closure:
+                continue
+            closure.add(name)
+            deme = self.graph.demes[name]
+            if deme.start_time < start_time:
+                stack.extend(ancestor.name for ancestor in deme.ancestors)
+            for j, migration in self.migrations_into[name]:
+                if migration.time_interval.intersects(window):
+                    migrations.append((j, migration))
+                    stack.append(migration.source.name)
+            for j, pulse in self.pulses_into[name]:
+                if start_time > pulse.time > end_time:
+                    pulses.append((j, pulse))
+                    stack.extend(source.name for source in pulse.sources)
+        if len(closure) == 0:
+            # A graph must have at least one deme.
+            raise ValueError(
+                f"no demes exist in the time window ({start_time}, {end_time}]"
+            )
+
+        graph = parser.Graph(
+            time_units=self.graph.time_units,
+            generation_time=self.graph.generation_time,
+            doi=list(self.graph.doi),
+            description=self.graph.description,
+            metadata=copy.deepcopy(self.graph.metadata),
+        )
+        # Ancestors are listed before their descendants in the original
+        # graph, so they are added to the subgraph first.
+        for name in sorted(closure, key=self.deme_index.__getitem__):
+            self.add_deme(graph, self.graph.demes[name], start_time, end_time)
+        for _, migration in sorted(migrations, key=lambda item: item[0]):
+            graph.add_migration(
+                rate=migration.rate,
+                start_time=(
+                    math.inf
+                    if migration.start_time >= start_time
+                    else migration.start_time
+                ),
+                end_time=max(migration.end_time, end_time),
+                source=migration.source.name,
+                dest=migration.dest.name,
+                demes=None,
+            )
+        for _, pulse in sorted(pulses, key=lambda item: item[0]):
+            graph.add_pulse(
+                sources=[source.name for source in pulse.sources],
+                dest=pulse.dest.name,
+                time=pulse.time,
+                proportions=list(pulse.proportions),
+            )
+        return graph
+
+    def add_deme(self, graph, deme, start_time, end_time):
+        clipped = deme.start_time >= start_time
+        subdeme = graph.add_deme(
+            name=deme.name,
+            description=deme.description,
+            start_time=math.inf if clipped else deme.start_time,
+            ancestors=[] if clipped else [ancestor.name for ancestor in deme.ancestors],
+            proportions=[] if clipped else list(deme.proportions),
+        )
+        epoch_start_time = deme.start_time
+        for epoch in deme.epochs:
+            # The part of the epoch within the window, if any.
+            start = min(epoch_start_time, start_time)
+            end = max(epoch.end_time, end_time)
+            if start > end:
+                start_size = size_at(epoch, epoch_start_time, start)
+                if len(subdeme.epochs) == 0 and clipped:
+                    if epoch.size_function == "constant":
+                        start = math.inf
+                    else:
+                        # Hold the size at start_time constant before it.
+                        subdeme.add_epoch(
+                            end_time=start,
+                            start_size=start_size,
+                            end_size=start_size,
+                            selfing_rate=epoch.selfing_rate,
+                            cloning_rate=epoch.cloning_rate,
+                            size_function="constant",
+                        )
+                subdeme.add_epoch(
+                    end_time=end,
+                    start_size=start_size,
+                    end_size=size_at(epoch, epoch_start_time, end),
+                    selfing_rate=epoch.selfing_rate,
+                    cloning_rate=epoch.cloning_rate,
+                    size_function=epoch.size_function,
+                )
+            epoch_start_time = epoch.end_time
+
+
+def subgraph(
+    graph: parser.Graph,
+    demes: Union[Iterable[str], None] = None,
+    start_time: float = math.inf,
+    end_time: float = 0,
+) -> parser.Graph:
+    """
+    Return the subgraph of the resolved graph with the given demes, and their
+    ancestry closure, within the time window (start_time, end_time]. See
+    SubgraphExtractor.extract().
+    """
+    return SubgraphExtractor(graph).extract(demes, start_time, end_time)
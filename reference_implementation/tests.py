@@ -3,16 +3,56 @@ Unit tests for the Demes reference parser implementation.
 
 Run with ``python3 -m pytest ``
 """
+
+import copy
+import dataclasses
 import pathlib
+import bz2
+import gzip
+import importlib
 import json
+import random
 import math
-
+import asyncio
+import concurrent.futures
+import multiprocessing
+import io
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import gc
+import pickle
+import os
+
+import hypothesis
 import jsonschema
+import numpy as np
 import pytest
 from ruamel.yaml import YAML
-from ruamel.yaml.constructor import ConstructorError
+from ruamel.yaml.constructor import ConstructorError, DuplicateKeyError
 
 import demes_parser as parser
+import pulse_index
+import async_parse
+import resolve_yaml
+import graph_builder
+import templates
+import batch
+import timeline
+import coalescence
+import discretize
+import events
+import graph_generator
+import graph_writer
+import simplify
+import normalize
+import subgraph
+import flyweight
+import streaming
+import frozen
+import columnar
 
 
 def minimal_graph(num_demes=1, population_size=1):
@@ -1198,6 +1238,3410 @@ class TestGraphUtilities:
         graph = parser.parse(minimal_graph())
         assert len(str(graph)) > 0
 
+    def test_equality(self):
+        data = island_model_graph(3, migration_rate=0.1)
+        data["pulses"] = [
+            {"sources": ["deme0"], "dest": "deme1", "time": 1, "proportions": [0.1]}
+        ]
+        graph1 = parser.parse(data)
+        graph2 = parser.parse(data)
+        assert graph1 == graph2
+        assert graph1.demes["deme0"] == graph2.demes["deme0"]
+        assert graph1.migrations[0] == graph2.migrations[0]
+        assert graph1.pulses[0] == graph2.pulses[0]
+        assert graph1 != data
+        assert graph1.demes["deme0"] != graph1.demes["deme1"]
+        assert graph1.migrations[0] != graph1.migrations[1]
+        assert graph1.demes["deme0"] != "deme0"
+        assert graph1.migrations[0] != 1
+        assert graph1.pulses[0] != 1
+
+        data["pulses"][0]["proportions"] = [0.2]
+        assert graph1 != parser.parse(data)
+
+    def test_equality_deme_order(self):
+        data = minimal_graph(2)
+        graph1 = parser.parse(data)
+        data["demes"].reverse()
+        graph2 = parser.parse(data)
+        assert graph1 != graph2
+        assert graph1.fingerprint() != graph2.fingerprint()
+
+    def test_equality_ancestors_by_name(self):
+        data = single_ancestor_graph(1)
+        graph1 = parser.parse(data)
+        data["demes"][0]["epochs"][0]["start_size"] = 2
+        graph2 = parser.parse(data)
+        # The children are identical apart from their ancestor's size.
+        assert graph1.demes["child_0"] == graph2.demes["child_0"]
+        assert graph1 != graph2
+
+    def test_equality_diamond_ancestry(self):
+        # Each level has two demes, each descended from both demes of the
+        # previous level. Recursively comparing ancestors would need 2**depth
+        # comparisons.
+        depth = 40
+        demes = [
+            {"name": f"a{depth}", "epochs": [{"start_size": 1, "end_time": depth}]},
+            {"name": f"b{depth}", "epochs": [{"start_size": 1, "end_time": depth}]},
+        ]
+        for j in range(depth - 1, -1, -1):
+            for prefix in "ab":
+                demes.append(
+                    {
+                        "name": f"{prefix}{j}",
+                        "start_time": j + 1,
+                        "ancestors": [f"a{j + 1}", f"b{j + 1}"],
+                        "proportions": [0.5, 0.5],
+                        "epochs": [{"start_size": 1, "end_time": j}],
+                    }
+                )
+        data = {"time_units": "generations", "demes": demes}
+        graph = parser.parse(data)
+        assert graph == parser.parse(graph.as_json_dict())
+
+    def test_fingerprint(self):
+        data = island_model_graph(3, migration_rate=0.1)
+        data["metadata"] = {"x": [1, True, "y", None]}
+        graph = parser.parse(data)
+        fingerprint = graph.fingerprint()
+        assert len(fingerprint) == 64
+        # The fingerprint is stable across reparsing the resolved graph,
+        # in which integer values may have become floats.
+        resolved = json.loads(json.dumps(graph.as_json_dict()))
+        resolved["demes"][0]["epochs"][0]["start_size"] = 1.0
+        assert parser.parse(resolved).fingerprint() == fingerprint
+        data["migrations"][0]["rate"] = 0.2
+        assert parser.parse(data).fingerprint() != fingerprint
+
+    def test_pickle(self):
+        data = island_model_graph(3, migration_rate=0.1)
+        data["pulses"] = [
+            {"sources": ["deme0"], "dest": "deme1", "time": 1, "proportions": [0.1]}
+        ]
+        data["metadata"] = {"x": [1, {"y": 2}]}
+        data["doi"] = ["https://example.com"]
+        graph = parser.parse(data)
+        for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+            graph_copy = pickle.loads(pickle.dumps(graph, protocol=protocol))
+            assert graph_copy == graph
+            assert graph_copy.as_json_dict() == graph.as_json_dict()
+            graph_copy.validate()
+            # The entities refer to the demes of the copy.
+            deme1 = graph_copy.demes["deme1"]
+            assert graph_copy.pulses[0].dest is deme1
+            assert graph_copy.migrations[0].dest is deme1
+
+    def test_pickle_is_compact(self):
+        graph = parser.parse(island_model_graph(10, migration_rate=0.01))
+        state = parser.graph_state(graph)
+        assert parser.graph_from_state(state) == graph
+        # The state is plain values, so no classes are recorded for the
+        # demes, epochs and migrations.
+        text = pickle.dumps(graph)
+        assert b"Migration" not in text
+        assert b"Epoch" not in text
+        assert len(text) < len(pickle.dumps(graph.__dict__)) / 1.5
+
+    def test_copy(self):
+        # Copies are made as for any other dataclass, and not through the
+        # reduction used for pickling.
+        data = island_model_graph(3, migration_rate=0.1)
+        data["metadata"] = {"x": [1, {"y": 2}]}
+        graph = parser.parse(data)
+        shallow = copy.copy(graph)
+        assert shallow is not graph
+        assert shallow == graph
+        assert shallow.demes is graph.demes
+        assert shallow.migrations is graph.migrations
+        assert shallow.metadata is graph.metadata
+        deep = copy.deepcopy(graph)
+        assert deep == graph
+        assert deep.demes["deme0"] is not graph.demes["deme0"]
+        assert deep.metadata == graph.metadata
+        assert deep.metadata["x"] is not graph.metadata["x"]
+        assert deep.migrations[0].source is deep.demes["deme0"]
+        # Objects that are shared with something outside the graph remain
+        # shared within the copy.
+        graph.metadata["y"] = graph.metadata["x"]
+        copies = copy.deepcopy([graph, graph.metadata["x"]])
+        assert copies[0].metadata["x"] is copies[0].metadata["y"] is copies[1]
+
+    def test_pickle_unresolved(self):
+        graph = parser.build(
+            {
+                "time_units": "generations",
+                "demes": [
+                    {"name": "a", "epochs": [{"start_size": 1}]},
+                    {
+                        "name": "b",
+                        "ancestors": ["a"],
+                        "start_time": 10,
+                        "epochs": [{"start_size": 1}],
+                    },
+                ],
+                "migrations": [{"source": "a", "dest": "b", "rate": 0.1}],
+            }
+        )
+        graph_copy = pickle.loads(pickle.dumps(graph))
+        assert graph_copy.demes["b"].proportions is None
+        assert graph_copy.migrations[0].start_time is None
+        graph.resolve()
+        graph_copy.resolve()
+        assert graph_copy == graph
+
+
+class TestPulseIndex:
+    def pulse_graph(self, pulses):
+        data = minimal_graph(4)
+        data["pulses"] = pulses
+        return parser.parse(data)
+
+    def test_spec_example(self):
+        pulses = [
+            {"sources": ["deme0"], "dest": "deme2", "proportions": [0.25], "time": 10},
+            {"sources": ["deme1"], "dest": "deme2", "proportions": [0.2], "time": 10},
+        ]
+        index = pulse_index.PulseIndex(self.pulse_graph(pulses))
+        assert len(index) == 1
+        group = index.group_at(10)
+        assert group.order_dependent
+        assert index.order_dependent_groups() == [group]
+        ancestry = group.admixture["deme2"]
+        assert ancestry == pytest.approx({"deme0": 0.2, "deme1": 0.2, "deme2": 0.6})
+
+        # Reversing the pulses changes the outcome.
+        index = pulse_index.PulseIndex(self.pulse_graph(pulses[::-1]))
+        ancestry = index.group_at(10).admixture["deme2"]
+        assert ancestry == pytest.approx({"deme0": 0.25, "deme1": 0.15, "deme2": 0.6})
+
+    def test_multiple_sources(self):
+        pulses = [
+            {
+                "sources": ["deme0", "deme1"],
+                "dest": "deme2",
+                "proportions": [0.2, 0.2],
+                "time": 10,
+            },
+        ]
+        group = pulse_index.PulseIndex(self.pulse_graph(pulses)).group_at(10)
+        assert not group.order_dependent
+        ancestry = group.admixture["deme2"]
+        assert ancestry == pytest.approx({"deme0": 0.2, "deme1": 0.2, "deme2": 0.6})
+
+    def test_independent_pulses(self):
+        pulses = [
+            {"sources": ["deme0"], "dest": "deme1", "proportions": [0.1], "time": 5},
+            {"sources": ["deme2"], "dest": "deme3", "proportions": [0.3], "time": 5},
+        ]
+        group = pulse_index.PulseIndex(self.pulse_graph(pulses)).group_at(5)
+        assert not group.order_dependent
+        assert set(group.admixture) == {"deme1", "deme3"}
+        assert group.admixture["deme1"] == pytest.approx({"deme0": 0.1, "deme1": 0.9})
+        assert group.admixture["deme3"] == pytest.approx({"deme2": 0.3, "deme3": 0.7})
+
+    def test_chained_pulses(self):
+        # deme1 receives ancestry from deme0, and then passes it on to deme2.
+        pulses = [
+            {"sources": ["deme0"], "dest": "deme1", "proportions": [0.5], "time": 5},
+            {"sources": ["deme1"], "dest": "deme2", "proportions": [0.5], "time": 5},
+        ]
+        group = pulse_index.PulseIndex(self.pulse_graph(pulses)).group_at(5)
+        assert group.order_dependent
+        assert group.admixture["deme2"] == pytest.approx(
+            {"deme0": 0.25, "deme1": 0.25, "deme2": 0.5}
+        )
+        group = pulse_index.PulseIndex(self.pulse_graph(pulses[::-1])).group_at(5)
+        assert group.admixture["deme2"] == pytest.approx({"deme1": 0.5, "deme2": 0.5})
+
+    def test_time_windows(self):
+        pulses = [
+            {"sources": ["deme0"], "dest": "deme1", "proportions": [0.1], "time": t}
+            for t in [1, 2, 2, 3, 4.5]
+        ]
+        index = pulse_index.PulseIndex(self.pulse_graph(pulses))
+        assert [group.time for group in index] == [4.5, 3, 2, 1]
+        assert index.group_at(2.5) is None
+        assert index.group_at(10) is None
+        assert len(index.group_at(2).pulses) == 2
+        # Windows are half-open intervals, (start_time, end_time].
+        assert [p.time for p in index.pulses_between(3, 1)] == [2, 2, 1]
+        assert [p.time for p in index.pulses_between(math.inf, 3)] == [4.5, 3]
+        assert [g.time for g in index.groups_between(4.5, 2)] == [3, 2]
+        assert index.pulses_between(0.5, 0) == []
+
+    def test_no_pulses(self):
+        index = pulse_index.PulseIndex(parser.parse(minimal_graph()))
+        assert len(index) == 0
+        assert index.group_at(1) is None
+        assert index.pulses_between(math.inf, 0) == []
+
+
+class TestAsyncParser:
+    def test_parse(self):
+        data = island_model_graph(3, migration_rate=0.1)
+
+        async def main():
+            async with async_parse.AsyncParser(max_concurrency=2) as async_parser:
+                return await asyncio.gather(
+                    *(async_parser.parse(data) for _ in range(5))
+                )
+
+        graphs = asyncio.run(main())
+        assert len(graphs) == 5
+        for graph in graphs:
+            assert graph == parser.parse(data)
+
+    def test_error(self):
+        data = island_model_graph(3, migration_rate=1)
+
+        async def main():
+            async with async_parse.AsyncParser() as async_parser:
+                await async_parser.parse(data)
+
+        with pytest.raises(ValueError, match="sum to more than 1"):
+            asyncio.run(main())
+
+    def test_bad_max_concurrency(self):
+        with pytest.raises(ValueError):
+            async_parse.AsyncParser(max_concurrency=0)
+
+    def test_concurrency_limit(self, monkeypatch):
+        lock = threading.Lock()
+        running = []
+        max_running = []
+
+        def slow_parse(data):
+            with lock:
+                running.append(data)
+                max_running.append(len(running))
+            time.sleep(0.02)
+            with lock:
+                running.remove(data)
+            return data
+
+        monkeypatch.setattr(parser, "parse", slow_parse)
+
+        async def main():
+            async with async_parse.AsyncParser(max_concurrency=2) as async_parser:
+                return await asyncio.gather(*(async_parser.parse(j) for j in range(8)))
+
+        assert asyncio.run(main()) == list(range(8))
+        assert max(max_running) == 2
+
+    def test_cancellation(self, monkeypatch):
+        started = []
+        release = threading.Event()
+
+        def blocking_parse(data):
+            started.append(data)
+            release.wait()
+            raise ValueError("abandoned")
+
+        monkeypatch.setattr(parser, "parse", blocking_parse)
+
+        async def main():
+            async_parser = async_parse.AsyncParser(max_concurrency=1)
+            running = asyncio.ensure_future(async_parser.parse("running"))
+            waiting = asyncio.ensure_future(async_parser.parse("waiting"))
+            while not started:
+                await asyncio.sleep(0.001)
+            # The running task is cancelled promptly, although its worker is
+            # still busy.
+            running.cancel()
+            waiting.cancel()
+            results = await asyncio.gather(running, waiting, return_exceptions=True)
+            assert all(isinstance(r, asyncio.CancelledError) for r in results)
+            # The slot is released once the abandoned worker finishes.
+            release.set()
+            monkeypatch.setattr(parser, "parse", lambda data: data)
+            assert await async_parser.parse("next") == "next"
+            async_parser.close()
+
+        asyncio.run(main())
+        assert started == ["running"]
+
+    def test_cancelled_parse_keeps_slot(self, monkeypatch):
+        lock = threading.Lock()
+        started = []
+        finished = []
+        release = threading.Event()
+
+        def blocking_parse(data):
+            with lock:
+                started.append(data)
+            if data == "a":
+                release.wait()
+            with lock:
+                finished.append(data)
+            return data
+
+        monkeypatch.setattr(parser, "parse", blocking_parse)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=4) as executor:
+
+            async def main():
+                async_parser = async_parse.AsyncParser(
+                    max_concurrency=1, executor=executor
+                )
+                a = asyncio.ensure_future(async_parser.parse("a"))
+                while not started:
+                    await asyncio.sleep(0.001)
+                a.cancel()
+                b = asyncio.ensure_future(async_parser.parse("b"))
+                with pytest.raises(asyncio.CancelledError):
+                    await a
+                # "b" waits for the cancelled parse of "a" to finish, although
+                # the executor has free threads.
+                await asyncio.sleep(0.05)
+                assert started == ["a"]
+                release.set()
+                assert await b == "b"
+                assert finished == ["a", "b"]
+
+            asyncio.run(main())
+
+    def test_cancelled_parse_after_loop_closed(self, monkeypatch, caplog):
+        release = threading.Event()
+        started = threading.Event()
+
+        def blocking_parse(data):
+            started.set()
+            release.wait()
+            return data
+
+        monkeypatch.setattr(parser, "parse", blocking_parse)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+
+            async def main():
+                async_parser = async_parse.AsyncParser(executor=executor)
+                task = asyncio.ensure_future(async_parser.parse("a"))
+                await asyncio.get_running_loop().run_in_executor(None, started.wait)
+                task.cancel()
+                with pytest.raises(asyncio.CancelledError):
+                    await task
+
+            asyncio.run(main())
+            # The worker finishes after the event loop has been closed, so the
+            # slot can't be released, which mustn't raise in the worker.
+            release.set()
+        assert caplog.records == []
+
+    def test_parse_after_close(self):
+        async def main():
+            async_parser = async_parse.AsyncParser(max_concurrency=1)
+            async_parser.close()
+            for _ in range(2):
+                # The slot is released each time.
+                with pytest.raises(RuntimeError, match="shutdown"):
+                    await async_parser.parse(minimal_graph())
+
+        asyncio.run(main())
+
+    def test_external_executor(self):
+        data = minimal_graph()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=1) as executor:
+
+            async def main():
+                async with async_parse.AsyncParser(executor=executor) as async_parser:
+                    return await async_parser.parse(data)
+
+            assert asyncio.run(main()) == parser.parse(data)
+            # The executor is still usable after the parser is closed.
+            assert executor.submit(parser.parse, data).result() == parser.parse(data)
+
+
+class TestResolveYaml:
+    def test_main(self, capsys):
+        resolve_yaml.main(["../examples/zigzag.yaml"])
+        with open("../examples/zigzag.resolved.json", encoding="utf-8") as f:
+            assert capsys.readouterr().out == f.read()
+
+    def test_main_json(self, capsys):
+        resolve_yaml.main(["../examples/zigzag.resolved.json"])
+        with open("../examples/zigzag.resolved.json", encoding="utf-8") as f:
+            assert capsys.readouterr().out == f.read()
+
+    @pytest.mark.parametrize(
+        "options,option",
+        [
+            (["--all"], "--all"),
+            (["-o", "out.json"], "-o/--output"),
+            (["--output", "out.json"], "-o/--output"),
+            (["--format", "pretty"], "--format"),
+        ],
+    )
+    def test_main_worker_options(self, capsys, options, option):
+        # The worker would ignore these options, so they're rejected.
+        with pytest.raises(SystemExit) as excinfo:
+            resolve_yaml.main(["--worker"] + options)
+        assert excinfo.value.code == 2
+        assert f"not allowed with argument {option}" in capsys.readouterr().err
+
+    @pytest.mark.parametrize("format", ["compact", "yaml"])
+    def test_main_format(self, capsys, format):
+        resolve_yaml.main(["../examples/zigzag.yaml", "--format", format])
+        with open("../examples/zigzag.resolved.json", encoding="utf-8") as f:
+            expected = json.load(f)
+        out = capsys.readouterr().out
+        if format == "compact":
+            assert out == json.dumps(expected, separators=(",", ":")) + "\n"
+        else:
+            assert YAML(typ="safe").load(out) == expected
+
+    def test_lazy_imports(self):
+        # Check in a fresh interpreter which modules have been imported after
+        # resolving a JSON model.
+        code = (
+            "import sys, resolve_yaml; "
+            "resolve_yaml.main(['../examples/zigzag.resolved.json']); "
+            "print([m for m in ('ruamel.yaml', 'pprint', 'hashlib') "
+            "if m in sys.modules], file=sys.stderr)"
+        )
+        result = subprocess.run(
+            [sys.executable, "-c", code], capture_output=True, text=True, check=True
+        )
+        assert result.stderr.strip() == "[]"
+
+    @pytest.mark.parametrize(
+        "path",
+        list(map(str, pathlib.Path("../examples/").glob("*.*")))
+        + list(map(str, pathlib.Path("../test-cases/valid").glob("*.yaml"))),
+    )
+    def test_load_path_matches_pure_yaml(self, path):
+        yaml = YAML(typ="safe", pure=True)
+        with open(path, encoding="utf-8") as source:
+            expected = yaml.load(source)
+        assert resolve_yaml.load_path(path, resolve_yaml.LazyYAML()) == expected
+
+    def test_sniff_format(self):
+        assert resolve_yaml.sniff_format("", "model.json") == "json"
+        assert resolve_yaml.sniff_format("{}", "model.YAML") == "yaml"
+        assert resolve_yaml.sniff_format("", "model.yml") == "yaml"
+        assert resolve_yaml.sniff_format(b'\xef\xbb\xbf\n  {"a": 1}') == "json"
+        assert resolve_yaml.sniff_format('  {"a": 1}', "model.txt") == "json"
+        assert resolve_yaml.sniff_format("a: 1") == "yaml"
+        assert resolve_yaml.sniff_format(b"# comment\n{a: 1}") == "yaml"
+
+    def test_loads(self, tmp_path):
+        yaml = resolve_yaml.LazyYAML()
+        data = minimal_graph()
+        assert resolve_yaml.loads(json.dumps(data), yaml) == data
+        assert resolve_yaml.loads(json.dumps(data).encode(), yaml) == data
+        # A YAML flow mapping is not valid JSON.
+        assert resolve_yaml.loads("{a: 1, b: [x]}", yaml) == {"a": 1, "b": ["x"]}
+        # A file with an unknown extension is sniffed.
+        path = tmp_path / "model"
+        path.write_text(json.dumps(data))
+        assert resolve_yaml.load_path(str(path), yaml) == data
+
+    def test_loads_duplicate_keys(self):
+        # Rejected in the same way as by the YAML loader.
+        yaml = resolve_yaml.LazyYAML()
+        content = '{"time_units": "years", "time_units": "generations"}'
+        with pytest.raises(DuplicateKeyError):
+            yaml.load(content)
+        with pytest.raises(DuplicateKeyError):
+            resolve_yaml.loads(content, yaml)
+        with pytest.raises(DuplicateKeyError):
+            resolve_yaml.loads('{"a": [{"b": 1, "b": 1}]}'.encode(), yaml)
+
+    @pytest.mark.parametrize("constant", ["NaN", "Infinity", "-Infinity"])
+    def test_loads_constants(self, constant):
+        # Loaded in the same way as by the YAML loader, i.e., as strings,
+        # which aren't valid numbers.
+        yaml = resolve_yaml.LazyYAML()
+        content = f'{{"start_size": {constant}}}'
+        assert resolve_yaml.loads(content, yaml) == {"start_size": constant}
+        content = json.dumps(minimal_graph(population_size=0)).replace(
+            ": 0", f": {constant}"
+        )
+        with pytest.raises(TypeError):
+            parser.parse(resolve_yaml.loads(content, yaml))
+
+    def multi_document_stream(self):
+        documents = [
+            minimal_graph(),
+            {"time_units": "generations", "demes": []},
+            island_model_graph(2, 100, 0.1),
+        ]
+        yaml = YAML(typ="safe")
+        stream = io.StringIO()
+        yaml.dump_all(documents, stream)
+        stream.seek(0)
+        return documents, stream
+
+    def test_resolve_documents(self):
+        documents, stream = self.multi_document_stream()
+        results = list(resolve_yaml.resolve_documents(stream, resolve_yaml.LazyYAML()))
+        assert [index for index, _ in results] == [0, 1, 2]
+        assert results[0][1] == parser.parse(documents[0])
+        assert isinstance(results[1][1], ValueError)
+        assert results[2][1] == parser.parse(documents[2])
+
+    def test_resolve_documents_is_lazy(self):
+        # A syntax error in the second document is only found after the first
+        # document's result is consumed, and ends the stream.
+        _, stream = self.multi_document_stream()
+        text = stream.getvalue().replace("demes: []", "demes: [", 1)
+        results = resolve_yaml.resolve_documents(
+            io.StringIO(text), resolve_yaml.LazyYAML()
+        )
+        index, graph = next(results)
+        assert (index, graph) == (0, parser.parse(minimal_graph()))
+        index, error = next(results)
+        assert index == 1
+        assert type(error).__name__ == "ParserError"
+        assert list(results) == []
+
+    def test_resolve_documents_empty(self):
+        results = resolve_yaml.resolve_documents(
+            io.StringIO(""), resolve_yaml.LazyYAML()
+        )
+        assert list(results) == []
+
+    def test_main_all(self, capsys, tmp_path):
+        documents, stream = self.multi_document_stream()
+        path = tmp_path / "models.yaml"
+        path.write_text(stream.getvalue())
+        resolve_yaml.main(["--all", str(path)])
+        lines = capsys.readouterr().out.splitlines()
+        responses = [json.loads(line) for line in lines]
+        assert responses[0] == {
+            "index": 0,
+            "graph": parser.parse(documents[0]).as_json_dict(),
+        }
+        assert responses[1]["index"] == 1
+        assert responses[1]["error"]["type"] == "ValueError"
+        assert responses[2] == {
+            "index": 2,
+            "graph": parser.parse(documents[2]).as_json_dict(),
+        }
+
+    @pytest.mark.parametrize(
+        "module,suffix",
+        [("gzip", ".gz"), ("bz2", ".bz2"), ("lzma", ".xz")],
+    )
+    def test_compressed_input(self, tmp_path, module, suffix):
+        compression = importlib.import_module(module)
+        yaml = resolve_yaml.LazyYAML()
+        for source in ["../examples/zigzag.yaml", "../examples/zigzag.resolved.json"]:
+            expected = resolve_yaml.load_path(source, yaml)
+            with open(source, "rb") as f:
+                content = compression.compress(f.read())
+            # With a compression extension, and with a misleading extension.
+            for name in [pathlib.Path(source).name + suffix, "model.yaml"]:
+                path = tmp_path / name
+                path.write_bytes(content)
+                assert resolve_yaml.load_path(str(path), yaml) == expected
+                with resolve_yaml.open_input(str(path), text=True) as f:
+                    assert f.read() == pathlib.Path(source).read_text()
+
+    @pytest.mark.parametrize("module", [None, "gzip", "bz2", "lzma"])
+    def test_main_pipe(self, capsys, tmp_path, module):
+        # A pipe can only be read once, e.g. with resolve_yaml.py <(cat m.yaml).
+        with open("../examples/zigzag.yaml", "rb") as f:
+            content = f.read()
+        if module is not None:
+            content = importlib.import_module(module).compress(content)
+        path = tmp_path / "fifo"
+        os.mkfifo(path)
+
+        def write():
+            with open(path, "wb") as f:
+                f.write(content)
+
+        writer = threading.Thread(target=write)
+        writer.start()
+        try:
+            resolve_yaml.main([str(path)])
+        finally:
+            writer.join()
+        with open("../examples/zigzag.resolved.json", encoding="utf-8") as f:
+            assert capsys.readouterr().out == f.read()
+
+    def test_open_input_closes_file(self, tmp_path):
+        path = tmp_path / "model.yaml.gz"
+        path.write_bytes(gzip.compress(b"time_units: years\n"))
+        with resolve_yaml.open_input(str(path)) as f:
+            assert f.read() == b"time_units: years\n"
+        assert f.source.closed
+        with resolve_yaml.open_input(str(path), text=True) as f:
+            assert f.read() == "time_units: years\n"
+        assert f.buffer.source.closed
+
+    def test_uncompressed_path(self):
+        assert resolve_yaml.uncompressed_path("a/b.yaml.gz").name == "b.yaml"
+        assert resolve_yaml.uncompressed_path("b.json.XZ").name == "b.json"
+        assert resolve_yaml.uncompressed_path("b.yaml").name == "b.yaml"
+
+    @pytest.mark.parametrize(
+        "module,suffix",
+        [("gzip", ".gz"), ("bz2", ".bz2"), ("lzma", ".xz"), (None, "")],
+    )
+    def test_main_output(self, tmp_path, module, suffix):
+        path = tmp_path / ("zigzag.json" + suffix)
+        resolve_yaml.main(["../examples/zigzag.yaml", "--output", str(path)])
+        content = path.read_bytes()
+        if module is not None:
+            content = importlib.import_module(module).decompress(content)
+        with open("../examples/zigzag.resolved.json", "rb") as f:
+            assert content == f.read()
+
+    def test_main_all_compressed(self, capsys, tmp_path):
+        documents, stream = self.multi_document_stream()
+        path = tmp_path / "models.yaml.gz"
+        with gzip.open(path, "wt", encoding="utf-8") as f:
+            f.write(stream.getvalue())
+        output = tmp_path / "models.ndjson.bz2"
+        resolve_yaml.main(["--all", str(path), "-o", str(output)])
+        assert capsys.readouterr().out == ""
+        with bz2.open(output, "rt", encoding="utf-8") as f:
+            responses = [json.loads(line) for line in f]
+        assert [response["index"] for response in responses] == [0, 1, 2]
+        assert responses[2]["graph"] == parser.parse(documents[2]).as_json_dict()
+
+    def run_worker(self, requests):
+        stdin = io.StringIO("".join(json.dumps(r) + "\n" for r in requests))
+        stdout = io.StringIO()
+        resolve_yaml.run_worker(stdin, stdout)
+        return [json.loads(line) for line in stdout.getvalue().splitlines()]
+
+    def test_worker(self):
+        with open("../examples/zigzag.resolved.json", encoding="utf-8") as f:
+            zigzag = json.load(f)
+        with open("../examples/minimal.yaml", encoding="utf-8") as f:
+            minimal_yaml = f.read()
+        responses = self.run_worker(
+            [
+                {"id": 1, "path": "../examples/zigzag.yaml"},
+                {"id": "two", "document": minimal_yaml},
+                {"document": json.dumps(minimal_graph())},
+                {"id": 4, "path": "../examples/zigzag.yaml"},
+            ]
+        )
+        assert responses[0] == {"id": 1, "graph": zigzag}
+        assert responses[1]["id"] == "two"
+        assert responses[1]["graph"]["demes"][0]["name"] == "a"
+        assert responses[2] == {
+            "id": None,
+            "graph": parser.parse(minimal_graph()).as_json_dict(),
+        }
+        assert responses[3] == {"id": 4, "graph": zigzag}
+
+    @pytest.mark.parametrize(
+        "request_data,error_type",
+        [
+            ({"id": 1, "document": "time_units: generations\ndemes: []"}, "ValueError"),
+            ({"id": 1, "path": "../examples/nonexistent.yaml"}, "FileNotFoundError"),
+            ({"id": 1}, "ValueError"),
+            ({"id": 1, "path": "x.yaml", "document": "x"}, "ValueError"),
+            ({"id": 1, "document": "x", "extra": 1}, "ValueError"),
+            ([1, 2], "TypeError"),
+        ],
+    )
+    def test_worker_errors(self, request_data, error_type):
+        responses = self.run_worker([request_data, {"id": 2, "document": "{"}])
+        assert len(responses) == 2
+        if isinstance(request_data, dict):
+            assert responses[0]["id"] == 1
+        assert "graph" not in responses[0]
+        assert responses[0]["error"]["type"] == error_type
+        assert len(responses[0]["error"]["message"]) > 0
+        # The worker carries on after an error.
+        assert responses[1]["id"] == 2
+        assert "error" in responses[1]
+
+    def test_worker_invalid_json(self):
+        stdin = io.StringIO("not json\n\n")
+        stdout = io.StringIO()
+        resolve_yaml.run_worker(stdin, stdout)
+        (response,) = [json.loads(line) for line in stdout.getvalue().splitlines()]
+        assert response["id"] is None
+        assert response["error"]["type"] == "JSONDecodeError"
+
+
+class TestGraphBuilder:
+    def test_matches_parse(self):
+        data = {
+            "time_units": "years",
+            "generation_time": 25,
+            "doi": ["https://example.com"],
+            "demes": [
+                {"name": "A", "epochs": [{"start_size": 100, "end_time": 50}]},
+                {
+                    "name": "B",
+                    "ancestors": ["A"],
+                    "epochs": [
+                        {"start_size": 10, "end_size": 20, "end_time": 10},
+                        {"end_size": 5, "selfing_rate": 0.1},
+                    ],
+                },
+                {"name": "C", "ancestors": ["A"], "epochs": [{"start_size": 50}]},
+                {
+                    "name": "D",
+                    "start_time": 20,
+                    "ancestors": ["B", "C"],
+                    "proportions": [0.25, 0.75],
+                    "epochs": [{"start_size": 50, "cloning_rate": 0.5}],
+                },
+            ],
+            "migrations": [
+                {"demes": ["B", "C"], "rate": 1e-3},
+                {"source": "C", "dest": "D", "rate": 1e-4, "end_time": 5},
+            ],
+            "pulses": [
+                {"sources": ["B"], "dest": "C", "proportions": [0.1], "time": 30}
+            ],
+        }
+        builder = graph_builder.GraphBuilder(
+            time_units="years", generation_time=25, doi=["https://example.com"]
+        )
+        builder.add_deme("A")
+        builder.add_epoch("A", start_size=100, end_time=50)
+        builder.add_deme("B", ancestors=["A"])
+        builder.add_epoch("B", start_size=10, end_size=20, end_time=10)
+        builder.add_epoch("B", end_size=5, selfing_rate=0.1)
+        builder.add_deme("C", ancestors=["A"])
+        builder.add_epoch("C", start_size=50)
+        builder.add_deme(
+            "D", start_time=20, ancestors=["B", "C"], proportions=[0.25, 0.75]
+        )
+        builder.add_epoch("D", start_size=50, cloning_rate=0.5)
+        builder.add_migration(demes=["B", "C"], rate=1e-3)
+        builder.add_migration(source="C", dest="D", rate=1e-4, end_time=5)
+        builder.add_pulse(sources=["B"], dest="C", proportions=[0.1], time=30)
+        graph = builder.build()
+        assert graph == parser.parse(data)
+        assert graph.as_json_dict() == parser.parse(data).as_json_dict()
+
+    def test_many_demes(self):
+        builder = graph_builder.GraphBuilder(time_units="generations")
+        builder.add_deme("root", start_time=math.inf)
+        builder.add_epoch("root", start_size=1000, end_time=100)
+        for j in range(1000):
+            builder.add_deme(f"deme{j}", ancestors=["root"])
+            builder.add_epoch(f"deme{j}", start_size=100)
+        graph = builder.build()
+        assert len(graph.demes) == 1001
+        assert graph.demes["deme999"].start_time == 100
+
+    @pytest.mark.parametrize(
+        "method,kwargs,error",
+        [
+            ("add_deme", dict(name="not an identifier"), ValueError),
+            ("add_deme", dict(name="x", start_time=0), ValueError),
+            ("add_deme", dict(name="x", ancestors="A"), TypeError),
+            ("add_deme", dict(name="x", proportions=[0]), ValueError),
+            ("add_deme", dict(name="x", ancestors=["nonexistent"]), KeyError),
+            ("add_epoch", dict(deme="A", start_size=-1), ValueError),
+            ("add_epoch", dict(deme="A", end_time=math.inf), ValueError),
+            ("add_epoch", dict(deme="A", selfing_rate=2), ValueError),
+            ("add_epoch", dict(deme="A", size_function=1), TypeError),
+            ("add_epoch", dict(deme="nonexistent", start_size=1), KeyError),
+            ("add_migration", dict(rate=-1, source="A", dest="B"), ValueError),
+            ("add_migration", dict(rate=0.1, source=""), ValueError),
+            ("add_migration", dict(rate=0.1, demes=["A"]), ValueError),
+            ("add_migration", dict(rate=0.1, source="A"), ValueError),
+            (
+                "add_pulse",
+                dict(sources=["A"], dest="B", time=0, proportions=[1]),
+                ValueError,
+            ),
+            (
+                "add_pulse",
+                dict(sources="A", dest="B", time=1, proportions=[1]),
+                TypeError,
+            ),
+        ],
+    )
+    def test_bad_arguments(self, method, kwargs, error):
+        builder = graph_builder.GraphBuilder(time_units="generations")
+        builder.add_deme("A")
+        builder.add_deme("B")
+        with pytest.raises(error):
+            getattr(builder, method)(**kwargs)
+
+    def test_bad_graph_arguments(self):
+        with pytest.raises(TypeError):
+            graph_builder.GraphBuilder(time_units=1)
+        with pytest.raises(ValueError):
+            graph_builder.GraphBuilder(time_units="years", generation_time=0)
+        with pytest.raises(ValueError):
+            graph_builder.GraphBuilder(time_units="years", doi=[""])
+        with pytest.raises(TypeError):
+            graph_builder.GraphBuilder(time_units="years", metadata=[])
+
+    def test_build_errors(self):
+        builder = graph_builder.GraphBuilder(time_units="generations")
+        with pytest.raises(ValueError, match="one or more demes"):
+            builder.build()
+        # The builder can't be reused.
+        with pytest.raises(ValueError, match="already been built"):
+            builder.add_deme("A")
+
+        builder = graph_builder.GraphBuilder(time_units="generations")
+        builder.add_deme("A")
+        with pytest.raises(ValueError, match="no epochs"):
+            builder.build()
+
+        builder = graph_builder.GraphBuilder(time_units="years")
+        builder.add_deme("A")
+        builder.add_epoch("A", start_size=1)
+        with pytest.raises(ValueError, match="generation_time"):
+            builder.build()
+
+
+def lift_parameters(value, parameters, key=None):
+    # Replace every number outside of the metadata with a placeholder, and
+    # record the number as the parameter's value.
+    if key == "metadata":
+        return value
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        name = f"p{len(parameters)}"
+        parameters[name] = value
+        return "$" + name
+    if isinstance(value, list):
+        return [lift_parameters(item, parameters) for item in value]
+    if isinstance(value, dict):
+        return {k: lift_parameters(v, parameters, k) for k, v in value.items()}
+    return value
+
+
+class TestTemplate:
+    def template(self):
+        return templates.Template(
+            {
+                "time_units": "generations",
+                "demes": [
+                    {
+                        "name": "A",
+                        "epochs": [
+                            {"start_size": "$N_anc", "end_time": "$T"},
+                            {"start_size": "$N_A"},
+                        ],
+                    },
+                    {
+                        "name": "B",
+                        "ancestors": ["A"],
+                        "start_time": "$T",
+                        "epochs": [{"start_size": "$N_B"}],
+                    },
+                ],
+                "migrations": [{"demes": ["A", "B"], "rate": "$m"}],
+            }
+        )
+
+    def test_parameters(self):
+        template = self.template()
+        assert template.parameters == ["N_anc", "T", "N_A", "N_B", "m"]
+        values = dict(N_anc=1000, T=100, N_A=200, N_B=300, m=1e-3)
+        graph = template.bind(values)
+        assert graph.demes["A"].epochs[0].end_time == 100
+        assert graph.demes["B"].start_time == 100
+        assert graph.demes["B"].epochs[0].start_size == 300
+        assert [m.rate for m in graph.migrations] == [1e-3, 1e-3]
+        assert template.bind([1000, 100, 200, 300, 1e-3]) == graph
+        assert template.is_valid(values)
+
+    @pytest.mark.parametrize(
+        "values,error",
+        [
+            (dict(N_anc=1000, T=100, N_A=200, N_B=300), KeyError),
+            (dict(N_anc=1000, T=100, N_A=200, N_B=300, m=0, x=1), KeyError),
+            ([1000, 100, 200, 300], ValueError),
+            ([1000, 100, 200, 300, "0"], TypeError),
+            ([1000, 0, 200, 300, 0], ValueError),
+            ([1000, 100, -1, 300, 0], ValueError),
+            ([1000, math.inf, 200, 300, 0], ValueError),
+            ([1000, 100, 200, 300, 1.5], ValueError),
+        ],
+    )
+    def test_bad_values(self, values, error):
+        template = self.template()
+        with pytest.raises(error):
+            template.bind(values)
+        if error is ValueError and len(values) == 5:
+            assert not template.is_valid(values)
+
+    def test_unused_defaults_are_checked(self):
+        data = minimal_graph()
+        data["defaults"] = {
+            "epoch": {"cloning_rate": "$c"},
+            "pulse": {"proportions": [0.5, "$p"]},
+        }
+        template = templates.Template(data)
+        assert template.is_valid([0.5, 0.25])
+        assert not template.is_valid([1.5, 0.25])
+        assert not template.is_valid([0.5, 0.75])
+
+    def test_pulses_sorted(self):
+        data = minimal_graph(2)
+        data["pulses"] = [
+            {
+                "sources": ["deme0"],
+                "dest": "deme1",
+                "time": "$t1",
+                "proportions": [0.1],
+            },
+            {
+                "sources": ["deme1"],
+                "dest": "deme0",
+                "time": "$t2",
+                "proportions": [0.1],
+            },
+        ]
+        template = templates.Template(data)
+        assert [p.time for p in template.bind([1, 2]).pulses] == [2, 1]
+        assert [p.time for p in template.bind([2, 1]).pulses] == [2, 1]
+
+    def test_size_function(self):
+        data = minimal_graph()
+        data["demes"][0]["epochs"] = [
+            {"end_time": 10, "start_size": 100},
+            {"end_size": "$N"},
+        ]
+        template = templates.Template(data)
+        assert template.bind([100]).demes["deme0"].epochs[1].size_function == (
+            "constant"
+        )
+        assert template.bind([200]).demes["deme0"].epochs[1].size_function == (
+            "exponential"
+        )
+
+    def test_static_values(self):
+        # Values that don't depend on the parameters are resolved, and
+        # checked, when the template is compiled.
+        template = templates.Template(minimal_graph())
+        assert template.parameters == []
+        assert all(template.is_static(slot) for slot in range(template.num_slots))
+        assert template.bind({}) == parser.parse(minimal_graph())
+        with pytest.raises(ValueError):
+            templates.Template(minimal_graph(population_size=-1))
+
+    def test_bad_placeholders(self):
+        data = minimal_graph()
+        data["description"] = "$x"
+        # Placeholders are only substituted for numbers.
+        with pytest.raises(TypeError):
+            templates.Template(data)
+        data = minimal_graph()
+        data["metadata"] = {"x": "$x"}
+        template = templates.Template(data)
+        assert template.parameters == []
+        assert template.bind({}).metadata == {"x": "$x"}
+
+    @pytest.mark.parametrize(
+        "yaml_path", map(str, pathlib.Path("../test-cases/valid").glob("*.yaml"))
+    )
+    def test_valid_cases(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            data = yaml.load(source)
+        resolved = parser.parse(data).as_json_dict()
+        parameters = {}
+        template = templates.Template(lift_parameters(data, parameters))
+        assert template.bind(parameters).as_json_dict() == resolved
+        assert templates.Template(data).bind({}).as_json_dict() == resolved
+
+    @pytest.mark.parametrize(
+        "yaml_path",
+        [
+            str(path)
+            for path in pathlib.Path("../test-cases/invalid").glob("*.yaml")
+            if path.name != "invalid_fields_11.yaml"
+        ],
+    )
+    def test_invalid_cases(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            data = yaml.load(source)
+        parameters = {}
+        lifted = lift_parameters(data, parameters)
+        try:
+            template = templates.Template(lifted)
+        except (ValueError, TypeError, KeyError):
+            pass
+        else:
+            with pytest.raises((ValueError, TypeError, KeyError)) as bind_error:
+                template.bind(parameters)
+            # The compiled bind() fails on the same check as evaluate().
+            with pytest.raises(type(bind_error.value)) as evaluate_error:
+                template.evaluate(parameters)
+            assert str(evaluate_error.value) == str(bind_error.value)
+        with pytest.raises((ValueError, TypeError, KeyError)):
+            templates.Template(data).bind({})
+
+
+class TestBatchTemplate:
+    def template(self):
+        data = minimal_graph(3)
+        data["demes"][0]["epochs"] = [
+            {"start_size": 100, "end_time": "$T"},
+            {"start_size": 100, "end_size": "$N"},
+        ]
+        data["migrations"] = [
+            {"source": "deme0", "dest": "deme1", "rate": "$m1"},
+            {"source": "deme1", "dest": "deme0", "rate": "$m2", "start_time": 50},
+        ]
+        data["pulses"] = [
+            {"sources": ["deme0"], "dest": "deme1", "time": "$t", "proportions": [0.1]},
+            {
+                "sources": ["deme1", "deme2"],
+                "dest": "deme0",
+                "time": 20,
+                "proportions": ["$p", 0.1],
+            },
+        ]
+        return templates.Template(data)
+
+    def test_matches_evaluate(self):
+        template = self.template()
+        assert template.parameters == ["T", "N", "m1", "m2", "t", "p"]
+        values = np.array(
+            [
+                [100, 200, 0.1, 0.2, 10, 0.5],
+                [100, 200, 0.1, 0.2, 30, 0.5],
+                [0, 200, 0.1, 0.2, 10, 0.5],
+                [100, -1, 0.1, 0.2, 10, 0.5],
+                [100, 200, 0.1, 0.2, 10, 0],
+                [100, 200, 1.5, 0.2, 10, 0.5],
+                [math.inf, 200, 0.1, 0.2, 10, 0.5],
+                [math.nan, 200, 0.1, 0.2, 10, 0.5],
+                [100, 200, 0.1, 0.2, 0, 0.5],
+            ]
+        )
+        result = batch.BatchTemplate(template).evaluate(values)
+        assert list(result.valid) == [True, True] + [False] * 7
+        for row, valid, reason, slots in zip(
+            values, result.valid, result.reasons(), result.slots
+        ):
+            if valid:
+                assert reason is None
+                assert list(slots) == template.evaluate(list(row))
+            else:
+                with pytest.raises(ValueError) as e:
+                    template.evaluate(list(row))
+                assert str(e.value) == reason
+
+        assert result.epochs == [
+            ("deme0", 0),
+            ("deme0", 1),
+            ("deme1", 0),
+            ("deme2", 0),
+        ]
+        assert result.epoch_start_time[0].tolist() == [
+            math.inf,
+            100,
+            math.inf,
+            math.inf,
+        ]
+        assert result.epoch_end_time[0].tolist() == [100, 0, 0, 0]
+        assert result.epoch_start_size[0].tolist() == [100, 100, 1, 1]
+        assert result.epoch_end_size[0].tolist() == [100, 200, 1, 1]
+        assert result.migration_rate[0].tolist() == [0.1, 0.2]
+        assert result.migration_start_time[0].tolist() == [math.inf, 50]
+        assert result.migration_end_time[0].tolist() == [0, 0]
+        assert result.pulse_time[:2].tolist() == [[10, 20], [30, 20]]
+        assert result.pulse_proportions[0].tolist() == [[0.1, 0], [0.5, 0.1]]
+        assert result.pulse_order[:2].tolist() == [[1, 0], [0, 1]]
+        for row, order in zip(values[:2], result.pulse_order):
+            graph = template.bind(list(row))
+            assert [p.time for p in graph.pulses] == [
+                template.evaluate(list(row))[template.pulses[j].time] for j in order
+            ]
+
+    def test_bad_shape(self):
+        evaluator = batch.BatchTemplate(self.template())
+        with pytest.raises(ValueError, match="shape"):
+            evaluator.evaluate(np.zeros(6))
+        with pytest.raises(ValueError, match="shape"):
+            evaluator.evaluate(np.zeros((2, 5)))
+
+    def test_static_template(self):
+        template = templates.Template(minimal_graph())
+        result = batch.BatchTemplate(template).evaluate(np.zeros((3, 0)))
+        assert list(result.valid) == [True] * 3
+        assert result.migration_rate.shape == (3, 0)
+        assert result.pulse_proportions.shape == (3, 0, 0)
+
+    @pytest.mark.parametrize(
+        "yaml_path", map(str, pathlib.Path("../test-cases/valid").glob("*.yaml"))
+    )
+    def test_valid_cases(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            data = yaml.load(source)
+        parameters = {}
+        template = templates.Template(lift_parameters(data, parameters))
+        # Scale the parameters randomly, so that some of the samples are
+        # invalid.
+        rng = np.random.default_rng(1234)
+        base = np.array(list(parameters.values()), dtype=float)
+        values = base * rng.choice([0.5, 1, 1, 2], size=(20, len(base)))
+        result = batch.BatchTemplate(template).evaluate(values)
+        for row, reason, slots in zip(values, result.reasons(), result.slots):
+            try:
+                expected = template.evaluate(list(row))
+            except ValueError as e:
+                assert str(e) == reason
+            else:
+                assert reason is None
+                assert list(slots) == expected
+
+
+class TestTimeline:
+    def graph(self):
+        data = {
+            "time_units": "generations",
+            "demes": [
+                {
+                    "name": "A",
+                    "epochs": [
+                        {"start_size": 1000, "end_time": 100},
+                        {"end_size": 4000, "end_time": 50},
+                    ],
+                },
+                {
+                    "name": "B",
+                    "ancestors": ["A"],
+                    "start_time": 100,
+                    "epochs": [
+                        {"start_size": 100, "end_size": 200, "size_function": "linear"}
+                    ],
+                },
+            ],
+            "migrations": [{"source": "A", "dest": "B", "rate": 1e-3, "end_time": 60}],
+            "pulses": [
+                {"sources": ["B"], "dest": "A", "time": 70, "proportions": [0.1]}
+            ],
+        }
+        return parser.parse(data)
+
+    def test_snapshots(self):
+        graph = self.graph()
+        tl = timeline.Timeline(graph)
+        assert tl.times == [100, 70, 60, 50, 0]
+        assert len(tl) == 5
+        assert [(s.start_time, s.end_time) for s in tl] == [
+            (math.inf, 100),
+            (100, 70),
+            (70, 60),
+            (60, 50),
+            (50, 0),
+        ]
+        assert [s.demes for s in tl] == [
+            ["A"],
+            ["A", "B"],
+            ["A", "B"],
+            ["A", "B"],
+            ["B"],
+        ]
+        assert [s.epochs["A"].index for s in tl[:4]] == [0, 1, 1, 1]
+        assert tl[1].epochs["A"] is tl[3].epochs["A"]
+        assert [len(s.migrations) for s in tl] == [0, 1, 1, 0, 0]
+        assert tl[1].migrations[0] is graph.migrations[0]
+        assert [len(s.pulses) for s in tl] == [0, 1, 0, 0, 0]
+        assert tl[1].pulses[0] is graph.pulses[0]
+
+    @pytest.mark.parametrize(
+        "time,index",
+        [
+            (1e6, 0),
+            (100, 0),
+            (99.9, 1),
+            (70, 1),
+            (50, 3),
+            (1, 4),
+            (0, 4),
+        ],
+    )
+    def test_snapshot_at(self, time, index):
+        tl = timeline.Timeline(self.graph())
+        assert tl.index_at(time) == index
+        snapshot = tl.snapshot_at(time)
+        assert snapshot.index == index
+        assert time in snapshot
+
+    @pytest.mark.parametrize("time", [-1, math.inf, math.nan])
+    def test_bad_time(self, time):
+        tl = timeline.Timeline(self.graph())
+        with pytest.raises(ValueError, match="not within"):
+            tl.snapshot_at(time)
+
+    def test_size_at(self):
+        tl = timeline.Timeline(self.graph())
+        epoch = tl[1].epochs["A"]
+        assert epoch.size_function == "exponential"
+        assert epoch.size_at(100 - 1e-9) == pytest.approx(1000)
+        assert epoch.size_at(75) == pytest.approx(2000)
+        assert epoch.size_at(50 + 1e-9) == pytest.approx(4000)
+        assert tl[0].epochs["A"].size_at(1e6) == 1000
+        epoch = tl[4].epochs["B"]
+        assert epoch.size_function == "linear"
+        assert epoch.size_at(50) == pytest.approx(150)
+        assert epoch.size_at(0) == 200
+        with pytest.raises(ValueError, match="not within"):
+            epoch.size_at(100)
+
+    def test_getitem(self):
+        tl = timeline.Timeline(self.graph())
+        assert tl[-1] == tl[4]
+        assert tl[1:3] == [tl[1], tl[2]]
+        assert list(tl) == tl[:]
+        with pytest.raises(IndexError):
+            tl[5]
+
+    @pytest.mark.parametrize("seed", range(10))
+    def test_random_graphs(self, seed):
+        graph = parser.parse(graph_generator.random_graph(seed))
+        tl = timeline.Timeline(graph)
+        for snapshot in tl:
+            time = snapshot.end_time
+            assert snapshot.demes == [
+                deme.name for deme in graph.demes.values() if time in deme.time_interval
+            ]
+            assert [id(m) for m in snapshot.migrations] == [
+                id(m) for m in graph.migrations if time in m.time_interval
+            ]
+            assert [id(p) for p in snapshot.pulses] == [
+                id(p) for p in graph.pulses if p.time == time
+            ]
+
+    def test_storage(self):
+        # The entities are stored in O(log n) nodes each, rather than in each
+        # of the snapshots that they're in.
+        data = island_model_graph(50, migration_rate=1e-5)
+        data["pulses"] = [
+            {"sources": ["deme0"], "dest": "deme1", "time": t, "proportions": [0.1]}
+            for t in range(1, 1601)
+        ]
+        tl = timeline.Timeline(parser.parse(data))
+        assert len(tl) == 1601
+        stored = sum(len(ids) for ids in tl._nodes.values())
+        num_entities = len(tl._entities)
+        assert stored <= 2 * num_entities * math.ceil(math.log2(len(tl)))
+        assert len(tl[800].migrations) == 50 * 49
+
+    @pytest.mark.parametrize(
+        "yaml_path", map(str, pathlib.Path("../examples/").glob("*.yaml"))
+    )
+    def test_examples(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            graph = parser.parse(yaml.load(source))
+        tl = timeline.Timeline(graph)
+        for snapshot in tl:
+            if math.isinf(snapshot.start_time):
+                time = snapshot.end_time + 1
+            else:
+                time = (snapshot.start_time + snapshot.end_time) / 2
+            assert tl.snapshot_at(time) == snapshot
+            assert snapshot.demes == [
+                deme.name for deme in graph.demes.values() if time in deme.time_interval
+            ]
+            assert set(snapshot.epochs) == set(snapshot.demes)
+            for name, epoch in snapshot.epochs.items():
+                assert graph.demes[name].epochs[epoch.index].end_time == epoch.end_time
+                assert time in parser.Interval(epoch.start_time, epoch.end_time)
+            assert [id(m) for m in snapshot.migrations] == [
+                id(m) for m in graph.migrations if time in m.time_interval
+            ]
+
+
+def integrate(f, start_time, end_time, n=200001):
+    # The trapezoidal rule, for checking the closed-form integrals.
+    x = np.linspace(end_time, start_time, n)
+    y = f(x)
+    return (start_time - end_time) / (n - 1) * (y.sum() - (y[0] + y[-1]) / 2)
+
+
+class TestSizeHistory:
+    def history(self, generation_time=None):
+        data = {
+            "time_units": "generations" if generation_time is None else "years",
+            "generation_time": generation_time,
+            "demes": [
+                {
+                    "name": "A",
+                    "epochs": [
+                        {"start_size": 1000, "end_time": 500},
+                        {"end_size": 100, "end_time": 200},
+                        {"end_size": 5000, "end_time": 100, "size_function": "linear"},
+                        {"end_size": 300, "end_time": 50},
+                        {"end_size": 300, "end_time": 10, "size_function": "linear"},
+                        {"end_size": 600},
+                    ],
+                }
+            ],
+        }
+        if generation_time is None:
+            del data["generation_time"]
+        graph = parser.parse(data)
+        return coalescence.size_histories(graph)["A"]
+
+    def test_size(self):
+        history = self.history()
+        assert list(history.size([1e6, 500, 200, 150, 100, 0])) == pytest.approx(
+            [1000, 1000, 100, 2550, 5000, 600]
+        )
+        assert history.size(math.inf) == 1000
+        assert history.size(350) == pytest.approx(math.sqrt(1000 * 100))
+
+    @pytest.mark.parametrize(
+        "start_time,end_time",
+        [(600, 0), (450, 150), (20, 10), (100, 0), (499, 120), (60, 40)],
+    )
+    def test_integral(self, start_time, end_time):
+        history = self.history()
+        expected = integrate(lambda t: 1 / history.size(t), start_time, end_time)
+        assert history.integral(start_time, end_time) == pytest.approx(expected)
+        mean = history.harmonic_mean_size(start_time, end_time)
+        assert mean == pytest.approx((start_time - end_time) / expected)
+
+    def test_integral_arrays(self):
+        history = self.history()
+        start_times = np.array([600, 450, 20])
+        end_times = np.array([0, 150, 10])
+        integrals = history.integral(start_times, end_times)
+        assert integrals.shape == (3,)
+        for start_time, end_time, integral in zip(start_times, end_times, integrals):
+            assert history.integral(start_time, end_time) == integral
+        assert history.integral(math.inf, 0) == math.inf
+
+    def test_inverse(self):
+        history = self.history()
+        times = np.array([0, 10, 50, 100, 150, 300, 499, 1000, 1e6])
+        assert history.inverse(history.cumulative(times)) == pytest.approx(times)
+        integrals = history.integral(np.array([300, 600]), 120)
+        assert history.inverse(integrals, end_time=120) == pytest.approx([300, 600])
+        assert history.inverse(0, end_time=120) == pytest.approx(120)
+
+    def test_expected_coalescence_time(self):
+        history = self.history()
+        for t in [0, 30, 75, 150, 400, 600]:
+            expected = integrate(
+                lambda x: np.exp(-(history.cumulative(x) - history.cumulative(t)) / 2),
+                t + 200000,
+                t,
+                n=2000001,
+            )
+            assert history.expected_coalescence_time(t) == pytest.approx(expected)
+        # An isolated deme with a constant size.
+        assert history.expected_coalescence_time(600) == pytest.approx(2000)
+        assert history.expected_coalescence_time(600, ploidy=1) == pytest.approx(1000)
+        times = history.expected_coalescence_time(np.array([0, 600]))
+        assert times[0] == history.expected_coalescence_time()
+
+    def test_generation_time(self):
+        history = self.history(generation_time=25)
+        # Sizes and integrals over time are unaffected, but coalescence
+        # rates are per generation.
+        assert history.integral(600, 0) == self.history().integral(600, 0)
+        assert history.expected_coalescence_time(600) == pytest.approx(2000 * 25)
+
+    def test_linear_rate_equal_to_coalescence_rate(self):
+        # The survival function is linear in time when the linear slope is
+        # equal to the coalescence rate.
+        graph = parser.parse(
+            {
+                "time_units": "generations",
+                "demes": [
+                    {
+                        "name": "A",
+                        "epochs": [
+                            {"start_size": 150, "end_time": 100},
+                            {"end_size": 100, "size_function": "linear"},
+                        ],
+                    }
+                ],
+            }
+        )
+        history = coalescence.SizeHistory(graph.demes["A"])
+        assert history.linear_slopes[1] == 0.5
+        expected = integrate(
+            lambda x: np.exp(-history.cumulative(x) / 2), 200000, 0, n=2000001
+        )
+        assert history.expected_coalescence_time() == pytest.approx(expected)
+
+    def test_exponential_integrals(self):
+        x = np.array([0.1, 1, 2, 10, 100])
+        e1 = [1.8229239584193906, 0.21938393439552029, 0.04890051070806112]
+        e1 += [4.156968929685324e-06, 3.683597761682032e-46]
+        assert coalescence.scaled_e1(x) * np.exp(-x) == pytest.approx(e1)
+        x = np.array([0.1, 1, 2, 10, 50])
+        ei = [-1.6228128139692766, 1.8951178163559368, 4.954234356001890]
+        ei += [2492.228976241878, 1.058563689713169e20]
+        assert coalescence.scaled_ei(x) * np.exp(x) == pytest.approx(ei)
+
+    def test_errors(self):
+        history = self.history()
+        with pytest.raises(ValueError, match="time interval"):
+            history.size(-1)
+        with pytest.raises(ValueError, match="integral values"):
+            history.inverse(-1)
+        with pytest.raises(ValueError, match="greater than"):
+            history.harmonic_mean_size(10, 10)
+        with pytest.raises(ValueError, match="finite"):
+            history.expected_coalescence_time(math.inf)
+
+        graph = parser.parse(two_ancestor_graph())
+        history = coalescence.SizeHistory(graph.demes["child_0"])
+        with pytest.raises(ValueError, match="finite start_time"):
+            history.expected_coalescence_time()
+        with pytest.raises(ValueError, match="integral values"):
+            history.inverse(history.integral(history.start_time, 0) * 2)
+
+
+class TestDiscretize:
+    def graph(self):
+        data = {
+            "time_units": "years",
+            "generation_time": 10,
+            "demes": [
+                {
+                    "name": "A",
+                    "epochs": [
+                        {"start_size": 100, "end_time": 1004},
+                        # Rounded to zero length.
+                        {"start_size": 200, "end_time": 998},
+                        {"start_size": 100, "end_time": 503},
+                        {"start_size": 200, "end_size": 240, "end_time": 0},
+                    ],
+                },
+                {"name": "B", "ancestors": ["A"], "start_time": 1996, "epochs": [{}]},
+            ],
+            "defaults": {"epoch": {"start_size": 100}},
+            "migrations": [
+                {"source": "A", "dest": "B", "rate": 1e-3, "end_time": 1000},
+                {"source": "A", "dest": "B", "rate": 1e-3, "start_time": 1000},
+                {
+                    "source": "B",
+                    "dest": "A",
+                    "rate": 1e-4,
+                    "start_time": 302,
+                    "end_time": 298,
+                },
+            ],
+            "pulses": [
+                {"sources": ["A"], "dest": "B", "time": 52, "proportions": [0.1]},
+                {"sources": ["B"], "dest": "A", "time": 54, "proportions": [0.2]},
+                {"sources": ["A"], "dest": "B", "time": 48, "proportions": [0.3]},
+            ],
+        }
+        return parser.parse(data)
+
+    def test_discretize(self):
+        graph = self.graph()
+        discrete = discretize.discretize(graph)
+        deme = discrete.demes["A"]
+        assert (deme.start_time, deme.end_time) == (math.inf, 0)
+        assert [(e.start_time, e.end_time) for e in deme.epochs] == [
+            (math.inf, 100),
+            (100, 50),
+            (50, 0),
+        ]
+        assert discrete.zero_length == [
+            discretize.ZeroLength("epoch", "A", 1, 100),
+            discretize.ZeroLength("migration", "B->A", 2, 30),
+        ]
+        # The constant epochs are merged into one run.
+        assert deme.size_schedule[0] == discretize.Run(math.inf, 50, 100)
+        assert deme.selfing_schedule == [discretize.Run(math.inf, 0, 0)]
+        assert discrete.demes["B"].start_time == 200
+        assert discrete.demes["B"].size_schedule == [discretize.Run(200, 0, 100)]
+
+        # The pulses at 52 and 48 years are both rounded to generation 5,
+        # and their order is kept.
+        assert [(p.time, p.proportions) for p in discrete.pulses] == [
+            (5, [0.2]),
+            (5, [0.1]),
+            (5, [0.3]),
+        ]
+        assert len(discrete.migrations) == 2
+        assert discrete.migration_schedules == {
+            ("A", "B"): [discretize.Run(200, 0, 1e-3)]
+        }
+
+    def test_size_schedule(self):
+        discrete = discretize.discretize(self.graph())
+        deme = discrete.demes["A"]
+        runs = deme.size_schedule[1:]
+        # The runs cover the epoch, in order.
+        assert runs[0].start_time == 50
+        assert runs[-1].end_time == 0
+        for run_a, run_b in zip(runs, runs[1:]):
+            assert run_a.end_time == run_b.start_time
+            assert run_a.value < run_b.value
+        for k in range(50):
+            (run,) = [run for run in runs if run.start_time > k >= run.end_time]
+            assert run.value == round(200 * 1.2 ** ((50 - k) / 50))
+        assert runs[-1].value == 240
+        assert len(runs) < 50
+
+        discrete = discretize.discretize(self.graph(), integer_sizes=False)
+        runs = discrete.demes["A"].size_schedule[1:]
+        assert len(runs) == 50
+        assert runs[0].value == pytest.approx(200 * 1.2 ** (1 / 50))
+
+    def test_linear_size_schedule(self):
+        data = minimal_graph()
+        data["demes"][0]["epochs"] = [
+            {"start_size": 100, "end_time": 10},
+            {"end_size": 120, "size_function": "linear"},
+        ]
+        discrete = discretize.discretize(parser.parse(data))
+        assert discrete.demes["deme0"].size_schedule[1:] == [
+            discretize.Run(start_time=k + 1, end_time=k, value=120 - 2 * k)
+            for k in range(9, -1, -1)
+        ]
+
+    @pytest.mark.parametrize(
+        "rounding,times", [("floor", [100, 99, 50]), ("ceil", [101, 100, 51])]
+    )
+    def test_rounding(self, rounding, times):
+        discrete = discretize.discretize(self.graph(), rounding=rounding)
+        assert [e.end_time for e in discrete.demes["A"].epochs[:3]] == times
+        assert discrete.zero_length == []
+
+    def test_zero_length_deme(self):
+        data = minimal_graph()
+        data["time_units"] = "years"
+        data["generation_time"] = 10
+        data["demes"][0]["epochs"][0]["end_time"] = 100
+        data["demes"].append(
+            {
+                "name": "B",
+                "ancestors": ["deme0"],
+                "epochs": [{"start_size": 1, "end_time": 98}],
+            }
+        )
+        discrete = discretize.discretize(parser.parse(data))
+        assert discrete.zero_length == [
+            discretize.ZeroLength("epoch", "B", 0, 10),
+            discretize.ZeroLength("deme", "B", None, 10),
+        ]
+        assert discrete.demes["B"].epochs == []
+
+    def test_bad_rounding(self):
+        with pytest.raises(ValueError, match="rounding"):
+            discretize.discretize(self.graph(), rounding="up")
+
+
+class TestEventList:
+    def graph(self):
+        data = {
+            "time_units": "generations",
+            "demes": [
+                {"name": "X", "epochs": [{"start_size": 100, "end_time": 500}]},
+                {
+                    "name": "A",
+                    "ancestors": ["X"],
+                    "epochs": [
+                        {"start_size": 1000, "end_time": 100},
+                        {"end_size": 4000, "end_time": 50},
+                        {"end_size": 2000, "size_function": "linear"},
+                    ],
+                },
+                {"name": "B", "ancestors": ["X"], "epochs": [{"start_size": 500}]},
+                {
+                    "name": "C",
+                    "ancestors": ["A", "B"],
+                    "proportions": [0.25, 0.75],
+                    "start_time": 100,
+                    "epochs": [{"start_size": 200}],
+                },
+            ],
+            "migrations": [
+                {"source": "A", "dest": "B", "rate": 1e-3, "start_time": 400},
+                {"source": "A", "dest": "B", "rate": 1e-3, "end_time": 400},
+                {"source": "B", "dest": "A", "rate": 1e-4, "end_time": 300},
+                {"source": "B", "dest": "A", "rate": 2e-4, "start_time": 300},
+            ],
+            "pulses": [
+                {"sources": ["A"], "dest": "B", "time": 80, "proportions": [0.1]},
+                {"sources": ["B"], "dest": "A", "time": 80, "proportions": [0.2]},
+            ],
+        }
+        return parser.parse(data)
+
+    def test_events(self):
+        el = events.EventList(self.graph())
+        assert el.deme_names == ["X", "A", "B", "C"]
+        assert el.deme_index == {"X": 0, "A": 1, "B": 2, "C": 3}
+        assert el.times == [0, 50, 80, 100, 300, 500]
+        assert len(el) == 6
+
+        events_at_time = el.batch_at(0)
+        assert [type(e) for e in events_at_time.events] == [
+            events.SizeChange,
+            events.SizeChange,
+            events.SizeChange,
+            events.MigrationRateChange,
+            events.MigrationRateChange,
+        ]
+        size_a = events_at_time.events[0]
+        assert size_a.deme == 1
+        assert size_a.size_function == "linear"
+        assert size_a.initial_size == 2000
+        assert size_a.linear_rate == pytest.approx((4000 - 2000) / 50)
+        assert events_at_time.events[3] == events.MigrationRateChange(0, 1, 2, 1e-3)
+        assert events_at_time.events[4] == events.MigrationRateChange(0, 2, 1, 2e-4)
+
+        size_a = el.batch_at(50).events[0]
+        assert size_a.size_function == "exponential"
+        assert size_a.growth_rate == pytest.approx(math.log(4000 / 1000) / 50)
+        assert size_a.initial_size * math.exp(-size_a.growth_rate * 50) == (
+            pytest.approx(1000)
+        )
+
+        # Pulses are applied in reverse backwards in time.
+        assert el.batch_at(80).events == [
+            events.PulseEvent(80, [2], 1, [0.2]),
+            events.PulseEvent(80, [1], 2, [0.1]),
+        ]
+        assert el.batch_at(100).events[-1] == events.AncestryEvent(
+            100, 3, [1, 2], [0.25, 0.75]
+        )
+        # The A->B migrations meet at 400 with the same rate, so there is no
+        # change then.
+        assert el.batch_at(400) is None
+        assert el.batch_at(300).events == [events.MigrationRateChange(300, 2, 1, 1e-4)]
+        events_at_time = el.batch_at(500)
+        assert [type(e) for e in events_at_time.events] == [
+            events.SizeChange,
+            events.MigrationRateChange,
+            events.MigrationRateChange,
+            events.AncestryEvent,
+            events.AncestryEvent,
+        ]
+        assert [e.rate for e in events_at_time.events[1:3]] == [0, 0]
+
+    def test_batches_between(self):
+        el = events.EventList(self.graph())
+        assert [b.time for b in el.batches_between(300, 50)] == [50, 80, 100]
+        assert [b.time for b in el.batches_between(math.inf, 0)] == el.times
+        assert [b.time for b in el] == el.times
+
+    @pytest.mark.parametrize(
+        "yaml_path", map(str, pathlib.Path("../examples/").glob("*.yaml"))
+    )
+    def test_examples(self, yaml_path):
+        # Replaying the events gives the same state as the timeline.
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            graph = parser.parse(yaml.load(source))
+        el = events.EventList(graph)
+        tl = timeline.Timeline(graph)
+        active = {}
+        rates = {}
+        for events_at_time in el:
+            for event in events_at_time.events:
+                if isinstance(event, events.SizeChange):
+                    active[event.deme] = event
+                elif isinstance(event, events.MigrationRateChange):
+                    rates[(event.source, event.dest)] = event.rate
+                elif isinstance(event, events.AncestryEvent):
+                    del active[event.deme]
+            # The event times are the end times of the snapshots, so this is
+            # the snapshot for the time just above the batch.
+            snapshot = tl.snapshot_at(events_at_time.time)
+            assert sorted(el.deme_names[j] for j in active) == sorted(snapshot.demes)
+            for j, event in active.items():
+                epoch = snapshot.epochs[el.deme_names[j]]
+                assert event.initial_size == epoch.end_size
+            expected_rates = {
+                (el.deme_index[m.source.name], el.deme_index[m.dest.name]): m.rate
+                for m in snapshot.migrations
+            }
+            assert {pair: r for pair, r in rates.items() if r != 0} == expected_rates
+
+
+class TestGraphGenerator:
+    @pytest.mark.parametrize("seed", range(20))
+    @pytest.mark.parametrize(
+        "knobs",
+        [
+            {},
+            dict(num_demes=1, depth=0),
+            dict(num_demes=5, depth=0, migration_density=1),
+            dict(
+                num_demes=30,
+                depth=5,
+                max_epochs=5,
+                max_ancestors=3,
+                migration_density=0.5,
+                num_pulse_times=5,
+                pulses_per_time=3,
+            ),
+        ],
+    )
+    def test_valid(self, seed, knobs):
+        data = graph_generator.random_graph(seed, **knobs)
+        graph = parser.parse(data)
+        assert len(graph.demes) == knobs.get("num_demes", 10)
+        for deme in graph.demes.values():
+            assert 1 <= len(deme.epochs) <= knobs.get("max_epochs", 3)
+            assert len(deme.ancestors) <= knobs.get("max_ancestors", 2)
+        pulse_times = {pulse.time for pulse in graph.pulses}
+        assert len(pulse_times) <= knobs.get("num_pulse_times", 2)
+        for t in pulse_times:
+            num_pulses = sum(pulse.time == t for pulse in graph.pulses)
+            assert num_pulses <= knobs.get("pulses_per_time", 1)
+
+    def depth(self, graph, name):
+        ancestors = graph.demes[name].ancestors
+        return max((1 + self.depth(graph, a.name) for a in ancestors), default=0)
+
+    @pytest.mark.parametrize("depth", [0, 1, 4])
+    def test_depth(self, depth):
+        for seed in range(10):
+            data = graph_generator.random_graph(seed, num_demes=20, depth=depth)
+            graph = parser.parse(data)
+            assert max(self.depth(graph, name) for name in graph.demes) <= depth
+
+    def test_no_migrations_or_pulses(self):
+        data = graph_generator.random_graph(
+            1, num_demes=10, migration_density=0, num_pulse_times=0
+        )
+        assert "migrations" not in data
+        assert "pulses" not in data
+        parser.parse(data)
+
+    def test_seeds(self):
+        a = graph_generator.random_graph(1234)
+        assert graph_generator.random_graph(1234) == a
+        assert graph_generator.random_graph(1235) != a
+        rng = random.Random(1234)
+        assert graph_generator.random_graph(rng) == a
+
+    @pytest.mark.parametrize(
+        "knobs",
+        [dict(num_demes=0), dict(depth=-1), dict(max_epochs=0), dict(max_ancestors=0)],
+    )
+    def test_bad_knobs(self, knobs):
+        with pytest.raises(ValueError):
+            graph_generator.random_graph(1, **knobs)
+
+    @hypothesis.given(graph_generator.graphs())
+    @hypothesis.settings(max_examples=50, deadline=None)
+    def test_strategy(self, data):
+        graph = parser.parse(data)
+        assert parser.parse(graph.as_json_dict()) == graph
+
+
+class CharCounter:
+    # A text stream that counts the characters written to it.
+    def __init__(self):
+        self.count = 0
+
+    def write(self, text):
+        self.count += len(text)
+
+
+class TestGraphWriter:
+    def graphs(self):
+        yaml = YAML(typ="safe")
+        for path in sorted(pathlib.Path("../examples/").glob("*.yaml")):
+            with open(path, encoding="utf-8") as source:
+                yield parser.parse(yaml.load(source))
+        for seed in range(10):
+            yield parser.parse(graph_generator.random_graph(seed))
+
+    def write(self, graph, format):
+        stream = io.StringIO()
+        graph_writer.write_graph(graph, stream, format)
+        return stream.getvalue()
+
+    def test_pretty(self):
+        for graph in self.graphs():
+            expected = json.dumps(graph.as_json_dict(), indent=2) + "\n"
+            assert self.write(graph, "pretty") == expected
+
+    def test_default_format(self):
+        graph = parser.parse(minimal_graph())
+        stream = io.StringIO()
+        graph_writer.write_graph(graph, stream)
+        assert stream.getvalue() == self.write(graph, "pretty")
+
+    def test_compact(self):
+        for graph in self.graphs():
+            data = graph.as_json_dict()
+            expected = json.dumps(data, separators=(",", ":")) + "\n"
+            assert self.write(graph, "compact") == expected
+
+    def test_yaml(self):
+        yaml = YAML(typ="safe")
+        for graph in self.graphs():
+            data = yaml.load(self.write(graph, "yaml"))
+            assert data == graph.as_json_dict()
+            assert list(data) == list(graph.as_json_dict())
+            assert parser.parse(data) == graph
+
+    @pytest.mark.parametrize("format", graph_writer.FORMATS)
+    def test_metadata(self, format):
+        data = minimal_graph()
+        data["metadata"] = {"a": [1, {"b": "c"}], "d": {}}
+        graph = parser.parse(data)
+        if format == "yaml":
+            output = YAML(typ="safe").load(self.write(graph, format))
+        else:
+            output = json.loads(self.write(graph, format))
+        assert output == graph.as_json_dict()
+
+    def test_bad_format(self):
+        graph = parser.parse(minimal_graph())
+        with pytest.raises(ValueError, match="format must be one of"):
+            graph_writer.write_graph(graph, io.StringIO(), "xml")
+
+    @pytest.mark.parametrize("format", ["pretty", "compact"])
+    def test_memory(self, format):
+        # The peak memory used while writing is much smaller than the output.
+        # With 60 demes there are 3540 migrations, and about 500 kB of output,
+        # which is enough to show this. Larger models make the test slow when
+        # coverage is measured, as parsing them takes several seconds.
+        graph = parser.parse(island_model_graph(60, 1000, 1e-5))
+        stream = CharCounter()
+        tracemalloc.start()
+        try:
+            graph_writer.write_graph(graph, stream, format)
+            _, peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        assert peak < stream.count / 10
+
+
+class TestSimplify:
+    def abc_graph(self):
+        data = minimal_graph(3)
+        for deme, name in zip(data["demes"], "abc"):
+            deme["name"] = name
+        return data
+
+    @pytest.mark.parametrize(
+        "path",
+        list(map(str, pathlib.Path("../examples/").glob("*.yaml")))
+        + list(map(str, pathlib.Path("../test-cases/valid").glob("*.yaml"))),
+    )
+    def test_round_trip(self, path):
+        yaml = YAML(typ="safe")
+        with open(path, encoding="utf-8") as source:
+            graph = parser.parse(yaml.load(source))
+        data = simplify.simplify(graph)
+        # The document must survive serialisation as JSON.
+        data = json.loads(json.dumps(data))
+        assert parser.parse(data) == graph
+        # Simplifying is idempotent.
+        assert simplify.simplify(parser.parse(data)) == data
+
+    @hypothesis.given(graph_generator.graphs())
+    @hypothesis.settings(max_examples=50, deadline=None)
+    def test_random_graphs(self, data):
+        graph = parser.parse(data)
+        assert parser.parse(simplify.simplify(graph)) == graph
+
+    def test_minimal(self):
+        graph = parser.parse(minimal_graph())
+        assert simplify.simplify(graph) == {
+            "time_units": "generations",
+            "demes": [{"name": "deme0", "epochs": [{"start_size": 1}]}],
+        }
+
+    def test_graph_fields(self):
+        data = minimal_graph()
+        data.update(
+            time_units="years",
+            generation_time=25,
+            description="model",
+            doi=["https://example.com"],
+            metadata={"a": [1]},
+        )
+        simple = simplify.simplify(parser.parse(data))
+        for key in ["generation_time", "description", "doi", "metadata"]:
+            assert simple[key] == data[key]
+
+    def test_island_model(self):
+        graph = parser.parse(island_model_graph(10, 1000, 1e-5))
+        data = simplify.simplify(graph)
+        assert data["migrations"] == [
+            {"demes": [f"deme{j}" for j in range(10)], "rate": 1e-5}
+        ]
+        assert data["defaults"] == {"epoch": {"start_size": 1000}}
+        assert all(deme == {"name": f"deme{j}"} for j, deme in enumerate(data["demes"]))
+        assert len(json.dumps(data)) * 10 < len(json.dumps(graph.as_json_dict()))
+
+    @pytest.mark.parametrize(
+        "migrations,symmetric",
+        [
+            # Asymmetric migrations that aren't in the expansion order.
+            (
+                [
+                    {"source": "a", "dest": "b", "rate": 0.1},
+                    {"source": "a", "dest": "c", "rate": 0.1},
+                    {"source": "b", "dest": "a", "rate": 0.1},
+                ],
+                [],
+            ),
+            # The reverse pair has a different rate.
+            (
+                [
+                    {"source": "a", "dest": "b", "rate": 0.1},
+                    {"source": "b", "dest": "a", "rate": 0.2},
+                ],
+                [],
+            ),
+            # The reverse pair has a different end time.
+            (
+                [
+                    {"source": "a", "dest": "b", "rate": 0.1},
+                    {"source": "b", "dest": "a", "rate": 0.1, "end_time": 10},
+                ],
+                [],
+            ),
+            # The first row of the expansion of [a, b, c] matches, but the
+            # last pair is in the wrong order.
+            (
+                [
+                    {"source": "a", "dest": "b", "rate": 0.1},
+                    {"source": "b", "dest": "a", "rate": 0.1},
+                    {"source": "a", "dest": "c", "rate": 0.1},
+                    {"source": "c", "dest": "a", "rate": 0.1},
+                    {"source": "c", "dest": "b", "rate": 0.1},
+                    {"source": "b", "dest": "c", "rate": 0.1},
+                ],
+                [["a", "b"], ["a", "c"], ["c", "b"]],
+            ),
+            (
+                [
+                    {"source": "a", "dest": "b", "rate": 0.1},
+                    {"source": "b", "dest": "a", "rate": 0.1},
+                    {"source": "a", "dest": "c", "rate": 0.1},
+                    {"source": "c", "dest": "a", "rate": 0.1},
+                    {"source": "b", "dest": "c", "rate": 0.1},
+                    {"source": "c", "dest": "b", "rate": 0.1},
+                ],
+                [["a", "b", "c"]],
+            ),
+        ],
+    )
+    def test_migration_grouping(self, migrations, symmetric):
+        data = self.abc_graph()
+        data["migrations"] = migrations
+        graph = parser.parse(data)
+        simple = simplify.simplify(graph)
+        assert parser.parse(simple) == graph
+        assert [m["demes"] for m in simple["migrations"] if "demes" in m] == symmetric
+
+    def test_symmetric_with_times(self):
+        data = self.abc_graph()
+        data["demes"][2].update(ancestors=["a"], start_time=1000)
+        data["migrations"] = [
+            {"demes": ["a", "b", "c"], "rate": 0.1, "end_time": 600},
+            {"demes": ["a", "b"], "rate": 0.1, "start_time": 500, "end_time": 200},
+        ]
+        graph = parser.parse(data)
+        simple = simplify.simplify(graph)
+        assert simple["migrations"] == [
+            {"demes": ["a", "b", "c"], "end_time": 600},
+            {"demes": ["a", "b"], "start_time": 500, "end_time": 200},
+        ]
+        assert simple["defaults"]["migration"] == {"rate": 0.1}
+        assert parser.parse(simple) == graph
+
+    def test_dropped_fields(self):
+        data = {
+            "time_units": "generations",
+            "demes": [
+                {
+                    "name": "a",
+                    "epochs": [
+                        {"start_size": 100, "end_time": 1000},
+                        {"end_size": 200, "end_time": 500},
+                        {"end_size": 300, "size_function": "linear"},
+                    ],
+                },
+                {
+                    "name": "b",
+                    "ancestors": ["a"],
+                    "start_time": 800,
+                    "epochs": [{"start_size": 7}],
+                },
+                {
+                    "name": "c",
+                    "ancestors": ["a", "b"],
+                    "proportions": [0.5, 0.5],
+                    "start_time": 600,
+                    "epochs": [{"start_size": 50, "selfing_rate": 0.1}],
+                },
+            ],
+        }
+        simple = simplify.simplify(parser.parse(data))
+        assert simple["demes"] == [
+            {
+                "name": "a",
+                "epochs": [
+                    {"end_time": 1000, "start_size": 100},
+                    {"end_time": 500, "end_size": 200},
+                    {"end_size": 300, "size_function": "linear"},
+                ],
+            },
+            {
+                "name": "b",
+                "start_time": 800,
+                "ancestors": ["a"],
+                "epochs": [{"start_size": 7}],
+            },
+            {
+                "name": "c",
+                "start_time": 600,
+                "ancestors": ["a", "b"],
+                "proportions": [0.5, 0.5],
+                "epochs": [{"start_size": 50, "selfing_rate": 0.1}],
+            },
+        ]
+
+    def test_defaults_spell_out_dropped_fields(self):
+        # Most epochs have start_size 1000, so it becomes the default, and the
+        # epoch whose start_size was dropped as the previous end_size must now
+        # set it.
+        data = minimal_graph(4, 1000)
+        data["demes"][0]["epochs"] = [
+            {"start_size": 50, "end_time": 100},
+            {"start_size": 50},
+        ]
+        graph = parser.parse(data)
+        simple = simplify.simplify(graph)
+        assert simple["defaults"] == {"epoch": {"start_size": 1000}}
+        assert simple["demes"][0]["epochs"] == [
+            {"end_time": 100, "start_size": 50},
+            {"start_size": 50},
+        ]
+        assert parser.parse(simple) == graph
+
+    def test_no_default_for_varying_symmetric_times(self):
+        # The start times of the pairs of the symmetric migration differ, so
+        # it can't use a default start_time.
+        data = self.abc_graph()
+        data["demes"][2].update(ancestors=["a"], start_time=1000)
+        data["migrations"] = [
+            {"demes": ["a", "b", "c"], "rate": 0.1, "end_time": 600},
+            {"source": "a", "dest": "b", "rate": 0.1, "start_time": 500},
+            {"source": "b", "dest": "a", "rate": 0.2, "start_time": 500},
+        ]
+        data["migrations"][1]["end_time"] = 200
+        data["migrations"][2]["end_time"] = 300
+        graph = parser.parse(data)
+        simple = simplify.simplify(graph)
+        assert "start_time" not in simple["defaults"]["migration"]
+        assert [m.get("start_time") for m in simple["migrations"]] == [None, 500, 500]
+        assert parser.parse(simple) == graph
+
+
+class TestMergeEpochs:
+    def graph(self, epochs, start_time=None):
+        data = {"time_units": "generations", "demes": [{"name": "a"}]}
+        if start_time is not None:
+            data["demes"] = [
+                {"name": "x", "epochs": [{"start_size": 1}]},
+                {"name": "a", "ancestors": ["x"], "start_time": start_time},
+            ]
+        data["demes"][-1]["epochs"] = epochs
+        return parser.parse(data)
+
+    def sizes(self, deme, times):
+        return coalescence.SizeHistory(deme).size(times)
+
+    def check_merge(self, graph, expected_epochs):
+        # Merge a copy, and check the sizes are unchanged.
+        merged = copy.deepcopy(graph)
+        num_epochs = sum(len(deme.epochs) for deme in graph.demes.values())
+        removed = normalize.merge_epochs(merged)
+        assert num_epochs - removed == sum(
+            len(deme.epochs) for deme in merged.demes.values()
+        )
+        merged.validate()
+        for name, deme in graph.demes.items():
+            start_time = min(deme.start_time, deme.end_time + 1000)
+            times = np.linspace(deme.end_time, start_time, 101)
+            assert self.sizes(merged.demes[name], times) == pytest.approx(
+                self.sizes(deme, times), rel=1e-9
+            )
+        assert len(merged.demes["a"].epochs) == expected_epochs
+        return merged
+
+    def test_constant(self):
+        graph = self.graph(
+            [
+                {"start_size": 100, "end_time": 300},
+                {"start_size": 100, "end_time": 200},
+                {"start_size": 100, "end_time": 100},
+                {"start_size": 50},
+            ]
+        )
+        merged = self.check_merge(graph, 2)
+        epochs = merged.demes["a"].epochs
+        assert [epoch.end_time for epoch in epochs] == [100, 0]
+        assert [epoch.start_size for epoch in epochs] == [100, 50]
+
+    def test_exponential(self):
+        # An exponential epoch from 1000 to 10 split into pieces.
+        times = [1000, 700, 400, 100, 0]
+        sizes = [1000 * 10 ** (-2 * (1000 - t) / 1000) for t in times]
+        epochs = [
+            {"start_size": sizes[j], "end_size": sizes[j + 1], "end_time": times[j + 1]}
+            for j in range(len(times) - 1)
+        ]
+        graph = self.graph(epochs, start_time=1000)
+        merged = self.check_merge(graph, 1)
+        (epoch,) = merged.demes["a"].epochs
+        assert epoch.start_size == sizes[0]
+        assert epoch.end_size == sizes[-1]
+        assert epoch.end_time == 0
+        assert epoch.size_function == "exponential"
+
+    def test_linear(self):
+        epochs = [
+            {"start_size": 100, "end_size": 200, "end_time": 400},
+            {"end_size": 500, "end_time": 100},
+            {"end_size": 600, "end_time": 0},
+        ]
+        for epoch in epochs:
+            epoch["size_function"] = "linear"
+        graph = self.graph(epochs, start_time=500)
+        merged = self.check_merge(graph, 1)
+        assert merged.demes["a"].epochs[0].size_function == "linear"
+
+    def test_flat_epochs_with_different_size_functions(self):
+        graph = self.graph(
+            [
+                {"start_size": 100, "end_time": 200},
+                {"end_size": 100, "size_function": "exponential", "end_time": 100},
+                {"end_size": 100, "size_function": "linear"},
+            ]
+        )
+        merged = self.check_merge(graph, 1)
+        assert merged.demes["a"].epochs[0].size_function == "constant"
+
+    @pytest.mark.parametrize(
+        "older,younger",
+        [
+            # Different selfing rates.
+            ({"start_size": 100}, {"start_size": 100, "selfing_rate": 0.1}),
+            # Different cloning rates.
+            ({"start_size": 100}, {"start_size": 100, "cloning_rate": 0.1}),
+            # Different constant sizes.
+            ({"start_size": 100}, {"start_size": 200}),
+            # A constant epoch after exponential growth.
+            ({"start_size": 100, "end_size": 400}, {"start_size": 400}),
+            # A discontinuous size.
+            (
+                {"start_size": 100, "end_size": 400},
+                {"start_size": 300, "end_size": 1200},
+            ),
+            # Different growth rates.
+            ({"start_size": 100, "end_size": 400}, {"end_size": 3200}),
+            # Exponential then linear growth.
+            (
+                {"start_size": 100, "end_size": 400},
+                {"end_size": 1600, "size_function": "linear"},
+            ),
+        ],
+    )
+    def test_not_merged(self, older, younger):
+        epochs = [dict(older, end_time=200), dict(younger, end_time=100)]
+        graph = self.graph(epochs, start_time=300)
+        self.check_merge(graph, 2)
+
+    @pytest.mark.parametrize(
+        "path", map(str, pathlib.Path("../examples/").glob("*.yaml"))
+    )
+    def test_examples(self, path):
+        yaml = YAML(typ="safe")
+        with open(path, encoding="utf-8") as source:
+            graph = parser.parse(yaml.load(source))
+        merged = copy.deepcopy(graph)
+        normalize.merge_epochs(merged)
+        merged.validate()
+        for name, deme in graph.demes.items():
+            history = coalescence.SizeHistory(deme)
+            times = [epoch.end_time for epoch in deme.epochs]
+            assert coalescence.SizeHistory(merged.demes[name]).size(
+                times
+            ) == pytest.approx(history.size(times), rel=1e-9)
+
+
+class TestSubgraph:
+    def graph(self):
+        # X is the root, with children A and B. C is an admixture of A and B,
+        # and D has no relation to C, but receives migrants from it.
+        data = {
+            "time_units": "generations",
+            "demes": [
+                {"name": "X", "epochs": [{"start_size": 100, "end_time": 1000}]},
+                {
+                    "name": "A",
+                    "ancestors": ["X"],
+                    "epochs": [
+                        {"start_size": 100, "end_size": 1000, "end_time": 200},
+                        {"start_size": 500},
+                    ],
+                },
+                {"name": "B", "ancestors": ["X"], "epochs": [{"start_size": 200}]},
+                {
+                    "name": "C",
+                    "ancestors": ["A", "B"],
+                    "proportions": [0.5, 0.5],
+                    "start_time": 300,
+                    "epochs": [{"start_size": 300}],
+                },
+                {"name": "D", "epochs": [{"start_size": 400}]},
+                {"name": "E", "epochs": [{"start_size": 400}]},
+            ],
+            "migrations": [
+                {"source": "C", "dest": "D", "rate": 1e-3},
+                {"source": "E", "dest": "A", "rate": 1e-4, "start_time": 500},
+                {"demes": ["A", "B"], "rate": 1e-5, "end_time": 100},
+            ],
+            "pulses": [
+                {"sources": ["D"], "dest": "B", "time": 400, "proportions": [0.1]},
+                {"sources": ["E"], "dest": "C", "time": 50, "proportions": [0.1]},
+            ],
+        }
+        return parser.parse(data)
+
+    def check(self, graph, sub, start_time, end_time):
+        sub.validate()
+        assert parser.parse(sub.as_json_dict()) == sub
+        # The sizes within the window are unchanged.
+        for name, deme in sub.demes.items():
+            original = coalescence.SizeHistory(graph.demes[name])
+            history = coalescence.SizeHistory(deme)
+            start = min(start_time, deme.start_time, deme.end_time + 1000)
+            # The size may be discontinuous at the start of the window.
+            times = np.linspace(deme.end_time, start, 51)[:-1]
+            assert history.size(times) == pytest.approx(original.size(times))
+
+    def test_whole_graph(self):
+        graph = self.graph()
+        sub = subgraph.subgraph(graph)
+        assert sub == graph
+
+    @pytest.mark.parametrize(
+        "demes,expected",
+        [
+            (["C"], ["X", "A", "B", "C", "D", "E"]),
+            # B has a pulse from D, which has migration from C.
+            (["A"], ["X", "A", "B", "C", "D", "E"]),
+            (["B"], ["X", "A", "B", "C", "D", "E"]),
+            (["E"], ["E"]),
+            (["D"], ["X", "A", "B", "C", "D", "E"]),
+            (["X"], ["X"]),
+        ],
+    )
+    def test_ancestry_closure(self, demes, expected):
+        graph = self.graph()
+        sub = subgraph.subgraph(graph, demes)
+        assert list(sub.demes) == expected
+        self.check(graph, sub, math.inf, 0)
+        for migration in sub.migrations:
+            assert migration in graph.migrations
+        for pulse in sub.pulses:
+            assert pulse in graph.pulses
+
+    def test_time_window(self):
+        graph = self.graph()
+        sub = subgraph.subgraph(graph, ["C"], start_time=350, end_time=20)
+        self.check(graph, sub, 350, 20)
+        # A and B start before the window, so they have infinite start times
+        # and no ancestors, and X isn't included. The pulse from D into B is
+        # before the window, so D isn't included either.
+        assert list(sub.demes) == ["A", "B", "C", "E"]
+        a = sub.demes["A"]
+        assert math.isinf(a.start_time)
+        assert a.ancestors == []
+        # The size at the start of the window is held constant before it.
+        assert [epoch.end_time for epoch in a.epochs] == [350, 200, 20]
+        assert a.epochs[0].size_function == "constant"
+        assert a.epochs[0].start_size == pytest.approx(
+            coalescence.SizeHistory(graph.demes["A"]).size(350)
+        )
+        # C starts within the window, so keeps its ancestors.
+        assert [ancestor.name for ancestor in sub.demes["C"].ancestors] == ["A", "B"]
+        assert all(deme.end_time == 20 for deme in sub.demes.values())
+        # The migrations from E to A, and between A and B, start before the
+        # window, so they are extended into the past. The migration into D is
+        # dropped with D.
+        assert [
+            (m.source.name, m.dest.name, m.start_time, m.end_time)
+            for m in sub.migrations
+        ] == [
+            ("E", "A", math.inf, 20),
+            ("A", "B", math.inf, 100),
+            ("B", "A", math.inf, 100),
+        ]
+        # The pulse into B is before the window.
+        assert [pulse.dest.name for pulse in sub.pulses] == ["C"]
+
+    def test_window_at_epoch_boundary(self):
+        # The window starts at the end of A's first epoch, and its second
+        # epoch has a constant size, so is extended into the past.
+        graph = self.graph()
+        sub = subgraph.subgraph(graph, ["A"], start_time=200)
+        self.check(graph, sub, 200, 0)
+        (epoch,) = sub.demes["A"].epochs
+        assert math.isinf(sub.demes["A"].start_time)
+        assert (epoch.start_size, epoch.end_size, epoch.end_time) == (500, 500, 0)
+
+    def test_events_at_window_boundaries(self):
+        graph = self.graph()
+        # The pulse into C at time 50 is at the end of the window.
+        sub = subgraph.subgraph(graph, ["C"], start_time=300, end_time=50)
+        self.check(graph, sub, 300, 50)
+        assert sub.pulses == []
+        # C starts at the start of the window, so it has no ancestors.
+        assert list(sub.demes) == ["C"]
+        assert math.isinf(sub.demes["C"].start_time)
+
+    def test_extractor_reuse(self):
+        graph = self.graph()
+        extractor = subgraph.SubgraphExtractor(graph)
+        for demes in [["C"], ["E"], None]:
+            for start_time, end_time in [(math.inf, 0), (500, 100), (150, 10)]:
+                sub = extractor.extract(demes, start_time, end_time)
+                assert sub == subgraph.subgraph(graph, demes, start_time, end_time)
+                self.check(graph, sub, start_time, end_time)
+
+    @pytest.mark.parametrize(
+        "demes,start_time,end_time",
+        [
+            (["Z"], math.inf, 0),
+            (["X"], 500, 0),
+            (["C"], 400, 300),
+            (None, 100, 100),
+            (None, 100, 200),
+            (None, math.inf, math.inf),
+            (None, 100, -1),
+        ],
+    )
+    def test_bad_arguments(self, demes, start_time, end_time):
+        with pytest.raises(ValueError):
+            subgraph.subgraph(self.graph(), demes, start_time, end_time)
+
+    def test_empty_window(self):
+        # The only deme ends before the window starts.
+        graph = parser.parse(
+            {
+                "time_units": "generations",
+                "demes": [
+                    {"name": "X", "epochs": [{"start_size": 100, "end_time": 500}]}
+                ],
+            }
+        )
+        with pytest.raises(ValueError, match=r"\(100, 0\]"):
+            subgraph.subgraph(graph, None, 100, 0)
+
+    @pytest.mark.parametrize("seed", range(20))
+    def test_random_graphs(self, seed):
+        rng = random.Random(seed)
+        graph = parser.parse(
+            graph_generator.random_graph(rng, num_demes=10, migration_density=0.3)
+        )
+        extractor = subgraph.SubgraphExtractor(graph)
+        for _ in range(10):
+            end_time, start_time = sorted(rng.uniform(0, 4000) for _ in range(2))
+            if rng.random() < 0.2:
+                start_time = math.inf
+            window = parser.Interval(start_time, end_time)
+            names = [
+                name
+                for name, deme in graph.demes.items()
+                if deme.time_interval.intersects(window)
+            ]
+            if len(names) == 0:
+                continue
+            demes = rng.sample(names, rng.randint(1, len(names)))
+            sub = extractor.extract(demes, start_time, end_time)
+            assert set(demes) <= set(sub.demes)
+            self.check(graph, sub, start_time, end_time)
+
+
+class TestEpochSharing:
+    def grid(self):
+        # Three demes with the same epochs, and one with different epochs.
+        data = {
+            "time_units": "generations",
+            "demes": [
+                {
+                    "name": name,
+                    "epochs": [
+                        {"start_size": 1000, "end_time": 100},
+                        {"start_size": 10},
+                    ],
+                }
+                for name in "abc"
+            ]
+            + [
+                {
+                    "name": "d",
+                    "epochs": [
+                        {"start_size": 1000, "end_time": 100},
+                        {"start_size": 20},
+                    ],
+                }
+            ],
+        }
+        return parser.parse(data)
+
+    def test_mixed_types(self):
+        # Equal values of different types aren't shared, as they're output
+        # differently.
+        data = minimal_graph(2)
+        data["demes"][0]["epochs"] = [{"start_size": 1000}]
+        data["demes"][1]["epochs"] = [{"start_size": 1000.0}]
+        graph = parser.parse(data)
+        expected = graph.as_json_dict()
+        stats = flyweight.share_epochs(graph)
+        assert stats.unique_epochs == 2
+        assert stats.unique_sequences == 2
+        assert graph.as_json_dict() == expected
+        assert json.dumps(graph.as_json_dict()) == json.dumps(expected)
+        a, b = graph.demes.values()
+        assert a.epochs[0] == b.epochs[0]
+        assert type(b.epochs[0].start_size) is float
+
+    def test_share(self):
+        graph = self.grid()
+        original = copy.deepcopy(graph)
+        stats = flyweight.share_epochs(graph)
+        assert stats == flyweight.SharingStats(
+            demes=4, epochs=8, unique_epochs=3, unique_sequences=2
+        )
+        a, b, c, d = graph.demes.values()
+        for deme in graph.demes.values():
+            assert isinstance(deme.epochs, flyweight.SharedEpochs)
+        for j in range(2):
+            assert a.epochs.epochs[j] is b.epochs.epochs[j] is c.epochs.epochs[j]
+        # The first epoch of d is the same as the first epoch of a.
+        assert d.epochs.epochs[0] is a.epochs.epochs[0]
+        assert graph == original
+        assert original == graph
+        assert graph.as_json_dict() == original.as_json_dict()
+        assert graph.fingerprint() == original.fingerprint()
+        graph.validate()
+
+    def test_share_twice(self):
+        graph = self.grid()
+        flyweight.share_epochs(graph)
+        a = graph.demes["a"]
+        epochs = a.epochs.epochs
+        stats = flyweight.share_epochs(graph)
+        assert stats.unique_epochs == 3
+        assert a.epochs.epochs == epochs
+
+    def test_read(self):
+        graph = self.grid()
+        flyweight.share_epochs(graph)
+        epochs = graph.demes["a"].epochs
+        assert len(epochs) == 2
+        assert [epoch.end_time for epoch in epochs] == [100, 0]
+        assert epochs[-1].start_size == 10
+        assert epochs[1:] == [epochs[1]]
+        assert isinstance(epochs[1:], list)
+        assert epochs != 1
+        assert epochs != [epochs[0]]
+        assert repr(epochs) == repr(list(epochs))
+        assert graph.demes["a"].end_time == 0
+
+    def test_shared_epoch_is_immutable(self):
+        graph = self.grid()
+        flyweight.share_epochs(graph)
+        epoch = graph.demes["a"].epochs.epochs[0]
+        with pytest.raises(AttributeError, match="shared"):
+            epoch.start_size = 1
+        with pytest.raises(AttributeError, match="shared"):
+            del epoch.start_size
+        assert epoch.start_size == 1000
+        with pytest.raises(TypeError):
+            hash(epoch)
+        assert epoch != 1
+
+    def test_write_epoch(self):
+        graph = self.grid()
+        original = copy.deepcopy(graph)
+        flyweight.share_epochs(graph)
+        a, b = graph.demes["a"], graph.demes["b"]
+        view = a.epochs
+        first, last = view
+        other = view[-1]
+        with pytest.raises(TypeError):
+            hash(first)
+        assert first != 1
+        first.start_size = 2000
+        # The deme has a private list of epochs, to which the write went, and
+        # the other demes are unchanged.
+        assert type(a.epochs) is list
+        assert type(a.epochs[0]) is parser.Epoch
+        assert first.target() is a.epochs[0]
+        assert first.start_size == a.epochs[0].start_size == 2000
+        assert list(view) == view[:] == a.epochs
+        assert b.epochs[0].start_size == 1000
+        assert graph.demes["b"] == original.demes["b"]
+        # References to the same position refer to the same epoch.
+        last.end_size = 20
+        assert other.end_size == a.epochs[1].end_size == 20
+        assert b.epochs[1].end_size == 10
+        del other.size_function
+        assert not hasattr(a.epochs[1], "size_function")
+        # Copies don't refer to the deme.
+        for epoch_copy in [copy.copy(first), pickle.loads(pickle.dumps(first))]:
+            assert type(epoch_copy) is parser.Epoch
+            assert epoch_copy == first
+
+    def test_copy_on_write(self):
+        graph = self.grid()
+        original = copy.deepcopy(graph)
+        flyweight.share_epochs(graph)
+        a, b = graph.demes["a"], graph.demes["b"]
+        a.epochs[1] = parser.Epoch(
+            end_time=0,
+            start_size=10,
+            end_size=20,
+            size_function="exponential",
+            selfing_rate=0,
+            cloning_rate=0,
+        )
+        # The deme has a private list of modifiable epochs, and the other
+        # demes are unchanged.
+        assert type(a.epochs) is list
+        assert type(a.epochs[0]) is parser.Epoch
+        a.epochs[0].start_size = 2000
+        assert b.epochs[0].start_size == 1000
+        assert a.epochs[1].end_size == 20
+        assert b.epochs[1].end_size == 10
+        assert graph.demes["c"] == original.demes["c"]
+        assert graph.demes["b"] == original.demes["b"]
+        assert graph.demes["a"] != original.demes["a"]
+
+    @pytest.mark.parametrize(
+        "mutate",
+        [
+            lambda epochs, epoch: epochs.append(epoch),
+            lambda epochs, epoch: epochs.extend([epoch, epoch]),
+            lambda epochs, epoch: epochs.insert(0, epoch),
+            lambda epochs, epoch: epochs.pop(),
+            lambda epochs, epoch: epochs.reverse(),
+            lambda epochs, epoch: epochs.__delitem__(0),
+            lambda epochs, epoch: epochs.__iadd__([epoch]),
+            lambda epochs, epoch: epochs.clear(),
+        ],
+    )
+    def test_list_mutations(self, mutate):
+        graph = self.grid()
+        flyweight.share_epochs(graph)
+        a, b = graph.demes["a"], graph.demes["b"]
+        shared = b.epochs
+        expected = [copy.copy(epoch) for epoch in a.epochs]
+        epoch = parser.Epoch(0, 1, 1, "constant", 0, 0)
+        mutate(expected, epoch)
+        mutate(a.epochs, epoch)
+        assert type(a.epochs) is list
+        assert a.epochs == expected
+        assert b.epochs is shared
+        assert len(b.epochs) == 2
+
+    def test_add_epoch(self):
+        graph = parser.Graph(
+            time_units="generations",
+            generation_time=None,
+            doi=[],
+            description="",
+            metadata={},
+        )
+        for name in "ab":
+            graph.add_deme(
+                name=name,
+                description="",
+                start_time=math.inf,
+                ancestors=[],
+                proportions=[],
+            ).add_epoch(
+                end_time=100,
+                start_size=1,
+                end_size=1,
+                selfing_rate=0,
+                cloning_rate=0,
+                size_function="constant",
+            )
+        flyweight.share_epochs(graph)
+        a, b = graph.demes["a"], graph.demes["b"]
+        a.add_epoch(
+            end_time=0,
+            start_size=2,
+            end_size=2,
+            selfing_rate=0,
+            cloning_rate=0,
+            size_function="constant",
+        )
+        assert [epoch.end_time for epoch in a.epochs] == [100, 0]
+        assert [epoch.end_time for epoch in b.epochs] == [100]
+
+    def test_unshare(self):
+        graph = self.grid()
+        flyweight.share_epochs(graph)
+        a = graph.demes["a"]
+        flyweight.unshare(a)
+        assert type(a.epochs) is list
+        epochs = a.epochs
+        flyweight.unshare(a)
+        assert a.epochs is epochs
+        normalize.merge_epochs(graph)
+
+    def test_merge_epochs(self):
+        graph = parser.parse(
+            {
+                "time_units": "generations",
+                "demes": [
+                    {
+                        "name": name,
+                        "epochs": [
+                            {"start_size": 1, "end_time": 10},
+                            {"start_size": 1},
+                        ],
+                    }
+                    for name in "ab"
+                ],
+            }
+        )
+        graph.add_deme(
+            name="c", description="", start_time=math.inf, ancestors=[], proportions=[]
+        ).epochs = copy.deepcopy(graph.demes["a"].epochs)
+        expected = copy.deepcopy(graph)
+        flyweight.share_epochs(graph)
+        c = graph.demes["c"]
+        del graph.demes["c"]
+        assert normalize.merge_epochs(graph) == normalize.merge_epochs(expected) - 1
+        del expected.demes["c"]
+        assert graph.as_json_dict() == expected.as_json_dict()
+        # The deme that wasn't merged still has the shared epochs.
+        assert len(c.epochs) == 2
+        assert c.epochs.shared
+        # Both the merged and the shared epochs can be frozen.
+        graph.demes["c"] = c
+        frozen.freeze(graph)
+        assert [len(deme.epochs) for deme in graph.demes.values()] == [1, 1, 2]
+
+    def test_pickle_and_deepcopy(self):
+        graph = self.grid()
+        flyweight.share_epochs(graph)
+        for graph_copy in [copy.deepcopy(graph), pickle.loads(pickle.dumps(graph))]:
+            assert graph_copy == graph
+            a, b = graph_copy.demes["a"], graph_copy.demes["b"]
+            assert a.epochs.epochs[0] is b.epochs.epochs[0]
+            a.epochs.append(parser.Epoch(0, 1, 1, "constant", 0, 0))
+            assert len(b.epochs) == 2
+
+    def test_memory_saved(self):
+        data = {
+            "time_units": "generations",
+            "demes": [
+                {
+                    "name": f"deme{j}",
+                    "epochs": [{"start_size": 100, "end_time": 10}, {"start_size": 1}],
+                }
+                for j in range(200)
+            ],
+        }
+        tracemalloc.start()
+        try:
+            graph = parser.parse(data)
+            gc.collect()
+            before, _ = tracemalloc.get_traced_memory()
+            flyweight.share_epochs(graph)
+            gc.collect()
+            after, _ = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        # Each deme frees a list and two epochs, and gains a SharedEpochs.
+        assert before - after > 200 * 100
+
+    @pytest.mark.parametrize(
+        "yaml_path", map(str, pathlib.Path("../examples/").glob("*.yaml"))
+    )
+    def test_examples(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            data = yaml.load(source)
+        graph = parser.parse(data)
+        original = copy.deepcopy(graph)
+        stats = flyweight.share_epochs(graph)
+        assert stats.epochs == sum(len(d.epochs) for d in graph.demes.values())
+        assert stats.unique_epochs <= stats.epochs
+        assert stats.unique_sequences <= stats.demes
+        assert graph == original
+        assert graph.as_json_dict() == original.as_json_dict()
+
+
+class RecordingObserver(streaming.Observer):
+    def __init__(self):
+        self.events = []
+
+    def deme(self, deme):
+        self.events.append(("deme", deme.name))
+
+    def migration(self, migration):
+        self.events.append(("migration", migration.source.name, migration.dest.name))
+
+    def pulse(self, pulse):
+        self.events.append(("pulse", pulse.time))
+
+    def commit(self, graph):
+        self.events.append(("commit", graph))
+
+    def abort(self, error):
+        self.events.append(("abort", error))
+
+
+class TestStreamingParser:
+    def model(self):
+        return {
+            "time_units": "generations",
+            "defaults": {"epoch": {"start_size": 100}},
+            "demes": [
+                {"name": "a"},
+                {"name": "b", "ancestors": ["a"], "start_time": 100},
+                {"name": "c", "ancestors": ["a"], "start_time": 100},
+                {"name": "d", "ancestors": ["a"], "start_time": 50},
+            ],
+            "migrations": [
+                {"demes": ["b", "d"], "rate": 1e-3},
+                {"source": "b", "dest": "c", "rate": 1e-3},
+            ],
+            "pulses": [
+                {"sources": ["b"], "dest": "c", "time": 10, "proportions": [0.1]},
+                {"sources": ["c"], "dest": "b", "time": 20, "proportions": [0.1]},
+            ],
+        }
+
+    def test_events(self):
+        observer = RecordingObserver()
+        graph = streaming.parse(self.model(), [observer])
+        assert graph == parser.parse(self.model())
+        # Migrations are emitted after the later of their demes, and pulses
+        # after all of the demes, from oldest to youngest.
+        assert observer.events == [
+            ("deme", "a"),
+            ("deme", "b"),
+            ("deme", "c"),
+            ("migration", "b", "c"),
+            ("deme", "d"),
+            ("migration", "b", "d"),
+            ("migration", "d", "b"),
+            ("pulse", 20),
+            ("pulse", 10),
+            ("commit", graph),
+        ]
+
+    def test_entities_are_resolved(self):
+        entities = []
+
+        class Observer(streaming.Observer):
+            def deme(self, deme):
+                entities.append(deme.as_json_dict())
+
+            def migration(self, migration):
+                entities.append(migration.as_json_dict())
+
+        graph = streaming.parse(self.model(), [Observer()])
+        # The entities don't change after they're emitted.
+        for entity in entities:
+            if "name" in entity:
+                assert entity == graph.demes[entity["name"]].as_json_dict()
+            else:
+                assert entity in [m.as_json_dict() for m in graph.migrations]
+
+    def test_observers(self):
+        first = RecordingObserver()
+        second = RecordingObserver()
+        streaming_parser = streaming.StreamingParser([first])
+        streaming_parser.add_observer(second)
+        # An observer that ignores all of the events.
+        streaming_parser.add_observer(streaming.Observer())
+        graph = streaming_parser.parse(self.model())
+        assert first.events == second.events
+        assert first.events[-1] == ("commit", graph)
+        # The parser can be reused.
+        streaming_parser.parse(self.model())
+        assert len(first.events) == 20
+
+    def check_abort(self, data, events):
+        observer = RecordingObserver()
+        with pytest.raises(ValueError) as excinfo:
+            streaming.parse(data, [observer])
+        assert observer.events == events + [("abort", excinfo.value)]
+        # The error is raised by parse() too.
+        with pytest.raises(ValueError):
+            parser.parse(data)
+
+    def test_abort_build(self):
+        data = self.model()
+        data["demes"][1]["colour"] = "red"
+        self.check_abort(data, [])
+
+    def test_abort_generation_time(self):
+        data = self.model()
+        data["time_units"] = "years"
+        self.check_abort(data, [])
+
+    def test_abort_deme(self):
+        data = self.model()
+        data["demes"][2]["proportions"] = [0.5]
+        self.check_abort(data, [("deme", "a"), ("deme", "b")])
+
+    def test_abort_migration(self):
+        data = self.model()
+        data["migrations"][1]["start_time"] = 200
+        self.check_abort(data, [("deme", "a"), ("deme", "b"), ("deme", "c")])
+
+    def test_abort_pulse(self):
+        data = self.model()
+        data["pulses"][0]["time"] = 200
+        self.check_abort(
+            data,
+            [
+                ("deme", "a"),
+                ("deme", "b"),
+                ("deme", "c"),
+                ("migration", "b", "c"),
+                ("deme", "d"),
+                ("migration", "b", "d"),
+                ("migration", "d", "b"),
+            ],
+        )
+
+    @pytest.mark.parametrize(
+        "migration",
+        [
+            # Overlaps the migration from b to c.
+            {"source": "b", "dest": "c", "rate": 1e-3, "end_time": 10},
+            # Too much migration into c.
+            {"source": "d", "dest": "c", "rate": 0.9999},
+        ],
+    )
+    def test_abort_global_checks(self, migration):
+        data = self.model()
+        data["migrations"].append(migration)
+        observer = RecordingObserver()
+        with pytest.raises(ValueError):
+            streaming.parse(data, [observer])
+        # Every entity was emitted before the model was aborted.
+        assert sorted(event[0] for event in observer.events[:-1]) == sorted(
+            ["deme"] * 4 + ["migration"] * 4 + ["pulse"] * 2
+        )
+        assert observer.events[-1][0] == "abort"
+
+    def test_abort_observer_error(self):
+        class Observer(RecordingObserver):
+            def deme(self, deme):
+                super().deme(deme)
+                if deme.name == "b":
+                    raise RuntimeError("out of memory")
+
+        observer = Observer()
+        with pytest.raises(RuntimeError, match="out of memory"):
+            streaming.parse(self.model(), [observer])
+        assert observer.events[:2] == [("deme", "a"), ("deme", "b")]
+        assert observer.events[2][0] == "abort"
+
+    def test_abort_commit_error(self):
+        class Observer(RecordingObserver):
+            def commit(self, graph):
+                super().commit(graph)
+                raise RuntimeError("disk full")
+
+        observers = [RecordingObserver(), Observer(), RecordingObserver()]
+        with pytest.raises(RuntimeError, match="disk full") as error:
+            streaming.parse(self.model(), observers)
+        # Each observer gets either a commit() or an abort().
+        assert [o.events[-1][0] for o in observers] == ["commit", "commit", "abort"]
+        assert observers[2].events[-1][1] is error.value
+        assert [len(o.events) for o in observers] == [len(observers[0].events)] * 3
+
+    @pytest.mark.parametrize(
+        "yaml_path",
+        [
+            str(path)
+            for pattern in ["../examples/*.yaml", "../test-cases/valid/*.yaml"]
+            for path in pathlib.Path(".").glob(pattern)
+        ],
+    )
+    def test_valid_cases(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            data = yaml.load(source)
+        observer = RecordingObserver()
+        graph = streaming.parse(data, [observer])
+        assert graph == parser.parse(data)
+        demes = [event[1] for event in observer.events if event[0] == "deme"]
+        assert demes == list(graph.demes)
+        assert sorted(event[0] for event in observer.events) == sorted(
+            ["deme"] * len(graph.demes)
+            + ["migration"] * len(graph.migrations)
+            + ["pulse"] * len(graph.pulses)
+            + ["commit"]
+        )
+        pulses = [event[1] for event in observer.events if event[0] == "pulse"]
+        assert pulses == [pulse.time for pulse in graph.pulses]
+
+    @pytest.mark.parametrize(
+        "yaml_path",
+        [
+            str(path)
+            for path in pathlib.Path("../test-cases/invalid").glob("*.yaml")
+            if path.name != "invalid_fields_11.yaml"
+        ],
+    )
+    def test_invalid_cases(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            data = yaml.load(source)
+        observer = RecordingObserver()
+        with pytest.raises((ValueError, TypeError, KeyError)):
+            streaming.parse(data, [observer])
+        assert observer.events[-1][0] == "abort"
+        assert "commit" not in [event[0] for event in observer.events]
+
+
+class TestFreeze:
+    def model(self):
+        return {
+            "time_units": "years",
+            "generation_time": 25,
+            "doi": ["https://example.com"],
+            "metadata": {"a": [1, {"b": 2}]},
+            "defaults": {"epoch": {"start_size": 100}},
+            "demes": [
+                {"name": "a"},
+                {
+                    "name": "b",
+                    "ancestors": ["a"],
+                    "start_time": 100,
+                    "epochs": [
+                        {"end_time": 50, "end_size": 200},
+                        {"end_time": 10, "start_size": 20},
+                        {"start_size": 20},
+                    ],
+                },
+            ],
+            "migrations": [{"demes": ["a", "b"], "rate": 1e-3}],
+            "pulses": [
+                {"sources": ["a"], "dest": "b", "time": 20, "proportions": [0.1]}
+            ],
+        }
+
+    def test_equal(self):
+        graph = parser.parse(self.model())
+        frozen_graph = frozen.freeze(parser.parse(self.model()))
+        assert isinstance(frozen_graph, frozen.FrozenGraph)
+        assert isinstance(frozen_graph, parser.Graph)
+        assert frozen_graph == graph
+        assert graph == frozen_graph
+        assert frozen_graph.as_json_dict() == graph.as_json_dict()
+        assert type(frozen_graph.as_json_dict()["metadata"]["a"]) is list
+        assert frozen_graph.fingerprint() == graph.fingerprint()
+        assert str(frozen_graph) == str(graph)
+        frozen_graph.validate()
+        assert frozen.freeze(frozen_graph) is frozen_graph
+
+    def test_derived_properties(self):
+        graph = frozen.freeze(parser.parse(self.model()))
+        b = graph.demes["b"]
+        assert b.end_time == 0
+        assert b.time_interval == parser.Interval(100, 0)
+        assert b.time_interval is b.time_interval
+        assert b.epoch_start_times == [100, 50, 10]
+        np.testing.assert_array_equal(b.boundaries, [100, 50, 10, 0])
+        assert not b.boundaries.flags.writeable
+        migration = graph.migrations[0]
+        assert migration.time_interval == parser.Interval(100, 0)
+        assert migration.time_interval is migration.time_interval
+        assert parser.Interval(100, 0) == migration.time_interval
+        assert migration.time_interval != (100, 0)
+        assert hash(migration.time_interval) == hash(b.time_interval)
+        assert migration.time_interval.is_subinterval(parser.Interval(200, 0))
+        assert parser.Interval(200, 0).is_subinterval(b.time_interval) is False
+        assert b.time_interval.intersects(parser.Interval(200, 50))
+
+    @pytest.mark.parametrize(
+        "modify",
+        [
+            lambda graph: setattr(graph, "description", "x"),
+            lambda graph: delattr(graph, "description"),
+            lambda graph: graph.doi.append("x"),
+            lambda graph: graph.metadata.update(x=1),
+            lambda graph: graph.metadata["a"][1].pop("b"),
+            lambda graph: graph.metadata["a"].__setitem__(0, 2),
+            lambda graph: graph.demes.pop("a"),
+            lambda graph: graph.add_deme("c", "", math.inf, [], []),
+            lambda graph: graph.add_migration(
+                rate=0, start_time=None, end_time=None, source="a", dest="b"
+            ),
+            lambda graph: graph.add_pulse(["a"], "b", 1, [0.1]),
+            lambda graph: graph.resolve(),
+            lambda graph: graph.migrations.clear(),
+            lambda graph: graph.pulses.sort(),
+            lambda graph: setattr(graph.demes["a"], "start_time", 1),
+            lambda graph: graph.demes["a"].epochs.append(None),
+            lambda graph: graph.demes["b"].proportions.__iadd__([1]),
+            lambda graph: graph.demes["b"].ancestors.__delitem__(0),
+            lambda graph: graph.demes["a"].add_epoch(0, 1, 1, 0, 0, "constant"),
+            lambda graph: setattr(graph.demes["a"].epochs[0], "start_size", 1),
+            lambda graph: graph.demes["a"].epochs[0].resolve(),
+            lambda graph: setattr(graph.migrations[0], "rate", 0),
+            lambda graph: graph.migrations[0].resolve(),
+            lambda graph: setattr(graph.pulses[0], "time", 1),
+            lambda graph: graph.pulses[0].proportions.reverse(),
+            lambda graph: setattr(graph.demes["a"].time_interval, "end_time", 5),
+            lambda graph: delattr(graph.demes["b"].time_interval, "start_time"),
+            lambda graph: setattr(graph.migrations[0].time_interval, "end_time", 5),
+        ],
+    )
+    def test_immutable(self, modify):
+        graph = frozen.freeze(parser.parse(self.model()))
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            modify(graph)
+        assert graph == parser.parse(self.model())
+
+    def test_hash(self):
+        graphs = [
+            frozen.freeze(parser.parse(self.model())),
+            frozen.freeze(parser.parse(self.model())),
+        ]
+        model = self.model()
+        model["demes"][1]["epochs"][0]["end_size"] = 300
+        graphs.append(frozen.freeze(parser.parse(model)))
+        assert graphs[0] is not graphs[1]
+        assert hash(graphs[0]) == hash(graphs[1])
+        assert len({graphs[0], graphs[1]}) == 1
+        assert len(set(graphs)) == 2
+        a, b, _ = graphs
+        for name in ["a", "b"]:
+            assert hash(a.demes[name]) == hash(b.demes[name])
+            assert hash(a.demes[name].epochs[0]) == hash(b.demes[name].epochs[0])
+        assert hash(a.migrations[1]) == hash(b.migrations[1])
+        assert hash(a.pulses[0]) == hash(b.pulses[0])
+        assert hash(a.doi) == hash(tuple(a.doi))
+        assert a.demes["a"].epochs[0] == b.demes["a"].epochs[0]
+        assert a.demes["a"].epochs[0] != b.demes["b"].epochs[0]
+        assert a.demes["a"].epochs[0] != 1
+
+    def test_copy_and_pickle(self):
+        graph = frozen.freeze(parser.parse(self.model()))
+        assert copy.copy(graph) is graph
+        assert copy.deepcopy(graph) is graph
+        assert copy.copy(graph.demes) is graph.demes
+        assert copy.deepcopy(graph.demes) is graph.demes
+        assert copy.copy(graph.migrations) is graph.migrations
+        assert copy.deepcopy(graph.migrations) is graph.migrations
+        assert copy.deepcopy(graph.demes["a"].epochs[0]) is graph.demes["a"].epochs[0]
+        graph_copy = pickle.loads(pickle.dumps(graph))
+        assert isinstance(graph_copy, frozen.FrozenGraph)
+        assert graph_copy == graph
+        assert hash(graph_copy) == hash(graph)
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            graph_copy.demes["b"].proportions.append(1)
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            graph_copy.metadata["x"] = 1
+
+    def test_shared_epochs(self):
+        graph = parser.parse(self.model())
+        original = copy.deepcopy(graph)
+        flyweight.share_epochs(graph)
+        frozen.freeze(graph)
+        assert graph == original
+        assert type(graph.demes["a"].epochs) is frozen.FrozenList
+        with pytest.raises(dataclasses.FrozenInstanceError):
+            graph.demes["b"].epochs[1].end_time = 0
+
+    def test_threads(self):
+        graph = frozen.freeze(parser.parse(self.model()))
+        expected = graph.as_json_dict()
+        with concurrent.futures.ThreadPoolExecutor(4) as executor:
+            results = list(executor.map(lambda _: graph.as_json_dict(), range(20)))
+        assert all(result == expected for result in results)
+
+    @pytest.mark.parametrize(
+        "yaml_path", map(str, pathlib.Path("../examples/").glob("*.yaml"))
+    )
+    def test_examples(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            data = yaml.load(source)
+        graph = parser.parse(data)
+        frozen_graph = frozen.freeze(parser.parse(data))
+        assert frozen_graph == graph
+        assert frozen_graph.as_json_dict() == graph.as_json_dict()
+        for name, deme in graph.demes.items():
+            frozen_deme = frozen_graph.demes[name]
+            assert frozen_deme.time_interval == deme.time_interval
+            assert list(frozen_deme.boundaries[1:]) == [
+                epoch.end_time for epoch in deme.epochs
+            ]
+
+
+def columnar_worker(handle):
+    # Run in a worker process by TestColumnar.
+    with columnar.attach(handle) as view:
+        return (
+            view.deme_names,
+            float(view.epochs("b")["start_size"].sum()),
+            (view.to_graph().as_json_dict()),
+        )
+
+
+class TestColumnar:
+    def model(self):
+        return {
+            "time_units": "years",
+            "generation_time": 25,
+            "description": "ünïcode",
+            "doi": ["https://example.com/1", "https://example.com/2"],
+            "metadata": {"x": [1, {"y": "z"}]},
+            "demes": [
+                {"name": "a", "epochs": [{"start_size": 100}]},
+                {
+                    "name": "b",
+                    "description": "b deme",
+                    "ancestors": ["a"],
+                    "start_time": 1000,
+                    "epochs": [
+                        {"end_time": 500, "start_size": 10, "end_size": 20},
+                        {"start_size": 30, "selfing_rate": 0.1, "cloning_rate": 0.2},
+                    ],
+                },
+                {
+                    "name": "c",
+                    "ancestors": ["a", "b"],
+                    "proportions": [0.25, 0.75],
+                    "start_time": 100,
+                    "epochs": [{"start_size": 5, "end_size": 50}],
+                },
+            ],
+            "migrations": [{"demes": ["a", "b"], "rate": 1e-3}],
+            "pulses": [
+                {
+                    "sources": ["a", "b"],
+                    "dest": "c",
+                    "time": 50,
+                    "proportions": [0.1, 0.2],
+                }
+            ],
+        }
+
+    def test_columns(self):
+        graph = parser.parse(self.model())
+        columns = columnar.to_columns(graph)
+        np.testing.assert_array_equal(columns["deme_epochs"], [0, 1, 3, 4])
+        np.testing.assert_array_equal(columns["deme_ancestors"], [0, 0, 1, 3])
+        np.testing.assert_array_equal(columns["ancestor_deme"], [0, 0, 1])
+        np.testing.assert_array_equal(columns["ancestor_proportion"], [1, 0.25, 0.75])
+        np.testing.assert_array_equal(columns["epoch_end_time"], [0, 500, 0, 0])
+        np.testing.assert_array_equal(columns["migration_source"], [0, 1])
+        np.testing.assert_array_equal(columns["migration_dest"], [1, 0])
+        np.testing.assert_array_equal(columns["pulse_sources"], [0, 2])
+        np.testing.assert_array_equal(columns["pulse_source"], [0, 1])
+        assert all(array.ndim == 1 for array in columns.values())
+
+    def test_view(self):
+        graph = parser.parse(self.model())
+        view = columnar.GraphView(columnar.to_columns(graph))
+        assert view.time_units == "years"
+        assert view.generation_time == 25
+        assert view.description == "ünïcode"
+        assert view.doi == graph.doi
+        assert view.metadata == graph.metadata
+        assert view.deme_names == ["a", "b", "c"]
+        epochs = view.epochs("b")
+        np.testing.assert_array_equal(epochs["end_time"], [500, 0])
+        np.testing.assert_array_equal(epochs["start_size"], [10, 30])
+        np.testing.assert_array_equal(epochs["cloning_rate"], [0, 0.2])
+        assert [view.strings[j] for j in epochs["size_function"]] == [
+            "exponential",
+            "constant",
+        ]
+        graph_copy = view.to_graph()
+        assert graph_copy == graph
+        assert graph_copy.as_json_dict() == graph.as_json_dict()
+        graph_copy.validate()
+
+    def test_view_tables(self):
+        graph = parser.parse(self.model())
+        columns = columnar.to_columns(graph)
+        view = columnar.GraphView(columns)
+        demes = view.demes()
+        np.testing.assert_array_equal(demes["start_time"], [np.inf, 1000, 100])
+        np.testing.assert_array_equal(demes["epochs"], [0, 1, 3, 4])
+        ancestors = view.ancestors("c")
+        np.testing.assert_array_equal(ancestors["deme"], [0, 1])
+        np.testing.assert_array_equal(ancestors["proportion"], [0.25, 0.75])
+        assert len(view.ancestors("a")["deme"]) == 0
+        migrations = view.migrations()
+        np.testing.assert_array_equal(migrations["rate"], [1e-3, 1e-3])
+        np.testing.assert_array_equal(migrations["source"], [0, 1])
+        pulses = view.pulses()
+        np.testing.assert_array_equal(pulses["time"], [50])
+        np.testing.assert_array_equal(pulses["dest"], [2])
+        sources = view.pulse_sources(0)
+        np.testing.assert_array_equal(sources["source"], [0, 1])
+        np.testing.assert_array_equal(sources["proportion"], [0.1, 0.2])
+        # Every table is a view of the columns, not a copy.
+        tables = [demes, ancestors, migrations, pulses, sources, view.epochs("b")]
+        for table in tables:
+            for array in table.values():
+                assert any(np.shares_memory(array, c) for c in columns.values())
+
+    def test_shared(self):
+        graph = parser.parse(self.model())
+        with columnar.SharedGraph(graph) as shared:
+            handle = pickle.loads(pickle.dumps(shared.handle))
+            assert handle == shared.handle
+            with columnar.attach(handle) as view:
+                assert view.to_graph() == graph
+                start_size = view.epochs("b")["start_size"]
+                assert not start_size.flags.writeable
+                with pytest.raises(ValueError):
+                    start_size[0] = 1
+                del start_size
+                # A second view of the same memory.
+                with columnar.attach(handle) as other:
+                    assert other.deme_names == view.deme_names
+
+    def test_shared_empty(self):
+        graph = parser.parse(minimal_graph())
+        with columnar.SharedGraph(graph) as shared:
+            with columnar.attach(shared.handle) as view:
+                assert view.to_graph() == graph
+
+    def test_worker_processes(self):
+        graph = parser.parse(self.model())
+        context = multiprocessing.get_context("spawn")
+        with columnar.SharedGraph(graph) as shared:
+            with concurrent.futures.ProcessPoolExecutor(
+                2, mp_context=context
+            ) as executor:
+                results = list(executor.map(columnar_worker, [shared.handle] * 4))
+            # The workers don't unlink the block when they exit.
+            with columnar.attach(shared.handle) as view:
+                assert view.to_graph() == graph
+        for names, start_size, data in results:
+            assert names == ["a", "b", "c"]
+            assert start_size == 40
+            assert parser.parse(data) == graph
+
+    def test_attach_is_thread_safe(self, monkeypatch):
+        # Only the attaching thread skips the registration of blocks with the
+        # resource tracker. A block created by another thread while a block is
+        # being attached is registered as usual.
+        from multiprocessing import shared_memory
+
+        graph = parser.parse(self.model())
+        with columnar.SharedGraph(graph) as shared:
+            # Install the replacement register().
+            columnar.attach(shared.handle).close()
+            register = columnar._tracker_register
+            registered = []
+
+            def record(name, rtype):
+                registered.append(name)
+                register(name, rtype)
+
+            monkeypatch.setattr(columnar, "_tracker_register", record)
+            original = shared_memory.SharedMemory
+            created = []
+
+            def create():
+                created.append(original(create=True, size=8))
+
+            class SharedMemory(original):
+                def __init__(self, *args, **kwargs):
+                    thread = threading.Thread(target=create)
+                    thread.start()
+                    thread.join()
+                    super().__init__(*args, **kwargs)
+
+            monkeypatch.setattr(shared_memory, "SharedMemory", SharedMemory)
+            with columnar.attach(shared.handle) as view:
+                assert view.to_graph() == graph
+            (block,) = created
+            block.close()
+            block.unlink()
+        assert registered == [block._name]
+
+    def test_resource_tracker(self):
+        # The resource tracker doesn't report leaked or unknown blocks, when
+        # the creator and its workers attach to the block, and doesn't unlink
+        # the block when a worker exits. This is run in a new interpreter, so
+        # that the tracker's output can be checked.
+        script = """
+import concurrent.futures, multiprocessing
+import columnar, demes_parser as parser
+import tests
+
+if __name__ == "__main__":
+    graph = parser.parse(tests.TestColumnar().model())
+    context = multiprocessing.get_context("spawn")
+    with columnar.SharedGraph(graph) as shared:
+        with concurrent.futures.ProcessPoolExecutor(
+            2, mp_context=context
+        ) as executor:
+            list(executor.map(tests.columnar_worker, [shared.handle] * 4))
+        with columnar.attach(shared.handle) as view:
+            assert view.to_graph() == graph
+    print("done")
+"""
+        result = subprocess.run(
+            [sys.executable, "-c", script],
+            capture_output=True,
+            text=True,
+            timeout=120,
+        )
+        assert result.stdout == "done\n"
+        assert result.stderr == ""
+
+    def test_attach_python_3_13(self, monkeypatch):
+        # From Python 3.13, the block isn't registered with the resource
+        # tracker when it's attached.
+        from multiprocessing import shared_memory
+
+        calls = []
+
+        class SharedMemory:
+            def __init__(self, name, track=True):
+                calls.append((name, track))
+
+        monkeypatch.setattr(sys, "version_info", (3, 13))
+        monkeypatch.setattr(shared_memory, "SharedMemory", SharedMemory)
+        columnar.attach_shared_memory("x")
+        assert calls == [("x", False)]
+
+    @pytest.mark.parametrize(
+        "yaml_path",
+        [
+            str(path)
+            for pattern in ["../examples/*.yaml", "../test-cases/valid/*.yaml"]
+            for path in pathlib.Path(".").glob(pattern)
+        ],
+    )
+    def test_valid_cases(self, yaml_path):
+        yaml = YAML(typ="safe")
+        with open(yaml_path, encoding="utf-8") as source:
+            data = yaml.load(source)
+        graph = parser.parse(data)
+        assert columnar.GraphView(columnar.to_columns(graph)).to_graph() == graph
+        assert pickle.loads(pickle.dumps(graph)) == graph
+        frozen_graph = frozen.freeze(parser.parse(data))
+        assert pickle.loads(pickle.dumps(frozen_graph)) == graph
+
 
 @pytest.mark.parametrize(
     "yaml_path", map(str, pathlib.Path("../examples/").glob("*.yaml"))
@@ -0,0 +1,214 @@
+# A timeline of the events in a resolved Demes Graph.
+#
+# Many consumers of a Graph step through time, and at each step need to know
+# which demes exist, which of their epochs is active, and which migrations
+# are ongoing. The times at which any of these change are the deme start
+# times, epoch end times (which include the deme end times), migration start
+# and end times, and pulse times. Between two consecutive event times nothing
+# changes, so the Timeline splits time into intervals at the event times, and
+# gives a snapshot of the state of the graph for each interval, by index, or by
+# time using bisection.
+#
+# Storing every snapshot would take space proportional to the number of
+# entities times the number of intervals, as a long-lived deme or migration is
+# in every snapshot. Instead, each epoch and migration is stored in a segment
+# tree over the snapshot indexes, in the O(log n) nodes that cover its range
+# of snapshots, and a snapshot is built when it's requested, from the nodes on
+# the path from its leaf to the root. Building the timeline takes
+# O(E log E) time and space for E entities, and building a snapshot takes
+# O(log E + k) time, where k is the number of entities in the snapshot (plus
+# the time to sort them, which is close to linear as each node's entities are
+# already in order).
+from __future__ import annotations
+
+import bisect
+import collections
+import dataclasses
+import math
+from typing import Dict, List
+
+import demes_parser as parser
+
+
+@dataclasses.dataclass
+class ActiveEpoch:
+    """
+    An epoch of a deme, with the times over which it is active and the
+    parameters of its size function.
+    """
+
+    deme: str
+    index: int
+    start_time: float
+    end_time: float
+    start_size: float
+    end_size: float
+    size_function: str
+    selfing_rate: float
+    cloning_rate: float
+
+    def size_at(self, time: float) -> float:
+        """
+        Return the deme's size at the given time, which must be within the
+        epoch's time interval (start_time, end_time].
+        """
+        if time not in parser.Interval(self.start_time, self.end_time):
+            raise ValueError(
+                f"time {time} is not within the epoch's time interval "
+                f"({self.start_time}, {self.end_time}]"
+            )
+        if self.size_function == "constant":
+            return self.start_size
+        # The fraction of the epoch that has elapsed, forwards in time.
+        dt = (self.start_time - time) / (self.start_time - self.end_time)
+        if self.size_function == "exponential":
+            r = math.log(self.end_size / self.start_size)
+            return self.start_size * math.exp(r * dt)
+        assert self.size_function == "linear"
+        return self.start_size + (self.end_size - self.start_size) * dt
+
+
+@dataclasses.dataclass
+class Snapshot:
+    """
+    The state of the graph during the time interval (start_time, end_time].
+    """
+
+    index: int
+    start_time: float
+    end_time: float
+    # The names of the demes that exist, in the order of Graph.demes.
+    demes: List[str]
+    # The active epoch of each of the demes.
+    epochs: Dict[str, ActiveEpoch]
+    # The migrations that occur, in the order of Graph.migrations.
+    migrations: List[parser.Migration]
+    # The pulses at end_time, in the order that they are applied.
+    pulses: List[parser.Pulse]
+
+    def __contains__(self, time):
+        return self.start_time > time >= self.end_time
+
+
+class Timeline:
+    """
+    The snapshots of a resolved graph, from oldest to youngest. Each
+    snapshot is built when it is requested, so the snapshots returned for the
+    same index are equal, but aren't the same object.
+
+    The first snapshot starts at infinity and the last ends at time zero, so
+    together they cover every time at which the graph can be queried.
+    """
+
+    def __init__(self, graph: parser.Graph):
+        event_times = {0}
+        for deme in graph.demes.values():
+            event_times.add(deme.start_time)
+            event_times.update(epoch.end_time for epoch in deme.epochs)
+        for migration in graph.migrations:
+            event_times.add(migration.start_time)
+            event_times.add(migration.end_time)
+        event_times.update(pulse.time for pulse in graph.pulses)
+        event_times.discard(math.inf)
+        # The end times of the snapshots, from oldest to youngest.
+        self.times: List[float] = sorted(event_times, reverse=True)
+        self._index = {time: j for j, time in enumerate(self.times)}
+
+        # The epochs and migrations, in the order of their snapshot lists,
+        # with the epochs first, in the order of the demes.
+        self._entities: List[object] = []
+        # The entities in each node of the segment tree, by their index in
+        # self._entities. Node 1 is the root, and leaf j is node len(times) + j.
+        self._nodes: Dict[int, List[int]] = collections.defaultdict(list)
+        for deme in graph.demes.values():
+            start_time = deme.start_time
+            for k, epoch in enumerate(deme.epochs):
+                active_epoch = ActiveEpoch(
+                    deme=deme.name,
+                    index=k,
+                    start_time=start_time,
+                    end_time=epoch.end_time,
+                    start_size=epoch.start_size,
+                    end_size=epoch.end_size,
+                    size_function=epoch.size_function,
+                    selfing_rate=epoch.selfing_rate,
+                    cloning_rate=epoch.cloning_rate,
+                )
+                self._add(active_epoch, start_time, epoch.end_time)
+                start_time = epoch.end_time
+        self._num_epochs = len(self._entities)
+        for migration in graph.migrations:
+            self._add(migration, migration.start_time, migration.end_time)
+        self._pulses: Dict[int, List[parser.Pulse]] = collections.defaultdict(list)
+        for pulse in graph.pulses:
+            self._pulses[self._index[pulse.time]].append(pulse)
+        # Event times in increasing order, for use with the bisect module.
+        self._ascending_times = self.times[::-1]
+
+    def _add(self, entity, start_time, end_time):
+        # Add the entity to the nodes that cover the snapshots within its time
+        # interval, which are found from the snapshot indexes of its start and
+        # end times.
+        j = len(self._entities)
+        self._entities.append(entity)
+        n = len(self.times)
+        first = 0 if math.isinf(start_time) else self._index[start_time] + 1
+        lo = first + n
+        hi = self._index[end_time] + 1 + n
+        while lo < hi:
+            if lo & 1:
+                self._nodes[lo].append(j)
+                lo += 1
+            if hi & 1:
+                hi -= 1
+                self._nodes[hi].append(j)
+            lo >>= 1
+            hi >>= 1
+
+    def snapshot(self, index: int) -> Snapshot:
+        """Return the snapshot with the given index."""
+        j = range(len(self.times))[index]
+        ids = []
+        node = j + len(self.times)
+        while node >= 1:
+            ids.extend(self._nodes.get(node, ()))
+            node >>= 1
+        ids.sort()
+        split = bisect.bisect_left(ids, self._num_epochs)
+        epochs = {}
+        for k in ids[:split]:
+            epoch = self._entities[k]
+            epochs[epoch.deme] = epoch
+        return Snapshot(
+            index=j,
+            start_time=self.times[j - 1] if j > 0 else math.inf,
+            end_time=self.times[j],
+            demes=list(epochs),
+            epochs=epochs,
+            migrations=[self._entities[k] for k in ids[split:]],
+            pulses=list(self._pulses.get(j, ())),
+        )
+
+    def __len__(self):
+        return len(self.times)
+
+    def __iter__(self):
+        return (self.snapshot(j) for j in range(len(self.times)))
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.snapshot(j) for j in range(len(self.times))[index]]
+        return self.snapshot(index)
+
+    def index_at(self, time: float) -> int:
+        """Return the index of the snapshot whose interval contains the time."""
+        if not 0 <= time < math.inf:
+            raise ValueError(f"time {time} is not within the interval (inf, 0]")
+        # The number of event times <= time is at least 1, because 0 is
+        # always an event time.
+        k = bisect.bisect_right(self._ascending_times, time)
+        return len(self.times) - k
+
+    def snapshot_at(self, time: float) -> Snapshot:
+        """Return the snapshot whose interval contains the time."""
+        return self.snapshot(self.index_at(time))